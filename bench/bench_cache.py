@@ -0,0 +1,317 @@
+'''
+Persistent store of parsed bench files.
+
+Bench files never change once they have been uploaded, so the data points
+parsed from them can be reused across runs of bench_graph_svg.py. A
+RevisionStore keeps the list of bench files in a directory along with
+their parse results, keyed by each bench file's name, size and
+modification time together with everything else that affects parsing.
+'''
+import cPickle
+import hashlib
+import os
+import re
+import time
+
+# Bump whenever bench_util.parse output changes, to invalidate old entries.
+CACHE_VERSION = 4
+
+# Size of the store's data file past which it is trimmed.
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Fraction of max_bytes that a trimmed store is cut down to, so that the
+# next few runs do not each rewrite it again.
+TRIM_FRACTION = 0.75
+# A result's last-used stamp is written again once it is this many seconds
+# old, so that reusing results only rarely grows the index.
+STAMP_RESOLUTION = 3600
+
+# Default revision store location relative to the bench directory.
+STORE_DIR_SUFFIX = '.revision_store'
+# Bump whenever the layout of the index records changes.
+STORE_FORMAT = 2
+# First line of the store's index; a store with any other is started over.
+STORE_MAGIC = 'skia-bench-store %d.%d' % (CACHE_VERSION, STORE_FORMAT)
+STORE_INDEX = 'index'
+# Number of tab separated fields of each kind of index record.
+RECORD_FIELDS = {'F': 4, 'R': 2, 'D': 2, 'P': 9}
+STORE_DATA = 'data'
+
+# Bench file names and the revision and scalar type they hold.
+BENCH_FILE_RE = re.compile('bench_r(\d+)_(\S+)')
+
+# Directory listings younger than this many seconds are not trusted to be
+# complete, since files added within the same mtime tick would go unseen.
+LISTING_MIN_AGE = 2
+
+def default_store_dir(bench_directory):
+    """Returns the revision store directory for the given bench directory."""
+    return os.path.normpath(os.path.abspath(bench_directory)) + STORE_DIR_SUFFIX
+
+class RevisionStore:
+    """Persistent store of the bench files of one directory and their parse
+    results, so each run only lists and parses what is new.
+
+    The index is a text file of tab separated records, only ever appended to:
+      F name revision scalar   a bench file in the directory
+      R name                   a bench file that was removed
+      D mtime                  the directory's mtime when last listed
+      P name size mtime extra offset length sha1 stamp
+                               a parse result in the data file, last used
+                               at time stamp
+    The data file holds the pickled parse results back to back. Results are
+    written before the index record pointing to them, a torn last index line
+    is ignored, and the next run terminates it before appending, so an
+    interrupted run loses at most its own results.
+
+    The directory is listed again only when its mtime changes, and only new
+    file names are matched. Stored results are checked against the bench
+    file's size and mtime, everything else that affects parsing and a sha1
+    of the data. Results are stamped with the time of the run that last used
+    them; a later P record for the same key replaces the earlier one. Once
+    the data file is larger than max_bytes, trim() rewrites the store with
+    the most recently used results that fit in TRIM_FRACTION of max_bytes.
+
+    All failures to read or write the store are ignored; the store only ever
+    saves work.
+
+    (str, str, int)"""
+    def __init__(self, bench_directory, store_dir=None,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.bench_directory = bench_directory
+        self.store_dir = store_dir or default_store_dir(bench_directory)
+        self.max_bytes = max_bytes
+        self.files = {}  # {name: (revision, scalar)}
+        # {(name, size, mtime, extra digest): (offset, length, sha1, stamp)}
+        self.entries = {}
+        self.directory_mtime = None
+        self.now = int(time.time())  # the stamp of results used by this run
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.store_dir, name)
+
+    def _load(self):
+        try:
+            index_file = open(self._path(STORE_INDEX), 'rb')
+            try:
+                lines = index_file.read().split('\n')
+            finally:
+                index_file.close()
+        except IOError:
+            return
+        if not lines or lines[0] != STORE_MAGIC:
+            return
+        # The last element is either empty or a torn record. Records torn
+        # by earlier runs and terminated by later ones have the wrong number
+        # of fields or fields of the wrong form, and are skipped as well.
+        for line in lines[1:-1]:
+            fields = line.split('\t')
+            if len(fields) != RECORD_FIELDS.get(fields[0]):
+                continue
+            try:
+                if fields[0] == 'F':
+                    match = BENCH_FILE_RE.match(fields[1])
+                    if (match is None or
+                        match.groups() != (fields[2], fields[3])):
+                        continue
+                    self.files[fields[1]] = (int(fields[2]), fields[3])
+                elif fields[0] == 'R':
+                    self.files.pop(fields[1], None)
+                elif fields[0] == 'D':
+                    self.directory_mtime = fields[1]
+                elif fields[0] == 'P':
+                    if len(fields[4]) != 40 or len(fields[7]) != 40:
+                        continue
+                    key = (fields[1], int(fields[2]), fields[3], fields[4])
+                    self.entries[key] = (int(fields[5]), int(fields[6]),
+                                         fields[7], int(fields[8]))
+            except (IndexError, ValueError):
+                continue
+
+    def _append_index(self, records):
+        """Appends the records, each a tuple of fields, to the index."""
+        text = ''.join('\t'.join(map(str, record)) + '\n'
+                       for record in records)
+        try:
+            if not os.path.isdir(self.store_dir):
+                os.makedirs(self.store_dir)
+            index_file = open(self._path(STORE_INDEX), 'a+b')
+            try:
+                index_file.seek(0, 2)
+                if index_file.tell() == 0:
+                    text = STORE_MAGIC + '\n' + text
+                else:
+                    # Terminate a record torn by an interrupted run, so it
+                    # is not joined with the first of ours.
+                    index_file.seek(-1, 2)
+                    if index_file.read(1) != '\n':
+                        text = '\n' + text
+                    index_file.seek(0, 2)
+                index_file.write(text)
+            finally:
+                index_file.close()
+        except (IOError, OSError):
+            pass
+
+    def refresh(self):
+        """Brings the list of bench files up to date with the directory."""
+        try:
+            mtime = os.stat(self.bench_directory).st_mtime
+        except OSError:
+            return
+        if repr(mtime) == self.directory_mtime:
+            return
+        names = set(os.listdir(self.bench_directory))
+        records = []
+        for name in sorted(self.files):
+            if name not in names:
+                del self.files[name]
+                records.append(('R', name))
+        for name in sorted(names):
+            if name in self.files:
+                continue
+            match = BENCH_FILE_RE.match(name)
+            if match is None or '\t' in name or '\n' in name:
+                continue
+            self.files[name] = (int(match.group(1)), match.group(2))
+            records.append(('F', name) + self.files[name])
+        if time.time() - mtime > LISTING_MIN_AGE:
+            self.directory_mtime = repr(mtime)
+            records.append(('D', self.directory_mtime))
+        if records:
+            self._append_index(records)
+
+    def latest_revision(self):
+        """Returns the latest revision of the bench files, or None."""
+        if not self.files:
+            return None
+        return max(revision for revision, _ in self.files.itervalues())
+
+    def bench_files(self, oldest_revision, newest_revision):
+        """Returns [(revision, scalar_type, path)] of the bench files within
+        the revision range, ordered by file name."""
+        return [(revision, scalar, self.bench_directory + '/' + name)
+                for name, (revision, scalar) in sorted(self.files.iteritems())
+                if oldest_revision <= revision <= newest_revision]
+
+    def _key(self, path, extra):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (os.path.basename(path), stat.st_size, repr(stat.st_mtime),
+                hashlib.sha1(repr(extra)).hexdigest())
+
+    def get(self, path, extra):
+        """Returns the value stored for the bench file at path, or None."""
+        key = self._key(path, extra)
+        if key is None or key not in self.entries:
+            return None
+        offset, length, digest, stamp = self.entries[key]
+        try:
+            data_file = open(self._path(STORE_DATA), 'rb')
+            try:
+                data_file.seek(offset)
+                payload = data_file.read(length)
+            finally:
+                data_file.close()
+        except IOError:
+            return None
+        if hashlib.sha1(payload).hexdigest() != digest:
+            del self.entries[key]
+            return None
+        try:
+            value = cPickle.loads(payload)
+        except Exception:
+            del self.entries[key]
+            return None
+        self.entries[key] = (offset, length, digest, self.now)
+        if self.now - stamp >= STAMP_RESOLUTION:
+            self._append_index([('P',) + key + self.entries[key]])
+        return value
+
+    def put(self, path, extra, value):
+        """Stores value for the bench file at path."""
+        key = self._key(path, extra)
+        if key is None:
+            return
+        payload = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        try:
+            if not os.path.isdir(self.store_dir):
+                os.makedirs(self.store_dir)
+            data_file = open(self._path(STORE_DATA), 'ab')
+            try:
+                data_file.write(payload)
+                data_file.flush()
+                # the end of our own write, even if another run appended.
+                offset = data_file.tell() - len(payload)
+            finally:
+                data_file.close()
+        except (IOError, OSError):
+            return
+        entry = (offset, len(payload), hashlib.sha1(payload).hexdigest(),
+                 self.now)
+        self.entries[key] = entry
+        self._append_index([('P',) + key + entry])
+
+    def trim(self):
+        """Rewrites the store with the most recently used results that fit in
+        TRIM_FRACTION of max_bytes, if its data file is larger than
+        max_bytes."""
+        try:
+            if os.path.getsize(self._path(STORE_DATA)) <= self.max_bytes:
+                return
+        except OSError:
+            return
+        records = [('F', name) + self.files[name]
+                   for name in sorted(self.files)]
+        if self.directory_mtime is not None:
+            records.append(('D', self.directory_mtime))
+        temp_data = self._path('%s.%d.tmp' % (STORE_DATA, os.getpid()))
+        temp_index = self._path('%s.%d.tmp' % (STORE_INDEX, os.getpid()))
+        # Newest first; of results stamped alike, the later written wins.
+        newest_first = sorted(
+            self.entries,
+            key=lambda key: (self.entries[key][3], self.entries[key][0]),
+            reverse=True)
+        budget = int(self.max_bytes * TRIM_FRACTION)
+        entries = {}
+        try:
+            source = open(self._path(STORE_DATA), 'rb')
+            target = open(temp_data, 'wb')
+            try:
+                for key in newest_first:
+                    offset, length, digest, stamp = self.entries[key]
+                    if target.tell() + length > budget:
+                        break
+                    source.seek(offset)
+                    entries[key] = (target.tell(), length, digest, stamp)
+                    target.write(source.read(length))
+                    records.append(('P',) + key + entries[key])
+            finally:
+                source.close()
+                target.close()
+            index_file = open(temp_index, 'wb')
+            try:
+                index_file.write(STORE_MAGIC + '\n')
+                index_file.write(''.join('\t'.join(map(str, record)) + '\n'
+                                         for record in records))
+            finally:
+                index_file.close()
+            # Removing the index first leaves an empty store, never a
+            # mismatched one, if interrupted.
+            for name, temp_path in ((STORE_INDEX, temp_index),
+                                    (STORE_DATA, temp_data)):
+                if os.path.exists(self._path(name)):
+                    # os.rename does not replace existing files on Windows.
+                    os.remove(self._path(name))
+            os.rename(temp_data, self._path(STORE_DATA))
+            os.rename(temp_index, self._path(STORE_INDEX))
+        except (IOError, OSError):
+            for temp_path in (temp_data, temp_index):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            return
+        self.entries = entries
@@ -5,9 +5,25 @@ Created on May 16, 2011
 @author: bungeman
 '''
 import sys
+import cPickle
+import csv
 import getopt
+import heapq
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import tempfile
 import bench_util
 
+# Diffs with a Mann-Whitney p-value below this are significant.
+SIGNIFICANCE_LEVEL = 0.05
+
+# Data points per file held in memory by --stream before sorted runs of them
+# are spilled to temporary files.
+STREAM_MEMORY_POINTS = 1000000
+
 def usage():
     """Prints simple usage information."""
 
@@ -29,12 +45,54 @@ def usage():
     print '  n: new time'
     print '  d: diff'
     print '  p: percent diff'
+    print '  s: significance, as the p-value of a Mann-Whitney U test of the'
+    print '     iterations, each summed over the tiles. Keeps the iterations,'
+    print '     so uses more memory.'
     print '-t use tab delimited format for output.'
     print '--match <bench> only matches benches which begin with <bench>.'
+    print '--significant-only only outputs diffs with a p-value below %s.' % (
+        SIGNIFICANCE_LEVEL)
+    print
+    print '--matrix [options] <file> <file> ... compares any number of runs.'
+    print '   Outputs a row per bench with its time in each run, followed by'
+    print '   the mean, standard deviation, coefficient of variation, minimum'
+    print '   and maximum over the runs. -h, -s, -t and --match apply.'
+    print '--csv output the matrix as comma separated values.'
+    print '--json output the matrix as JSON.'
+    print '--jobs <int> the number of processes used to parse the runs.'
+    print
+    print '--stream compares files too large to hold in memory.'
+    print '   Data points are sorted in temporary files and merged, and diffs'
+    print '   are output by bench instead of by percent diff. Column widths'
+    print '   are not aligned and the s field and --significant-only do not'
+    print '   apply. A bench appearing more than once in a file gives a data'
+    print '   point per appearance, and each old one is compared with the'
+    print '   first new one; without --stream, the times of all appearances'
+    print '   are summed into one point.'
+    print '--memory-points <int> data points per file to hold in memory with'
+    print '   --stream. Not specifying is the same as %d.' % (
+        STREAM_MEMORY_POINTS)
+    print 'Benches found in only one of the files are listed after the diffs.'
+
+def summed_iterations(point):
+    """Returns the raw iterations of point summed over its tiles, one sum per
+    iteration, so that they sample the same total as point.time does. Tiles
+    with more iterations than the others are cut short. Returns None if the
+    iterations were not kept.
+
+    BenchDataPoint -> [float]"""
+    tiles = point.tile_iterations()
+    if tiles is None:
+        return None
+    if len(tiles) == 1:
+        return tiles[0]
+    return [sum(values) for values in itertools.izip(*tiles)]
 
 class BenchDiff:
     """A compare between data points produced by bench.
 
+    pvalue is the Mann-Whitney p-value of the summed_iterations of old and
+    new, or None unless both kept their iterations.
     (BenchDataPoint, BenchDataPoint)"""
     def __init__(self, old, new):
         self.old = old
@@ -44,6 +102,12 @@ class BenchDiff:
         if old.time != 0:
             diffp = self.diff / old.time
         self.diffp = diffp
+        self.pvalue = None
+        old_iterations = summed_iterations(old)
+        new_iterations = summed_iterations(new)
+        if old_iterations is not None and new_iterations is not None:
+            _, self.pvalue = bench_util.MannWhitneyU(old_iterations,
+                                                     new_iterations)
 
     def __repr__(self):
         return "BenchDiff(%s, %s)" % (
@@ -51,11 +115,299 @@ class BenchDiff:
                    str(self.old),
                )
 
+def bench_key(point):
+    """The key matching data points between bench files.
+
+    BenchDataPoint -> (str, str, str)"""
+    return (point.bench, point.config, point.time_type)
+
+def join_benches(old_benches, new_benches, match_bench=None):
+    """Matches old and new data points with the same key in linear time.
+
+    Each old point is compared with the first new point with its key.
+    match_bench, if given, only keeps benches that begin with it.
+    ([BenchDataPoint], [BenchDataPoint], str)
+        -> ([BenchDiff], [BenchDataPoint], [BenchDataPoint])
+    which are the diffs and the points only found in old and only in new."""
+    new_by_key = {}
+    for new_bench in new_benches:
+        if match_bench and not new_bench.bench.startswith(match_bench):
+            continue
+        new_by_key.setdefault(bench_key(new_bench), new_bench)
+
+    bench_diffs = []
+    old_only = []
+    old_keys = set()
+    for old_bench in old_benches:
+        #filter benches by the match criteria
+        if match_bench and not old_bench.bench.startswith(match_bench):
+            continue
+        key = bench_key(old_bench)
+        old_keys.add(key)
+        new_bench = new_by_key.get(key)
+        if new_bench is None:
+            old_only.append(old_bench)
+            continue
+        bench_diffs.append(BenchDiff(old_bench, new_bench))
+
+    new_only = [bench for key, bench in new_by_key.iteritems()
+                if key not in old_keys]
+    old_only.sort(key=bench_key)
+    new_only.sort(key=bench_key)
+    return bench_diffs, old_only, new_only
+
+class Spill:
+    """Records appended to a temporary file and read back in order.
+
+    Each record is pickled on its own, so memory use does not grow with the
+    number of records. Records are passed through convert, if given, when
+    read. Iterate only once all records have been appended.
+
+    (function)"""
+    def __init__(self, convert=None):
+        self.convert = convert
+        self.count = 0
+        self.file = tempfile.TemporaryFile()
+
+    def append(self, record):
+        cPickle.dump(record, self.file, cPickle.HIGHEST_PROTOCOL)
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        self.file.flush()
+        self.file.seek(0)
+        for _ in xrange(self.count):
+            record = cPickle.load(self.file)
+            if self.convert:
+                record = self.convert(record)
+            yield record
+
+def sort_records(records, memory_records):
+    """Returns an iterator over the records in sorted order.
+
+    At most memory_records are held in memory. Each time that many have been
+    read they are sorted and spilled to a temporary file, and the runs are
+    merged when iterating."""
+    runs = []
+    buffer = []
+    for record in records:
+        buffer.append(record)
+        if len(buffer) >= memory_records:
+            buffer.sort()
+            run = Spill()
+            for buffered in buffer:
+                run.append(buffered)
+            runs.append(run)
+            buffer = []
+    buffer.sort()
+    return heapq.merge(buffer, *runs)
+
+def _stream_records(path, stat_type, match_bench):
+    """Yields a (bench, config, time_type, index, time) record for each data
+    point in the file, one bench at a time."""
+    file_handle = open(path, 'r')
+    index = 0
+    for point in bench_util.iter_parse({}, file_handle, stat_type):
+        if match_bench and not point.bench.startswith(match_bench):
+            continue
+        yield (point.bench, point.config, point.time_type, index, point.time)
+        index += 1
+    file_handle.close()
+
+def _record_point(record):
+    bench, config, time_type, _, time = record
+    return bench_util.BenchDataPoint(bench, config, time_type, time, {})
+
+def stream_benches(old, new, stat_type, match_bench=None,
+                   memory_points=STREAM_MEMORY_POINTS):
+    """Matches the data points of the old and new files by sorting each side
+    by key and merging them, holding at most memory_points per side.
+
+    Like join_benches, each old point is compared with the first new point
+    with its key. The diffs are generated in key order; the points found in
+    only one file are spilled to temporary files as they are found, and are
+    complete once all diffs have been generated.
+    (str, str, str, str, int)
+        -> (iter(BenchDiff), Spill(BenchDataPoint), Spill(BenchDataPoint))"""
+    old_records = sort_records(_stream_records(old, stat_type, match_bench),
+                               memory_points)
+    new_records = sort_records(_stream_records(new, stat_type, match_bench),
+                               memory_points)
+    old_only = Spill(_record_point)
+    new_only = Spill(_record_point)
+
+    def merge_join():
+        key = lambda record: record[:3]
+        old_groups = itertools.groupby(old_records, key)
+        new_groups = itertools.groupby(new_records, key)
+        old_group = next(old_groups, None)
+        new_group = next(new_groups, None)
+        while old_group is not None or new_group is not None:
+            if new_group is None or (old_group is not None and
+                                     old_group[0] < new_group[0]):
+                for record in old_group[1]:
+                    old_only.append(record)
+                old_group = next(old_groups, None)
+            elif old_group is None or new_group[0] < old_group[0]:
+                new_only.append(next(new_group[1]))
+                new_group = next(new_groups, None)
+            else:
+                new_point = _record_point(next(new_group[1]))
+                for record in old_group[1]:
+                    yield BenchDiff(_record_point(record), new_point)
+                old_group = next(old_groups, None)
+                new_group = next(new_groups, None)
+
+    return merge_join(), old_only, new_only
+
+def _parse_run(path_stat_type):
+    """Parses one run for compare_runs, possibly in a worker process.
+
+    ((str, str)) -> {(str, str, str):float}"""
+    path, stat_type = path_stat_type
+    times = {}
+    file_handle = open(path, 'r')
+    for point in bench_util.parse({}, file_handle, stat_type):
+        times.setdefault(bench_key(point), point.time)
+    file_handle.close()
+    return times
+
+def compare_runs(paths, stat_type, match_bench=None, jobs=1):
+    """Parses each of the runs and lines up the time of every bench in them.
+
+    Runs are parsed by a pool of jobs processes if jobs is greater than one.
+    Returns the sorted keys and, for each, the list of its times in each run,
+    with None for runs without the bench.
+    ([str], str, str, int) -> ([(str, str, str)], [[float]])"""
+    tasks = [(path, stat_type) for path in paths]
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            runs = pool.map(_parse_run, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        runs = map(_parse_run, tasks)
+
+    keys = set()
+    for times in runs:
+        keys.update(times)
+    if match_bench:
+        keys = [key for key in keys if key[0].startswith(match_bench)]
+    keys = sorted(keys)
+    return keys, [[times.get(key) for times in runs] for key in keys]
+
+def spread(times):
+    """Returns the mean, sample standard deviation, coefficient of variation,
+    minimum and maximum of the times that are not None.
+
+    [float] -> (float, float, float, float, float)"""
+    times = [time for time in times if time is not None]
+    mean = sum(times) / len(times)
+    stddev = 0.0
+    if len(times) > 1:
+        stddev = math.sqrt(sum((time - mean) ** 2 for time in times) /
+                           (len(times) - 1))
+    cv = 0.0
+    if mean != 0:
+        cv = stddev / mean
+    return (mean, stddev, cv, min(times), max(times))
+
+SPREAD_NAMES = ['mean', 'stddev', 'cv', 'min', 'max']
+
+def output_matrix(paths, keys, rows, header, output_format):
+    """Writes the bench by run matrix from compare_runs.
+
+    output_format is one of 'table', 'tabs', 'csv' or 'json'.
+    ([str], [(str, str, str)], [[float]], bool, str)"""
+    spreads = [spread(times) for times in rows]
+
+    if output_format == 'json':
+        json.dump({
+            'runs' : paths,
+            'benches' : [dict([('bench', bench.strip()),
+                               ('config', config.strip()),
+                               ('time_type', time_type),
+                               ('times', times)] +
+                              zip(SPREAD_NAMES, row_spread))
+                         for (bench, config, time_type), times, row_spread
+                         in zip(keys, rows, spreads)],
+        }, sys.stdout, indent=1, sort_keys=True)
+        print
+        return
+
+    run_names = [os.path.basename(path) for path in paths]
+    if output_format == 'csv':
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        if header:
+            writer.writerow(['bench', 'conf', 'time'] + run_names +
+                            SPREAD_NAMES)
+        for (bench, config, time_type), times, row_spread in zip(
+                keys, rows, spreads):
+            writer.writerow([bench.strip(), config.strip(), time_type] +
+                            ['' if time is None else '%.2f' % time
+                             for time in times] +
+                            ['%.4f' % value for value in row_spread])
+        return
+
+    if output_format == 'tabs':
+        name_formats = ['{bench}\t', '{config}\t', '{time_type}\t']
+        time_formats = ['{0: 0.2f}\t'] * len(paths)
+        missing_formats = ['\t'] * len(paths)
+        run_formats = ['{0}\t'] * len(paths)
+        spread_formats = ['{0: 0.2f}\t', '{0: 0.2f}\t', '{0: 0.1%}\t',
+                          '{0: 0.2f}\t', '{0: 0.2f}\t']
+        spread_headers = ['{0}\t'] * len(SPREAD_NAMES)
+    else:
+        bench_max_len = max([0] + [len(key[0]) for key in keys])
+        config_max_len = max([0] + [len(key[1]) for key in keys])
+        name_formats = ['{bench: >%d} ' % (bench_max_len),
+                        '{config: <%d} ' % (config_max_len),
+                        '{time_type: <4} ']
+        widths = [max(10, len(name)) for name in run_names]
+        time_formats = ['{0: >%d.2f} ' % width for width in widths]
+        missing_formats = ['%s ' % ('-'.rjust(width)) for width in widths]
+        run_formats = ['{0: >%d} ' % width for width in widths]
+        spread_formats = ['{0: >10.2f} ', '{0: >10.2f} ', '{0: >8.1%} ',
+                          '{0: >10.2f} ', '{0: >10.2f} ']
+        spread_headers = ['{0: >10} ', '{0: >10} ', '{0: >8} ',
+                          '{0: >10} ', '{0: >10} ']
+    name_format = ''.join(name_formats)
+
+    if header:
+        print (name_format.format(bench='bench', config='conf',
+                                  time_type='time') +
+               ''.join(run_format.format(name) for run_format, name
+                       in zip(run_formats, run_names)) +
+               ''.join(spread_header.format(name) for spread_header, name
+                       in zip(spread_headers, SPREAD_NAMES)))
+
+    for (bench, config, time_type), times, row_spread in zip(
+            keys, rows, spreads):
+        line = name_format.format(bench=bench.strip(), config=config.strip(),
+                                  time_type=time_type)
+        for time_format, missing_format, time in zip(
+                time_formats, missing_formats, times):
+            if time is None:
+                line += missing_format
+            else:
+                line += time_format.format(time)
+        line += ''.join(spread_format.format(value) for spread_format, value
+                        in zip(spread_formats, row_spread))
+        print line
+
 def main():
     """Parses command line and writes output."""
 
     try:
-        opts, _ = getopt.getopt(sys.argv[1:], "f:o:n:s:ht", ['match='])
+        opts, args = getopt.getopt(sys.argv[1:], "f:o:n:s:ht",
+                                   ['match=', 'significant-only', 'matrix',
+                                    'csv', 'json', 'jobs=', 'stream',
+                                    'memory-points='])
     except getopt.GetoptError, err:
         print str(err) 
         usage()
@@ -70,6 +422,12 @@ def main():
     stat_type = "avg"
     use_tabs = False
     match_bench = None;
+    significant_only = False
+    matrix = False
+    output_format = 'table'
+    jobs = 1
+    stream = False
+    memory_points = STREAM_MEMORY_POINTS
 
     for option, value in opts:
         if option == "-o":
@@ -86,32 +444,63 @@ def main():
             use_tabs = True
         elif option == "--match":
             match_bench = value
+        elif option == "--significant-only":
+            significant_only = True
+        elif option == "--matrix":
+            matrix = True
+        elif option == "--csv":
+            output_format = 'csv'
+        elif option == "--json":
+            output_format = 'json'
+        elif option == "--jobs":
+            jobs = int(value)
+        elif option == "--stream":
+            stream = True
+        elif option == "--memory-points":
+            memory_points = int(value)
         else:
             usage()
             assert False, "unhandled option"
 
+    if matrix:
+        if not args:
+            usage()
+            sys.exit(2)
+        if use_tabs and output_format == 'table':
+            output_format = 'tabs'
+        keys, rows = compare_runs(args, stat_type, match_bench, jobs)
+        output_matrix(args, keys, rows, header, output_format)
+        return
+
     if old is None or new is None:
         usage()
         sys.exit(2)
 
-    old_benches = bench_util.parse({}, open(old, 'r'), stat_type)
-    new_benches = bench_util.parse({}, open(new, 'r'), stat_type)
-
-    bench_diffs = []
-    for old_bench in old_benches:
-        #filter benches by the match criteria
-        if match_bench and not old_bench.bench.startswith(match_bench):
-            continue
+    if stream:
+        if significant_only or 's' in columns or memory_points < 1:
+            usage()
+            sys.exit(2)
+        bench_diffs, old_only, new_only = stream_benches(
+            old, new, stat_type, match_bench, memory_points)
+    else:
+        samples = None
+        if significant_only or 's' in columns:
+            samples = bench_util.SampleBuffer()
+        old_benches = bench_util.parse({}, open(old, 'r'), stat_type, samples)
+        new_benches = bench_util.parse({}, open(new, 'r'), stat_type, samples)
 
-        #filter new_benches for benches that match old_bench
-        new_bench_match = [bench for bench in new_benches
-            if old_bench.bench == bench.bench and
-               old_bench.config == bench.config and
-               old_bench.time_type == bench.time_type
-        ]
-        if (len(new_bench_match) < 1):
-            continue
-        bench_diffs.append(BenchDiff(old_bench, new_bench_match[0]))
+        bench_diffs, old_only, new_only = join_benches(old_benches,
+                                                       new_benches,
+                                                       match_bench)
+        if significant_only:
+            bench_diffs = [bench_diff for bench_diff in bench_diffs
+                           if bench_diff.pvalue is not None and
+                              bench_diff.pvalue < SIGNIFICANCE_LEVEL]
+        bench_diffs.sort(key=lambda d : [d.diffp,
+                                         d.old.bench,
+                                         d.old.config,
+                                         d.old.time_type,
+                                        ])
 
     if use_tabs:
         column_formats = {
@@ -122,6 +511,7 @@ def main():
             'n' : '{new_time: 0.2f}\t',
             'd' : '{diff: 0.2f}\t',
             'p' : '{diffp: 0.1%}\t',
+            's' : '{pvalue: 0.4f}\t',
         }
         header_formats = {
             'b' : '{bench}\t',
@@ -131,10 +521,15 @@ def main():
             'n' : '{new_time}\t',
             'd' : '{diff}\t',
             'p' : '{diffp}\t',
+            's' : '{pvalue}\t',
         }
     else:
-        bench_max_len = max(map(lambda b: len(b.old.bench), bench_diffs))
-        config_max_len = max(map(lambda b: len(b.old.config), bench_diffs))
+        bench_max_len = 0
+        config_max_len = 0
+        if not stream:
+            bench_max_len = max([0] + [len(b.old.bench) for b in bench_diffs])
+            config_max_len = max([0] +
+                                 [len(b.old.config) for b in bench_diffs])
         column_formats = {
             'b' : '{bench: >%d} ' % (bench_max_len),
             'c' : '{config: <%d} ' % (config_max_len),
@@ -143,6 +538,7 @@ def main():
             'n' : '{new_time: >10.2f} ',
             'd' : '{diff: >+10.2f} ',
             'p' : '{diffp: >+8.1%} ',
+            's' : '{pvalue: >8.4f} ',
         }
         header_formats = {
             'b' : '{bench: >%d} ' % (bench_max_len),
@@ -152,6 +548,7 @@ def main():
             'n' : '{new_time: >10} ',
             'd' : '{diff: >10} ',
             'p' : '{diffp: >8} ',
+            's' : '{pvalue: >8} ',
         }
 
     for column_char in columns:
@@ -171,13 +568,9 @@ def main():
             , new_time='new'
             , diff='diff'
             , diffp='diffP'
+            , pvalue='p'
         )
 
-    bench_diffs.sort(key=lambda d : [d.diffp,
-                                     d.old.bench,
-                                     d.old.config,
-                                     d.old.time_type,
-                                    ])
     for bench_diff in bench_diffs:
         print column_format.format(
             bench=bench_diff.old.bench.strip()
@@ -187,7 +580,21 @@ def main():
             , new_time=bench_diff.new.time
             , diff=bench_diff.diff
             , diffp=bench_diff.diffp
+            , pvalue=bench_diff.pvalue
         )
 
+    for side, benches in (('old', old_only), ('new', new_only)):
+        if not benches:
+            continue
+        print
+        print 'Only in %s file:' % side
+        for bench in benches:
+            fields = (bench.bench.strip(), bench.config.strip(),
+                      bench.time_type)
+            if use_tabs:
+                print '\t'.join(fields)
+            else:
+                print ' '.join(fields).rstrip()
+
 if __name__ == "__main__":
     main()
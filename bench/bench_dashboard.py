@@ -0,0 +1,375 @@
+'''
+Writes bench lines as a dashboard rendered in the browser.
+
+Instead of one xhtml file holding every line, the dashboard is a directory
+with a small HTML page, an index of the benches and one gzipped JSON shard
+per bench. The page only downloads and draws the shards of the benches
+selected, so it loads in time proportional to what is looked at rather than
+to the whole history of the bot.
+
+Shards are named after a hash of their contents, so they never change once
+written and can be cached indefinitely; only the index and the page need to
+be fetched again. The index is written last, so it only ever refers to
+complete shards.
+'''
+import cStringIO
+import gzip
+import hashlib
+import json
+import os
+import xml.sax.saxutils
+
+import bench_util
+
+# Files written to the dashboard directory, besides the shards.
+SHELL_FILE = 'index.html'
+INDEX_FILE = 'index.json'
+
+# Shards are named SHARD_PREFIX + hash + SHARD_SUFFIX.
+SHARD_PREFIX = 'bench_'
+SHARD_SUFFIX = '.json.gz'
+SHARD_HASH_LENGTH = 16
+
+# Times are written with this many decimals, i.e. to the microsecond.
+TIME_DIGITS = 3
+
+REVISION_URL = 'http://code.google.com/p/skia/source/detail?r='
+
+# Color and opacity, (r, g, b, opacity), of lines without any given.
+DEFAULT_SHADING = (128, 128, 128, .10)
+
+def _write_file(path, data):
+    """Writes data to path through a temporary file, so readers never see
+    a partially written file."""
+    temp_path = path + '.tmp'
+    output = open(temp_path, 'wb')
+    try:
+        output.write(data)
+    finally:
+        output.close()
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_path, path)
+
+def _gzip(data):
+    """Returns data compressed in gzip format. The header carries no time
+    stamp, so equal data always compresses to the same bytes."""
+    output = cStringIO.StringIO()
+    compressor = gzip.GzipFile(filename='', mode='wb', fileobj=output,
+                               mtime=0)
+    compressor.write(data)
+    compressor.close()
+    return output.getvalue()
+
+def _line_data(label, line, regression, max_points, shading):
+    """Returns the JSON-able description of one line.
+
+    (Label, [(x,y)], LinearRegression?, int?, (r, g, b, opacity)) -> {str:_}"""
+    if max_points is not None:
+        line = bench_util.LargestTriangleThreeBuckets(line, max_points)
+    r, g, b, opacity = shading
+    data = {
+        'id': str(label),
+        'config': label.config,
+        'time_type': label.time_type,
+        'settings': label.settings,
+        'points': [[x, round(y, TIME_DIGITS)] for x, y in line],
+        'regression': None,
+        'color': 'rgb(%d,%d,%d)' % (r, g, b),
+        'opacity': round(opacity, TIME_DIGITS),
+    }
+    if regression is not None:
+        data['regression'] = [
+            regression.min_x,
+            round(regression.slope * regression.min_x + regression.intercept,
+                  TIME_DIGITS),
+            regression.max_x,
+            round(regression.slope * regression.max_x + regression.intercept,
+                  TIME_DIGITS),
+            round(regression.serror * 2, TIME_DIGITS),
+        ]
+    return data
+
+def write_dashboard(directory, lines, regressions, oldest_revision,
+                    newest_revision, title, ignored_points=0, max_points=None,
+                    shading=None):
+    """Writes the dashboard for lines to directory, creating it if needed.
+
+    shading gives the color and opacity each line is drawn with, as the
+    xhtml graph shades lines by the slope of their regression; lines not in
+    it get DEFAULT_SHADING. Shards left over from earlier runs which the new
+    index does not refer to are removed afterwards.
+    ({Label:[(x,y)]}, {Label:LinearRegression}, int, int, str, int, int?,
+     {Label:(r, g, b, opacity)}?)"""
+    if shading is None:
+        shading = {}
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    by_bench = {} # {bench : [Label]}
+    for label in lines.iterkeys():
+        by_bench.setdefault(label.bench, []).append(label)
+
+    benches = []
+    shard_files = set()
+    for bench in sorted(by_bench):
+        labels = sorted(by_bench[bench], key=str)
+        shard = {
+            'bench': bench,
+            'lines': [_line_data(label, lines[label], regressions.get(label),
+                                 max_points,
+                                 shading.get(label, DEFAULT_SHADING))
+                      for label in labels],
+        }
+        data = json.dumps(shard, sort_keys=True, separators=(',', ':'))
+        shard_file = (SHARD_PREFIX +
+                      hashlib.sha1(data).hexdigest()[:SHARD_HASH_LENGTH] +
+                      SHARD_SUFFIX)
+        shard_path = os.path.join(directory, shard_file)
+        if shard_file not in shard_files and not os.path.exists(shard_path):
+            _write_file(shard_path, _gzip(data))
+        shard_files.add(shard_file)
+        benches.append({
+            'bench': bench,
+            'shard': shard_file,
+            'lines': len(labels),
+            'configs': sorted(set(label.config for label in labels)),
+            'time_types': sorted(set(label.time_type for label in labels)),
+        })
+
+    index = {
+        'title': title,
+        'oldest_revision': oldest_revision,
+        'newest_revision': newest_revision,
+        'ignored_points': ignored_points,
+        'revision_url': REVISION_URL,
+        'benches': benches,
+    }
+    _write_file(os.path.join(directory, SHELL_FILE),
+                DASHBOARD_SHELL % {'title': xml.sax.saxutils.escape(title)})
+    _write_file(os.path.join(directory, INDEX_FILE),
+                json.dumps(index, sort_keys=True, separators=(',', ':')))
+
+    for name in os.listdir(directory):
+        if (name.startswith(SHARD_PREFIX) and name.endswith(SHARD_SUFFIX) and
+            name not in shard_files):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+# The page drawing the dashboard; %(title)s is replaced by the escaped title.
+# It must not contain any other percent signs.
+DASHBOARD_SHELL = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+<style>
+  body { font-family: sans-serif; }
+  select { vertical-align: top; }
+  #graph { border: 1px solid #ccc; }
+  #status { color: #888; }
+</style>
+</head>
+<body>
+<h3>%(title)s</h3>
+<p id="summary"></p>
+<form onsubmit="return false;">
+<select id="benches" multiple size="16" onchange="update();"></select>
+<select id="configs" multiple size="16" onchange="draw();"></select>
+<select id="time_types" multiple size="16" onchange="draw();"></select>
+</form>
+<p>Select benches to load them. Configs and time types narrow the lines
+drawn; selecting none shows all. Lines clearly going up are shaded red and
+lines clearly going down green, the more opaque the steeper. Hover over a
+line to name it and show its regression.</p>
+<p><span id="label">&nbsp;</span> <a id="revision" target="_blank"></a>
+<span id="status"></span></p>
+<svg id="graph" width="1024" height="600"
+     xmlns="http://www.w3.org/2000/svg"></svg>
+<script type="text/javascript">
+var SVG_NS = 'http://www.w3.org/2000/svg';
+var index = null;
+var shards = {};  // shard file name -> parsed shard, once loaded
+var pending = {}; // shard file names being loaded
+
+function load(url, callback) {
+  var request = new XMLHttpRequest();
+  request.open('GET', url);
+  request.responseType = 'arraybuffer';
+  request.onload = function() {
+    var bytes = new Uint8Array(request.response);
+    // Servers sending shards with Content-Encoding: gzip have already
+    // decompressed them; otherwise, do it here.
+    if (bytes.length > 1 && bytes[0] == 0x1f && bytes[1] == 0x8b) {
+      var stream = new Blob([bytes]).stream().pipeThrough(
+          new DecompressionStream('gzip'));
+      new Response(stream).text().then(function(text) {
+        callback(JSON.parse(text));
+      });
+    } else {
+      callback(JSON.parse(new TextDecoder().decode(bytes)));
+    }
+  };
+  request.send();
+}
+
+function selectedValues(id) {
+  var values = {};
+  var any = false;
+  var options = document.getElementById(id).options;
+  for (var i = 0; i < options.length; ++i) {
+    if (options[i].selected) {
+      values[options[i].value] = true;
+      any = true;
+    }
+  }
+  return any ? values : null;
+}
+
+function fillSelect(id, values) {
+  var select = document.getElementById(id);
+  for (var i = 0; i < values.length; ++i) {
+    var option = document.createElement('option');
+    option.value = values[i];
+    option.text = values[i] === '' ? '(wall)' : values[i];
+    select.appendChild(option);
+  }
+}
+
+function update() {
+  var benches = selectedValues('benches') || {};
+  index.benches.forEach(function(bench) {
+    var shard = bench.shard;
+    if (!benches[bench.bench] || shards[shard] || pending[shard]) return;
+    pending[shard] = true;
+    load(shard, function(data) {
+      shards[shard] = data;
+      delete pending[shard];
+      draw();
+    });
+  });
+  draw();
+}
+
+function visibleLines() {
+  var benches = selectedValues('benches') || {};
+  var configs = selectedValues('configs');
+  var timeTypes = selectedValues('time_types');
+  var lines = [];
+  var loading = 0;
+  index.benches.forEach(function(bench) {
+    if (!benches[bench.bench]) return;
+    var shard = shards[bench.shard];
+    if (!shard) {
+      ++loading;
+      return;
+    }
+    shard.lines.forEach(function(line) {
+      if ((!configs || configs[line.config]) &&
+          (!timeTypes || timeTypes[line.time_type])) {
+        lines.push(line);
+      }
+    });
+  });
+  document.getElementById('status').textContent =
+      loading ? 'loading ' + loading + ' benches...' : '';
+  return lines;
+}
+
+function element(name, attributes) {
+  var node = document.createElementNS(SVG_NS, name);
+  for (var key in attributes) {
+    node.setAttribute(key, attributes[key]);
+  }
+  return node;
+}
+
+function draw() {
+  var svg = document.getElementById('graph');
+  while (svg.firstChild) svg.removeChild(svg.firstChild);
+  var lines = visibleLines();
+  var minX = index.oldest_revision;
+  var maxX = index.newest_revision;
+  var maxY = 0;
+  lines.forEach(function(line) {
+    line.points.forEach(function(point) {
+      maxY = Math.max(maxY, point[1]);
+    });
+  });
+  if (!lines.length || maxX == minX || maxY == 0) return;
+  var width = svg.getAttribute('width');
+  var height = svg.getAttribute('height');
+  function cx(x) { return (x - minX) * width / (maxX - minX); }
+  function cy(y) { return height - y * height / maxY; }
+
+  svg.onmousemove = function(event) {
+    var box = svg.getBoundingClientRect();
+    var revision = Math.round(
+        minX + (event.clientX - box.left) * (maxX - minX) / width);
+    var link = document.getElementById('revision');
+    link.textContent = 'r' + revision;
+    link.setAttribute('href', index.revision_url + revision);
+  };
+
+  lines.forEach(function(line) {
+    var group = element('g', {});
+    var regression = null;
+    if (line.regression) {
+      var r = line.regression;
+      regression = element('polyline', {
+          'fill': 'none', 'stroke': 'yellow', 'opacity': '0.5',
+          'stroke-width': Math.max(1, r[4] * height / maxY),
+          'pointer-events': 'none', 'visibility': 'hidden',
+          'points': cx(r[0]) + ',' + cy(r[1]) + ' ' + cx(r[2]) + ',' + cy(r[3])
+      });
+      group.appendChild(regression);
+    }
+    var points = line.points.map(function(point) {
+      return cx(point[0]) + ',' + cy(point[1]);
+    });
+    var polyline = element('polyline', {
+        'fill': 'none', 'stroke': line.color, 'stroke-width': '2',
+        'opacity': line.opacity, 'points': points.join(' ')
+    });
+    polyline.onmouseover = function() {
+      document.getElementById('label').textContent = line.id;
+      polyline.setAttribute('stroke', 'blue');
+      polyline.setAttribute('opacity', '1');
+      if (regression) regression.setAttribute('visibility', 'visible');
+      svg.appendChild(group);
+    };
+    polyline.onmouseout = function() {
+      polyline.setAttribute('stroke', line.color);
+      polyline.setAttribute('opacity', line.opacity);
+      if (regression) regression.setAttribute('visibility', 'hidden');
+    };
+    group.appendChild(polyline);
+    svg.appendChild(group);
+  });
+}
+
+load('index.json', function(data) {
+  index = data;
+  var configs = {};
+  var timeTypes = {};
+  index.benches.forEach(function(bench) {
+    bench.configs.forEach(function(config) { configs[config] = true; });
+    bench.time_types.forEach(function(type) { timeTypes[type] = true; });
+  });
+  fillSelect('benches', index.benches.map(function(bench) {
+    return bench.bench;
+  }));
+  fillSelect('configs', Object.keys(configs).sort());
+  fillSelect('time_types', Object.keys(timeTypes).sort());
+  document.getElementById('summary').textContent =
+      index.benches.length + ' benches, revisions r' + index.oldest_revision +
+      ' - r' + index.newest_revision +
+      (index.ignored_points ? '; discarded ' + index.ignored_points +
+       ' data points out of range.' : '.');
+});
+</script>
+</body>
+</html>
+"""
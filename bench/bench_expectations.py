@@ -0,0 +1,223 @@
+'''
+Compiled index of the bench ranges in bench_expectations.txt.
+
+Each data row of an expectation file is
+<BenchType_BitmapConfig_TimerType>,<Platform-Alg>,<Expected>,<LB>,<UB>
+and is indexed under the tuple (row name, platform). Either name may contain
+'*' wildcards, matching any run of characters, so that one row covers a
+family of benches or platforms; 'desk_*' is a prefix row. Exact rows take
+precedence, and among wildcard rows the first one in the file wins.
+
+Parsing a file is cached in a binary form keyed by the sha1 of its text, so
+unchanged files are not parsed again. The cache holds the index's plain
+dict and list in marshal format, which are loaded as they are, in a
+directory private to the user, so it can neither be planted by other users
+nor run code when read.
+'''
+import hashlib
+import marshal
+import os
+import re
+import stat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Bump whenever the compiled form changes, to invalidate cached indexes.
+INDEX_VERSION = 3
+
+# Default location of the cached indexes, created readable only by the user.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'skia_bench_expectations')
+
+# Range checks of at least this many values are done with numpy, if it is
+# available.
+NUMPY_MIN_CHECKS = 256
+
+WILDCARD = '*'
+
+def _compile_pattern(pattern):
+    """Returns a regular expression matching the names pattern covers."""
+    return re.compile('.*'.join([re.escape(part)
+                                 for part in pattern.split(WILDCARD)]) + '$')
+
+class ExpectationIndex:
+    """The expected bench ranges of one or more expectation files.
+
+    exact maps (row, platform) to (LB, UB). patterns lists the rows with
+    wildcards as (row pattern, platform pattern, (LB, UB)), in file order."""
+    def __init__(self):
+        self.exact = {}
+        self.patterns = []
+        self._compiled = None
+
+    def __len__(self):
+        return len(self.exact) + len(self.patterns)
+
+    def __getstate__(self):
+        return (self.exact, self.patterns)
+
+    def __setstate__(self, state):
+        self.exact, self.patterns = state
+        self._compiled = None
+
+    def add(self, row, platform, bounds):
+        """Adds the range bounds, (LB, UB), for row on platform. Raises an
+        Exception if there already is one."""
+        key = (row, platform)
+        if WILDCARD in row or WILDCARD in platform:
+            if key in [(r, p) for r, p, _ in self.patterns]:
+                raise Exception("Dup entries for bench expectation %s,%s" % key)
+            self.patterns.append((row, platform, bounds))
+            self._compiled = None
+        else:
+            if key in self.exact:
+                raise Exception("Dup entries for bench expectation %s,%s" % key)
+            self.exact[key] = bounds
+
+    def merge(self, other):
+        """Adds all the ranges of the ExpectationIndex other. Raises an
+        Exception if any of them is already there."""
+        if len(other.exact) > len(self.exact):
+            duplicates = [key for key in self.exact if key in other.exact]
+        else:
+            duplicates = [key for key in other.exact if key in self.exact]
+        if duplicates:
+            raise Exception("Dup entries for bench expectation %s,%s" %
+                            min(duplicates))
+        self.exact.update(other.exact)
+        for row, platform, bounds in other.patterns:
+            self.add(row, platform, bounds)
+
+    def _platform_patterns(self, platform):
+        """Returns [(row regex, bounds)] of the wildcard rows for platform."""
+        if self._compiled is None:
+            self._compiled = [
+                (_compile_pattern(row), _compile_pattern(platform_pattern),
+                 bounds)
+                for row, platform_pattern, bounds in self.patterns]
+        return [(row_re, bounds)
+                for row_re, platform_re, bounds in self._compiled
+                if platform_re.match(platform)]
+
+    def lookup(self, row, platform):
+        """Returns the (LB, UB) expected for row on platform, or None."""
+        bounds = self.exact.get((row, platform))
+        if bounds is None:
+            for row_re, pattern_bounds in self._platform_patterns(platform):
+                if row_re.match(row):
+                    return pattern_bounds
+        return bounds
+
+    def check(self, rows, platform, values):
+        """Finds the values outside the range expected for their rows on
+        platform. Rows without expectations are skipped.
+
+        Returns (index, LB, UB) for each such value, in order.
+        ([str], str, [float]) -> [(int, float, float)]"""
+        patterns = self._platform_patterns(platform)
+        indices = []
+        lows = []
+        highs = []
+        for i, row in enumerate(rows):
+            bounds = self.exact.get((row, platform))
+            if bounds is None:
+                for row_re, pattern_bounds in patterns:
+                    if row_re.match(row):
+                        bounds = pattern_bounds
+                        break
+                else:
+                    continue
+            indices.append(i)
+            lows.append(bounds[0])
+            highs.append(bounds[1])
+
+        if numpy is not None and len(indices) >= NUMPY_MIN_CHECKS:
+            checked = numpy.array([values[i] for i in indices])
+            outside = numpy.flatnonzero((checked < numpy.array(lows)) |
+                                        (checked > numpy.array(highs)))
+        else:
+            outside = [k for k, i in enumerate(indices)
+                       if values[i] < lows[k] or values[i] > highs[k]]
+        return [(indices[k], lows[k], highs[k]) for k in outside]
+
+def parse(lines):
+    """Returns an ExpectationIndex of the expectation file lines."""
+    index = ExpectationIndex()
+    for expectation in lines:
+        elements = expectation.strip().split(',')
+        if not elements[0] or elements[0].startswith('#'):
+            continue
+        if len(elements) != 5:
+            raise Exception("Invalid expectation line format: %s" %
+                            expectation)
+        # [<Bench_BmpConfig_TimeType>,<Platform-Alg>] -> (LB, UB)
+        index.add(elements[0], elements[1],
+                  (float(elements[-2]), float(elements[-1])))
+    return index
+
+def from_state(state):
+    """Returns an ExpectationIndex of the (exact, patterns) state, as
+    returned by ExpectationIndex.__getstate__(), using its dict and list as
+    they are."""
+    exact, patterns = state
+    if not (isinstance(exact, dict) and isinstance(patterns, list)):
+        raise ValueError('Invalid cached expectation index')
+    index = ExpectationIndex()
+    index.__setstate__((exact, patterns))
+    return index
+
+def _is_private(path):
+    """Returns whether path is owned by the user and cannot be written by
+    anyone else. Always true where there are no file owners."""
+    if not hasattr(os, 'getuid'):
+        return True
+    path_stat = os.lstat(path)
+    return (path_stat.st_uid == os.getuid() and
+            not path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+def load(filename, cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the ExpectationIndex of the expectation file filename.
+
+    The index is read from cache_dir if the file was indexed before, and
+    stored there otherwise. cache_dir is created readable only by the user,
+    and cached indexes are only read from it while it and they are owned by
+    the user and not writable by others. Failures to read or write the cache
+    are ignored. Passing None as cache_dir parses the file without any
+    cache."""
+    text = open(filename).read()
+    if cache_dir is None:
+        return parse(text.splitlines(True))
+
+    digest = hashlib.sha1(text).hexdigest()
+    index_path = os.path.join(cache_dir, '%s.v%d' % (digest, INDEX_VERSION))
+    try:
+        if _is_private(cache_dir) and _is_private(index_path):
+            index_file = open(index_path, 'rb')
+            try:
+                return from_state(marshal.load(index_file))
+            finally:
+                index_file.close()
+    except Exception:
+        pass
+
+    index = parse(text.splitlines(True))
+    temp_path = '%s.%d.tmp' % (index_path, os.getpid())
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0700)
+        if not _is_private(cache_dir):
+            return index
+        index_file = open(temp_path, 'wb')
+        try:
+            marshal.dump(index.__getstate__(), index_file)
+        finally:
+            index_file.close()
+        if os.name == 'nt' and os.path.exists(index_path):
+            os.remove(index_path)
+        os.rename(temp_path, index_path)
+    except (IOError, OSError):
+        pass
+    return index
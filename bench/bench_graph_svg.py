@@ -3,16 +3,20 @@ Created on May 16, 2011
 
 @author: bungeman
 '''
+import bench_cache
+import bench_dashboard
+import bench_expectations
+import bench_upload
 import bench_util
+import copy
 import getopt
-import httplib
 import itertools
 import json
+import multiprocessing
 import os
 import re
 import sys
-import urllib
-import urllib2
+import traceback
 import xml.sax.saxutils
 
 # We throw out any measurement outside this range, and log a warning.
@@ -23,15 +27,29 @@ MAX_REASONABLE_TIME = 99999
 TITLE_PREAMBLE = 'Bench_Performance_for_'
 TITLE_PREAMBLE_LENGTH = len(TITLE_PREAMBLE)
 
+# Bytes of output gathered before handing them to the output file in one write.
+OUTPUT_CHUNK_SIZE = 1 << 16
+
+# Color and opacity, (r, g, b, opacity), of lines which are not clearly
+# going up or down.
+LINE_SHADING = (128, 128, 128, .10)
+
 def usage():
     """Prints simple usage information."""
 
     print '-a <url> the url to use for adding bench values to app engine app.'
     print '   Example: "https://skiadash.appspot.com/add_point".'
     print '   If not set, will skip this step.'
+    print '   Values which cannot be added are kept in <dir>%s' % (
+        bench_upload.SPOOL_SUFFIX)
+    print '   and added first on the next run.'
     print '-b <bench> the bench to show.'
     print '-c <config> the config to show (GPU, 8888, 565, etc).'
     print '-d <dir> a directory containing bench_r<revision>_<scalar> files.'
+    print '   Give -d and -l once per platform to graph several platforms in'
+    print '   one run. -o and --dashboard then name directories, in which'
+    print '   each platform is written under its title, and all the unmet'
+    print '   expectations are reported together at the end.'
     print '-e <file> file containing expected bench values/ranges.'
     print '   Will raise exception if actual bench values are out of range.'
     print '   See bench_expectations.txt for data format and examples.'
@@ -50,18 +68,48 @@ def usage():
     print '-t <time> the time to show (w, c, g, etc).'
     print '-x <int> the desired width of the svg.'
     print '-y <int> the desired height of the svg.'
+    print '--dashboard <dir> directory to which to write a dashboard.'
+    print '   The dashboard is an index.html page which loads and draws the'
+    print '   data of each bench, kept in its own gzipped JSON file, only when'
+    print '   the bench is selected.'
     print '--default-setting <setting>[=<value>] setting for those without.'
+    print '--jobs <int> the number of processes used to parse bench files.'
+    print '   With several platforms, the number of platforms graphed at once.'
+    print '--filter-outliers also discard points which stand out from the'
+    print '   points around them in their line, such as a spike to ten times'
+    print '   the usual time. The newest point of each line is always kept.'
+    print '--max-points <int> the most points to draw for each line.'
+    print '   Longer lines are downsampled, keeping their spikes, and the'
+    print '   revisions are grouped into as many areas. Regressions are still'
+    print '   fitted to all points.'
+    print '--change-points print the revisions at which each line shifted.'
+    print '--regression <engine> how to fit the regression lines.'
+    print '   One of %s. Not specifying is the same as %s.' % (
+        ', '.join(bench_util.REGRESSION_ENGINES),
+        bench_util.REGRESSION_LEAST_SQUARES)
+    print '--no-cache do not read or write the revision store.'
+    print '   By default, the bench files and their parsed data points are'
+    print '   kept in <dir>%s, so that only new files are parsed.' % (
+        bench_cache.STORE_DIR_SUFFIX)
+    print '--cache-size <int> the size in MB past which the revision store is'
+    print '   trimmed, dropping the data points least recently used first.'
+    print '   Not specifying is the same as %d.' % (
+        bench_cache.DEFAULT_MAX_BYTES >> 20)
     
 
 class Label:
     """The information in a label.
     
-    (str, str, str, str, {str:str})"""
-    def __init__(self, bench, config, time_type, settings):
+    settings_key is frozenset(settings.iteritems()), if already known.
+    Labels are used as dict keys, so settings must not change afterwards.
+    (str, str, str, str, {str:str}, frozenset)"""
+    def __init__(self, bench, config, time_type, settings, settings_key=None):
         self.bench = bench
         self.config = config
         self.time_type = time_type
         self.settings = settings
+        self._settings_key = settings_key
+        self._hash = None
     
     def __repr__(self):
         return "Label(%s, %s, %s, %s)" % (
@@ -86,10 +134,69 @@ class Label:
                 self.settings == other.settings)
     
     def __hash__(self):
-        return (hash(self.bench) ^
-                hash(self.config) ^
-                hash(self.time_type) ^
-                hash(frozenset(self.settings.iteritems())))
+        if self._hash is None:
+            if self._settings_key is None:
+                self._settings_key = frozenset(self.settings.iteritems())
+            self._hash = (hash(self.bench) ^
+                          hash(self.config) ^
+                          hash(self.time_type) ^
+                          hash(self._settings_key))
+        return self._hash
+
+class LabelInterner:
+    """Hands out a single Label for each distinct bench, config, time type and
+    settings, so repeated labels are neither rebuilt nor rehashed.
+
+    Settings are keyed by the identity of their dict, since data points of a
+    bench file share one, and each distinct dict is hashed only once. They
+    must not change while the interner is in use."""
+    def __init__(self):
+        self.labels = {} # {(bench, config, time_type, settings_key) : Label}
+        self._settings_keys = {} # {id(settings) : (settings, settings_key)}
+    
+    def settings_key(self, settings):
+        """Returns frozenset(settings.iteritems()), computed once per dict."""
+        entry = self._settings_keys.get(id(settings))
+        if entry is None:
+            # keeps settings alive, so its id is not reused.
+            entry = (settings, frozenset(settings.iteritems()))
+            self._settings_keys[id(settings)] = entry
+        return entry[1]
+    
+    def get(self, bench, config, time_type, settings):
+        """Returns the Label for these fields, creating it the first time."""
+        settings_key = self.settings_key(settings)
+        key = (bench, config, time_type, settings_key)
+        label = self.labels.get(key)
+        if label is None:
+            label = Label(bench, config, time_type, settings, settings_key)
+            self.labels[key] = label
+        return label
+
+def settings_filter(settings):
+    """Returns a predicate telling whether a data point's settings agree with
+    settings, i.e. have the same value for every setting they both have.
+    
+    Results are remembered per settings dict, which points of one bench file
+    share, so they must not change while the predicate is in use.
+    {str:str} -> ({str:str} -> bool)"""
+    items = settings.items()
+    if not items:
+        return lambda point_settings: True
+    results = {} # {id(point_settings) : (point_settings, bool)}
+    def matches(point_settings):
+        result = results.get(id(point_settings))
+        if result is None:
+            agrees = True
+            for key, value in items:
+                if key in point_settings and point_settings[key] != value:
+                    agrees = False
+                    break
+            # keeps point_settings alive, so its id is not reused.
+            result = (point_settings, agrees)
+            results[id(point_settings)] = result
+        return result[1]
+    return matches
 
 def get_latest_revision(directory):
     """Returns the latest revision number found within this directory.
@@ -107,14 +214,39 @@ def get_latest_revision(directory):
     else:
         return latest_revision_found
 
+def _parse_bench_file(path_settings_rep):
+    """Parses a single bench file for parse_dir, possibly in a worker process.
+
+    Returns the settings passed in along with the table of data points, so
+    that the caller can tell which rows were given the default settings.
+    ((str, {str, str}, str)) -> ({str, str}, BenchTable)"""
+    path, settings, rep = path_settings_rep
+    file_handle = open(path, 'r')
+    table = bench_util.parse_table(settings, file_handle, rep)
+    file_handle.close()
+    return (settings, table)
+
 def parse_dir(directory, default_settings, oldest_revision, newest_revision,
-              rep):
+              rep, jobs=1, store=None):
     """Parses bench data from files like bench_r<revision>_<scalar>.
+
+    If jobs is greater than one, files are parsed by a pool of that many
+    processes. If store is a refreshed bench_cache.RevisionStore for the
+    directory, the bench files are taken from it rather than by listing the
+    directory, files parsed by earlier runs are read from it and newly
+    parsed files are added to it. The results are identical in all cases.
+
+    Returns a bench_util.BenchTable of the data points, whose rows carry
+    their revision and are in file order.
     
-    (str, {str, str}, Number, Number) -> {int:[BenchDataPoints]}"""
-    revision_data_points = {} # {revision : [BenchDataPoints]}
-    file_list = os.listdir(directory)
-    file_list.sort()
+    (str, {str, str}, Number, Number, str, int, RevisionStore) -> BenchTable"""
+    bench_files = [] # [(revision, scalar_type, path)]
+    file_list = []
+    if store is not None:
+        bench_files = store.bench_files(oldest_revision, newest_revision)
+    else:
+        file_list = os.listdir(directory)
+        file_list.sort()
     for bench_file in file_list:
         file_name_match = re.match('bench_r(\d+)_(\S+)', bench_file)
         if (file_name_match is None):
@@ -126,15 +258,49 @@ def parse_dir(directory, default_settings, oldest_revision, newest_revision,
         if (revision < oldest_revision or revision > newest_revision):
             continue
 
-        file_handle = open(directory + '/' + bench_file, 'r')
-
-        if (revision not in revision_data_points):
-            revision_data_points[revision] = []
+        bench_files.append((revision, scalar_type,
+                            directory + '/' + bench_file))
+
+    results = [] # [({str, str}, BenchTable)] in bench_files order
+    tasks = [] # [(path, settings, rep)] for files to parse
+    missing = [] # indices of tasks in results
+    for revision, scalar_type, path in bench_files:
+        file_settings = dict(default_settings)
+        file_settings['scalar'] = scalar_type
+        result = None
+        if store is not None:
+            result = store.get(path, (file_settings, rep))
+        if result is None:
+            missing.append(len(results))
+            tasks.append((path, file_settings, rep))
+        results.append(result)
+
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            parsed = pool.map(_parse_bench_file, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parsed = map(_parse_bench_file, tasks)
+    for index, task, result in zip(missing, tasks, parsed):
+        if store is not None:
+            path, file_settings, rep = task
+            store.put(path, (file_settings, rep), result)
+        results[index] = result
+    if store is not None:
+        store.trim()
+
+    # Merge in file order. Points from files without a settings line share
+    # default_settings itself, which ends up with the last file's scalar.
+    table = bench_util.BenchTable()
+    for (revision, scalar_type, _), (file_settings, file_table) in zip(
+            bench_files, results):
         default_settings['scalar'] = scalar_type
-        revision_data_points[revision].extend(
-                        bench_util.parse(default_settings, file_handle, rep))
-        file_handle.close()
-    return revision_data_points
+        file_table.replace_settings(file_settings, default_settings)
+        table.extend_table(file_table, revision)
+    return table
 
 def add_to_revision_data_points(new_point, revision, revision_data_points):
     """Add new_point to set of revision_data_points we are building up.
@@ -143,24 +309,55 @@ def add_to_revision_data_points(new_point, revision, revision_data_points):
         revision_data_points[revision] = []
     revision_data_points[revision].append(new_point)
 
-def filter_data_points(unfiltered_revision_data_points):
+def filter_data_points(unfiltered_data_points):
     """Filter out any data points that are utterly bogus.
 
-    Returns (allowed_revision_data_points, ignored_revision_data_points):
-        allowed_revision_data_points: points that survived the filter
-        ignored_revision_data_points: points that did NOT survive the filter
+    Takes a bench_util.BenchTable whose rows carry their revision.
+    Returns (allowed_data_points, ignored_revision_data_points):
+        allowed_data_points: a BenchTable of the points that survived the
+            filter, in the same order
+        ignored_revision_data_points: points that did NOT survive the filter,
+            as {revision : [BenchDataPoints]}
     """
-    allowed_revision_data_points = {} # {revision : [BenchDataPoints]}
+    allowed = [] # indices of allowed rows
     ignored_revision_data_points = {} # {revision : [BenchDataPoints]}
-    revisions = unfiltered_revision_data_points.keys()
-    revisions.sort()
-    for revision in revisions:
-        for point in unfiltered_revision_data_points[revision]:
-            if point.time < MIN_REASONABLE_TIME or point.time > MAX_REASONABLE_TIME:
-                add_to_revision_data_points(point, revision, ignored_revision_data_points)
-            else:
-                add_to_revision_data_points(point, revision, allowed_revision_data_points)
-    return (allowed_revision_data_points, ignored_revision_data_points)
+    for i, time in enumerate(unfiltered_data_points.times):
+        if time < MIN_REASONABLE_TIME or time > MAX_REASONABLE_TIME:
+            add_to_revision_data_points(unfiltered_data_points.point(i),
+                                        unfiltered_data_points.revisions[i],
+                                        ignored_revision_data_points)
+        else:
+            allowed.append(i)
+    if len(allowed) == len(unfiltered_data_points):
+        return (unfiltered_data_points, ignored_revision_data_points)
+    return (unfiltered_data_points.take(allowed), ignored_revision_data_points)
+
+def filter_outliers(lines, ignored_revision_data_points):
+    """Removes the points which stand out from their neighbours from each
+    line, and adds them to ignored_revision_data_points.
+
+    The newest point of each line is always kept, as the expectations are
+    checked against it. Returns the number of points removed.
+    ({Label:[(x,y)]}, {int:[BenchDataPoint]}) -> int"""
+    num_outliers = 0
+    for label, line in lines.items():
+        outliers = bench_util.FindOutliers([time for _, time in line])
+        if outliers and outliers[-1] == len(line) - 1:
+            outliers.pop()
+        if not outliers:
+            continue
+        for index in outliers:
+            revision, time = line[index]
+            add_to_revision_data_points(
+                bench_util.BenchDataPoint(label.bench, label.config,
+                                          label.time_type, time,
+                                          label.settings),
+                revision, ignored_revision_data_points)
+        outliers = set(outliers)
+        lines[label] = [point for index, point in enumerate(line)
+                        if index not in outliers]
+        num_outliers += len(outliers)
+    return num_outliers
 
 def get_abs_path(relative_path):
     """My own implementation of os.path.abspath() that better handles paths
@@ -200,7 +397,8 @@ def create_lines(revision_data_points, settings
     
     Args:
       revision_data_points: a dictionary with integer keys (revision #) and a
-          list of bench data points as values
+          list of bench data points as values, or a bench_util.BenchTable
+          whose rows carry their revision
       settings: a dictionary of setting names to value
       bench_of_interest: optional filter parameters: which bench type is of
           interest. If None, process them all.
@@ -216,9 +414,26 @@ def create_lines(revision_data_points, settings
           values = a list of (x, y) tuples sorted such that x values increase
               monotonically
     """
+    lines = {} # {Label:[(x,y)] | x[n] <= x[n+1]}
+    interner = LabelInterner()
+    if isinstance(revision_data_points, bench_util.BenchTable):
+        table = revision_data_points
+        indices = table.select(bench_of_interest, config_of_interest,
+                               time_of_interest, time_to_ignore, settings)
+        # sort is stable, so rows of a revision keep their order.
+        indices.sort(key=table.revisions.__getitem__)
+        for (revision, bench, config, time_type, time,
+             point_settings) in table.rows(indices):
+            line_name = interner.get(bench, config, time_type, point_settings)
+            if line_name not in lines:
+                lines[line_name] = []
+            lines[line_name].append((revision, time))
+        return lines
+
+    settings_match = settings_filter(settings)
+
     revisions = revision_data_points.keys()
     revisions.sort()
-    lines = {} # {Label:[(x,y)] | x[n] <= x[n+1]}
     for revision in revisions:
         for point in revision_data_points[revision]:
             if (bench_of_interest is not None and
@@ -236,18 +451,13 @@ def create_lines(revision_data_points, settings
                   time_to_ignore == point.time_type):
                 continue
             
-            skip = False
-            for key, value in settings.items():
-                if key in point.settings and point.settings[key] != value:
-                    skip = True
-                    break
-            if skip:
+            if not settings_match(point.settings):
                 continue
             
-            line_name = Label(point.bench
-                            , point.config
-                            , point.time_type
-                            , point.settings)
+            line_name = interner.get(point.bench
+                                   , point.config
+                                   , point.time_type
+                                   , point.settings)
             
             if line_name not in lines:
                 lines[line_name] = []
@@ -274,23 +484,55 @@ def bounds(lines):
             
     return ((min_x, min_y), (max_x, max_y))
 
-def create_regressions(lines, start_x, end_x):
+def create_regressions(lines, start_x, end_x
+                     , engine=bench_util.REGRESSION_LEAST_SQUARES):
     """Creates regression data from line segments.
     
-    ({Label:[(x,y)] | [n].x <= [n+1].x}, Number, Number)
+    engine is one of bench_util.REGRESSION_ENGINES.
+    ({Label:[(x,y)] | [n].x <= [n+1].x}, Number, Number, str)
         -> {Label:LinearRegression}"""
     regressions = {} # {Label : LinearRegression}
     
-    for label, line in lines.iteritems():
-        regression_line = [p for p in line if start_x <= p[0] <= end_x]
-        
-        if (len(regression_line) < 2):
+    labels = lines.keys()
+    if engine == bench_util.REGRESSION_THEIL_SEN:
+        fits = []
+        for label in labels:
+            regression_line = [p for p in lines[label]
+                               if start_x <= p[0] <= end_x]
+            if (len(regression_line) < 2):
+                fits.append(None)
+            else:
+                fits.append(bench_util.TheilSenRegression(regression_line))
+    else:
+        fits = bench_util.FitLinearRegressions(
+                   [lines[label] for label in labels], start_x, end_x)
+    for label, regression in zip(labels, fits):
+        if regression is None:
             continue
-        regression = bench_util.LinearRegression(regression_line)
         regressions[label] = regression
     
     return regressions
 
+def find_change_points(lines):
+    """Finds the revisions at which the level of each line shifted.
+    
+    Each change point is reported with the median value of the line from
+    the previous change point on and up to the next one.
+    ({Label:[(x,y)] | [n].x <= [n+1].x})
+        -> {Label:[(revision, level_before, level_after)]}"""
+    change_points = {} # {Label : [(revision, level_before, level_after)]}
+    
+    for label, line in lines.iteritems():
+        values = [y for _, y in line]
+        splits = bench_util.FindChangePoints(values)
+        if not splits:
+            continue
+        levels = bench_util.SegmentMedians(values, splits)
+        change_points[label] = [(line[split][0], levels[i], levels[i + 1])
+                                for i, split in enumerate(splits)]
+    
+    return change_points
+
 def bounds_slope(regressions):
     """Finds the extreme up and down slopes of a set of linear regressions.
     
@@ -304,51 +546,401 @@ def bounds_slope(regressions):
     
     return (max_up_slope, min_down_slope)
 
+def regression_shading(regressions):
+    """Finds the color and opacity of the line of each regression. Lines
+    which clearly go down are shaded green and lines which clearly go up
+    red, the more opaque the steeper their slope is relative to the
+    steepest one. Lines without a regression have LINE_SHADING.
+    
+    ({Label:LinearRegression}) -> {Label:(r, g, b, opacity)}"""
+    max_up_slope, min_down_slope = bounds_slope(regressions)
+    shading = {}
+    for label, regression in regressions.iteritems():
+        r, g, b, a = LINE_SHADING
+        min_slope = regression.find_min_slope()
+        if min_slope < 0:
+            d = max(0, (min_slope / min_down_slope))
+            g += int(d*128)
+            a += d*0.9
+        elif min_slope > 0:
+            d = max(0, (min_slope / max_up_slope))
+            r += int(d*128)
+            a += d*0.9
+        shading[label] = (r, g, b, a)
+    
+    return shading
+
+def parse_range(range, latest_revision):
+    """Takes '<old>[:<new>]' as a string and returns (old, new).
+    Any revision numbers that are dependent on the latest revision number
+    will be filled in based on latest_revision.
+    """
+    old, _, new = range.partition(":")
+    old = int(old)
+    if old < 0:
+        old += latest_revision;
+    if not new:
+        new = latest_revision;
+    new = int(new)
+    if new < 0:
+        new += latest_revision;
+    return (old, new)
+
+def find_expectation_failures(lines, expectations, newest_revision,
+                              key_suffix):
+    """Returns descriptions of the benches in latest rev outside their
+    range in the ExpectationIndex expectations. Each also gets a URL link for
+    the dashboard plot.
+    The link history token format here only works for single-line plots.
+    """
+    # The platform for this bot, to pass to the dashboard plot.
+    platform = key_suffix[ : key_suffix.rfind('-')]
+    # Starting revision for the dashboard plot.
+    start_rev = str(newest_revision - 100)  # Displays about 100 revisions.
+    rows = [] # [<Bench_BmpConfig_TimeType>] of the lines at newest_revision
+    values = []
+    for line in lines:
+        this_revision, this_bench_value = lines[line][-1]
+        if this_revision != newest_revision:
+            # Skip benches without value for latest revision.
+            continue
+        rows.append('%s_%s_%s' % (line.bench, line.config, line.time_type))
+        values.append(this_bench_value)
+
+    exceptions = []
+    for i, this_min, this_max in expectations.check(rows, key_suffix, values):
+        line_str = rows[i]
+        bench_platform_key = line_str + ',' + key_suffix
+        link = ''
+        # For skp benches out of range, create dashboard plot link.
+        if line_str.find('.skp_') > 0:
+            # Extract bench and config for dashboard plot.
+            bench, config = line_str.strip('_').split('.skp_')
+            link = ' <a href="'
+            link += 'http://go/skpdash/SkpDash.html#%s~%s~%s~%s" ' % (
+                start_rev, bench, platform, config)
+            link += 'target="_blank">graph</a>'
+        exception = 'Bench %s value %s out of range [%s, %s].%s' % (
+            bench_platform_key, values[i], this_min, this_max, link)
+        exceptions.append(exception)
+    return exceptions
+
+def expectation_report(exceptions):
+    """Returns the report of the unmet expectations described by exceptions.
+    """
+    return 'Bench values out of range:\n' + '\n'.join(exceptions)
+
+def write_to_appengine(line_data_dict, url, newest_revision, bot,
+                       spool_path):
+    """Writes latest bench values to appengine datastore.
+      line_data_dict: dictionary from create_lines.
+      url: the appengine url used to send bench values to write
+      newest_revision: the latest revision that this script reads
+      bot: the bot platform the bench is run on
+      spool_path: file keeping the values which could not be written, to be
+        written first on the next run
+    """
+    config_data_dic = {}
+    for label in line_data_dict.iterkeys():
+        if not label.bench.endswith('.skp') or label.time_type:
+            # filter out non-picture and non-walltime benches
+            continue
+        config = label.config
+        rev, val = line_data_dict[label][-1]
+        # This assumes that newest_revision is >= the revision of the last
+        # data point we have for each line.
+        if rev != newest_revision:
+            continue
+        if config not in config_data_dic:
+            config_data_dic[config] = []
+        config_data_dic[config].append(label.bench.replace('.skp', '') +
+            ':%.2f' % val)
+    payloads = []
+    for config in config_data_dic:
+        if config_data_dic[config]:
+            payloads.append({'master': 'Skia', 'bot': bot, 'test': config,
+                             'revision': newest_revision,
+                             'benches': ','.join(config_data_dic[config])})
+    spooled = bench_upload.upload_with_spool(bench_upload.Uploader(url),
+                                             payloads, spool_path)
+    if spooled:
+        sys.stderr.write("Spooled %d payloads to %s for the next run.\n" % (
+            spooled, spool_path))
+
+class GraphOptions:
+    """The command line options shared by every platform graphed in a run.
+    
+    bench_expectations is a bench_expectations.ExpectationIndex."""
+    def __init__(self, settings, default_settings, bench_of_interest,
+                 config_of_interest, time_of_interest, time_to_ignore, rep,
+                 revision_range, regression_range, requested_width,
+                 requested_height, jobs, use_cache, regression_engine,
+                 show_change_points, max_points, appengine_url,
+                 bench_expectations, filter_outliers=False,
+                 cache_max_bytes=bench_cache.DEFAULT_MAX_BYTES):
+        self.settings = settings
+        self.default_settings = default_settings
+        self.bench_of_interest = bench_of_interest
+        self.config_of_interest = config_of_interest
+        self.time_of_interest = time_of_interest
+        self.time_to_ignore = time_to_ignore
+        self.rep = rep
+        self.revision_range = revision_range
+        self.regression_range = regression_range
+        self.requested_width = requested_width
+        self.requested_height = requested_height
+        self.jobs = jobs
+        self.use_cache = use_cache
+        self.regression_engine = regression_engine
+        self.show_change_points = show_change_points
+        self.max_points = max_points
+        self.appengine_url = appengine_url
+        self.bench_expectations = bench_expectations
+        self.filter_outliers = filter_outliers
+        self.cache_max_bytes = cache_max_bytes
+
+def graph_platform(directory, title, output_file, dashboard_path, options):
+    """Graphs the bench data of one platform and checks its expectations.
+    
+    Writes the xhtml graph to output_file and the dashboard to
+    dashboard_path, each if not None. Returns the change point reports, if
+    options.show_change_points is set, and the descriptions of the unmet
+    expectations.
+    (str, str, file?, str?, GraphOptions) -> ([str], [str])"""
+    rep = options.rep
+    # The title flag (-l) provided in buildbot slave is in the format
+    # Bench_Performance_for_<platform>, and we want to extract <platform>
+    # for use in platform_and_alg to track matching benches later. If title flag
+    # is not in this format, there may be no matching benches in the file
+    # provided by the expectation_file flag (-e).
+    bot = title  # To store the platform as bot name
+    platform_and_alg = title
+    if platform_and_alg.startswith(TITLE_PREAMBLE):
+        bot = platform_and_alg[TITLE_PREAMBLE_LENGTH:]
+        platform_and_alg = bot + '-' + rep
+    title += ' [representation: %s]' % rep
+
+    store = None
+    if options.use_cache:
+        store = bench_cache.RevisionStore(
+            directory, max_bytes=options.cache_max_bytes)
+        store.refresh()
+        latest_revision = store.latest_revision()
+    else:
+        latest_revision = get_latest_revision(directory)
+    oldest_revision, newest_revision = parse_range(options.revision_range,
+                                                   latest_revision)
+    oldest_regression, newest_regression = parse_range(
+        options.regression_range, latest_revision)
+
+    unfiltered_data_points = parse_dir(directory
+                                   , options.default_settings
+                                   , oldest_revision
+                                   , newest_revision
+                                   , rep
+                                   , options.jobs
+                                   , store=store)
+
+    # Filter out any data points that are utterly bogus... make sure to report
+    # that we did so later!
+    (allowed_data_points, ignored_revision_data_points) = filter_data_points(
+        unfiltered_data_points)
+
+    # Update oldest_revision and newest_revision based on the data we could find
+    oldest_revision = min(allowed_data_points.revisions)
+    newest_revision = max(allowed_data_points.revisions)
+
+    lines = create_lines(allowed_data_points
+                   , options.settings
+                   , options.bench_of_interest
+                   , options.config_of_interest
+                   , options.time_of_interest
+                   , options.time_to_ignore)
+
+    num_outliers = 0
+    if options.filter_outliers:
+        num_outliers = filter_outliers(lines, ignored_revision_data_points)
+
+    regressions = create_regressions(lines
+                                   , oldest_regression
+                                   , newest_regression
+                                   , options.regression_engine)
+
+    change_point_reports = []
+    if options.show_change_points:
+        change_points = find_change_points(lines)
+        for label in sorted(change_points, key=str):
+            for revision, before, after in change_points[label]:
+                change_point_reports.append(
+                    'Change point: %s shifted at r%s from %s to %s.' % (
+                        label, revision, before, after))
+
+    if output_file is not None:
+        output_xhtml(lines, oldest_revision, newest_revision,
+                     ignored_revision_data_points, regressions,
+                     options.requested_width, options.requested_height, title,
+                     options.max_points, output_file, num_outliers)
+
+    if dashboard_path:
+        bench_dashboard.write_dashboard(
+            get_abs_path(dashboard_path), lines, regressions,
+            oldest_revision, newest_revision, title,
+            sum([len(points) for points
+                 in ignored_revision_data_points.itervalues()]),
+            options.max_points, regression_shading(regressions))
+
+    if options.appengine_url:
+        write_to_appengine(lines, options.appengine_url, newest_revision, bot,
+                           bench_upload.default_spool_path(directory))
+
+    expectation_failures = []
+    if options.bench_expectations:
+        expectation_failures = find_expectation_failures(
+            lines, options.bench_expectations, newest_revision,
+            platform_and_alg)
+    return (change_point_reports, expectation_failures)
+
+def batch_output_name(title):
+    """Returns a file name for the graph of the platform with the given title.
+    """
+    return re.sub('[^\w.-]', '_', title)
+
+def _graph_platform_task(task):
+    """Runs graph_platform for one platform of a batch, possibly in a worker
+    process. The graph is written to the file output_path, if set.
+    
+    Returns the results of graph_platform and None, or None and the error
+    which stopped the platform from being graphed.
+    ((str, str, str?, str?, GraphOptions)) -> (([str], [str])?, str?)"""
+    directory, title, output_path, dashboard_path, options = task
+    output_file = None
+    try:
+        if output_path:
+            output_file = open(get_abs_path(output_path), 'w')
+        result = graph_platform(directory, title, output_file, dashboard_path,
+                                options)
+        if output_file is not None:
+            output_file.close()
+        return (result, None)
+    except Exception:
+        error = traceback.format_exc()
+        # Do not leave a partial graph behind.
+        if output_file is not None:
+            output_file.close()
+            os.remove(output_file.name)
+        return (None, error)
+
+def graph_batch(directories, titles, output_dir, dashboard_dir, options,
+                console):
+    """Graphs the platforms in directories, titled titles, in a pool of
+    options.jobs worker processes.
+    
+    Each platform's graph is written to output_dir and its dashboard to a
+    directory in dashboard_dir, if they are set, both named after its title.
+    Change points are reported to console as each platform finishes. The
+    platforms which could not be graphed and the unmet expectations of all
+    the others are raised together in one Exception at the end.
+    ([str], [str], str?, str?, GraphOptions, file) -> None"""
+    tasks = []
+    for directory, title in zip(directories, titles):
+        output_path = None
+        if output_dir:
+            output_path = os.path.join(output_dir,
+                                       batch_output_name(title) + '.xhtml')
+        dashboard_path = None
+        if dashboard_dir:
+            dashboard_path = os.path.join(dashboard_dir,
+                                          batch_output_name(title))
+        platform_options = copy.copy(options)
+        # parse_dir changes default_settings, so each platform needs its own.
+        platform_options.default_settings = dict(options.default_settings)
+        platform_options.jobs = 1
+        tasks.append((directory, title, output_path, dashboard_path,
+                      platform_options))
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    if options.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(options.jobs)
+        try:
+            results = pool.imap(_graph_platform_task, tasks)
+            errors, expectation_failures = _report_batch(
+                directories, results, console)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        errors, expectation_failures = _report_batch(
+            directories, itertools.imap(_graph_platform_task, tasks), console)
+
+    reports = []
+    if errors:
+        reports.append('Could not graph %d of %d platforms:\n%s' % (
+            len(errors), len(tasks), '\n'.join(errors)))
+    if expectation_failures:
+        reports.append(expectation_report(expectation_failures))
+    if reports:
+        raise Exception('\n'.join(reports))
+
+def _report_batch(directories, results, console):
+    """Reports the change points of each platform's result to console as it
+    comes in, and gathers the errors and unmet expectations of all of them.
+    
+    ([str], iter((([str], [str])?, str?)), file) -> ([str], [str])"""
+    errors = []
+    expectation_failures = []
+    for directory, (result, error) in itertools.izip(directories, results):
+        if error is not None:
+            errors.append('%s: %s' % (directory, error))
+            continue
+        change_point_reports, failures = result
+        for report in change_point_reports:
+            print >> console, report
+        expectation_failures.extend(failures)
+    return (errors, expectation_failures)
+
 def main():
     """Parses command line and writes output."""
     
+    # -o redirects stdout to the graph, so reports go here instead.
+    console = sys.stdout
+
     try:
         opts, _ = getopt.getopt(sys.argv[1:]
                                  , "a:b:c:d:e:f:i:l:m:o:r:s:t:x:y:"
-                                 , "default-setting=")
+                                 , ["dashboard=", "default-setting="
+                                   , "jobs=", "no-cache", "cache-size="
+                                   , "regression=", "change-points"
+                                   , "max-points=", "filter-outliers"])
     except getopt.GetoptError, err:
         print str(err) 
         usage()
         sys.exit(2)
     
-    directory = None
+    directories = []
     config_of_interest = None
     bench_of_interest = None
     time_of_interest = None
     time_to_ignore = None
     output_path = None
-    bench_expectations = {}
+    dashboard_path = None
+    expectations = bench_expectations.ExpectationIndex()
     appengine_url = None  # used for adding data to appengine datastore
     rep = None  # bench representation algorithm
     revision_range = '0:'
     regression_range = '0:'
-    latest_revision = None
     requested_height = None
     requested_width = None
-    title = 'Bench graph'
+    titles = []
     settings = {}
     default_settings = {}
-
-    def parse_range(range):
-        """Takes '<old>[:<new>]' as a string and returns (old, new).
-        Any revision numbers that are dependent on the latest revision number
-        will be filled in based on latest_revision.
-        """
-        old, _, new = range.partition(":")
-        old = int(old)
-        if old < 0:
-            old += latest_revision;
-        if not new:
-            new = latest_revision;
-        new = int(new)
-        if new < 0:
-            new += latest_revision;
-        return (old, new)
+    jobs = 1
+    use_cache = True
+    cache_max_bytes = bench_cache.DEFAULT_MAX_BYTES
+    regression_engine = bench_util.REGRESSION_LEAST_SQUARES
+    show_change_points = False
+    max_points = None
+    use_outlier_filter = False
 
     def add_setting(settings, setting):
         """Takes <key>[=<value>] adds {key:value} or {key:True} to settings."""
@@ -358,102 +950,6 @@ def main():
         else:
             settings[name] = value
 
-    def read_expectations(expectations, filename):
-        """Reads expectations data from file and put in expectations dict."""
-        for expectation in open(filename).readlines():
-            elements = expectation.strip().split(',')
-            if not elements[0] or elements[0].startswith('#'):
-                continue
-            if len(elements) != 5:
-                raise Exception("Invalid expectation line format: %s" %
-                                expectation)
-            bench_entry = elements[0] + ',' + elements[1]
-            if bench_entry in expectations:
-                raise Exception("Dup entries for bench expectation %s" %
-                                bench_entry)
-            # [<Bench_BmpConfig_TimeType>,<Platform-Alg>] -> (LB, UB)
-            expectations[bench_entry] = (float(elements[-2]),
-                                         float(elements[-1]))
-
-    def check_expectations(lines, expectations, newest_revision, key_suffix):
-        """Check if there are benches in latest rev outside expected range.
-        For exceptions, also outputs URL link for the dashboard plot.
-        The link history token format here only works for single-line plots.
-        """
-        # The platform for this bot, to pass to the dashboard plot.
-        platform = key_suffix[ : key_suffix.rfind('-')]
-        # Starting revision for the dashboard plot.
-        start_rev = str(newest_revision - 100)  # Displays about 100 revisions.
-        exceptions = []
-        for line in lines:
-            line_str = str(line)
-            line_str = line_str[ : line_str.find('_{')]
-            bench_platform_key = line_str + ',' + key_suffix
-            this_revision, this_bench_value = lines[line][-1]
-            if (this_revision != newest_revision or
-                bench_platform_key not in expectations):
-                # Skip benches without value for latest revision.
-                continue
-            this_min, this_max = expectations[bench_platform_key]
-            if this_bench_value < this_min or this_bench_value > this_max:
-                link = ''
-                # For skp benches out of range, create dashboard plot link.
-                if line_str.find('.skp_') > 0:
-                    # Extract bench and config for dashboard plot.
-                    bench, config = line_str.strip('_').split('.skp_')
-                    link = ' <a href="'
-                    link += 'http://go/skpdash/SkpDash.html#%s~%s~%s~%s" ' % (
-                        start_rev, bench, platform, config)
-                    link += 'target="_blank">graph</a>'
-                exception = 'Bench %s value %s out of range [%s, %s].%s' % (
-                    bench_platform_key, this_bench_value, this_min, this_max,
-                    link)
-                exceptions.append(exception)
-        if exceptions:
-            raise Exception('Bench values out of range:\n' +
-                            '\n'.join(exceptions))
-
-    def write_to_appengine(line_data_dict, url, newest_revision, bot):
-        """Writes latest bench values to appengine datastore.
-          line_data_dict: dictionary from create_lines.
-          url: the appengine url used to send bench values to write
-          newest_revision: the latest revision that this script reads
-          bot: the bot platform the bench is run on
-        """
-        config_data_dic = {}
-        for label in line_data_dict.iterkeys():
-            if not label.bench.endswith('.skp') or label.time_type:
-                # filter out non-picture and non-walltime benches
-                continue
-            config = label.config
-            rev, val = line_data_dict[label][-1]
-            # This assumes that newest_revision is >= the revision of the last
-            # data point we have for each line.
-            if rev != newest_revision:
-                continue
-            if config not in config_data_dic:
-                config_data_dic[config] = []
-            config_data_dic[config].append(label.bench.replace('.skp', '') +
-                ':%.2f' % val)
-        for config in config_data_dic:
-            if config_data_dic[config]:
-                data = {'master': 'Skia', 'bot': bot, 'test': config,
-                        'revision': newest_revision,
-                        'benches': ','.join(config_data_dic[config])}
-                req = urllib2.Request(appengine_url,
-                    urllib.urlencode({'data': json.dumps(data)}))
-                try:
-                    urllib2.urlopen(req)
-                except urllib2.HTTPError, e:
-                    sys.stderr.write("HTTPError for JSON data %s: %s\n" % (
-                        data, e))
-                except urllib2.URLError, e:
-                    sys.stderr.write("URLError for JSON data %s: %s\n" % (
-                        data, e))
-                except httplib.HTTPException, e:
-                    sys.stderr.write("HTTPException for JSON data %s: %s\n" % (
-                        data, e))
-
     try:
         for option, value in opts:
             if option == "-a":
@@ -463,20 +959,19 @@ def main():
             elif option == "-c":
                 config_of_interest = value
             elif option == "-d":
-                directory = value
+                directories.append(value)
             elif option == "-e":
-                read_expectations(bench_expectations, value)
+                expectations.merge(bench_expectations.load(value))
             elif option == "-f":
                 regression_range = value
             elif option == "-i":
                 time_to_ignore = value
             elif option == "-l":
-                title = value
+                titles.append(value)
             elif option == "-m":
                 rep = value
             elif option == "-o":
                 output_path = value
-                redirect_stdout(output_path)
             elif option == "-r":
                 revision_range = value
             elif option == "-s":
@@ -487,79 +982,77 @@ def main():
                 requested_width = int(value)
             elif option == "-y":
                 requested_height = int(value)
+            elif option == "--dashboard":
+                dashboard_path = value
             elif option == "--default-setting":
                 add_setting(default_settings, value)
+            elif option == "--jobs":
+                jobs = int(value)
+            elif option == "--no-cache":
+                use_cache = False
+            elif option == "--cache-size":
+                cache_max_bytes = int(value) << 20
+            elif option == "--regression":
+                if value not in bench_util.REGRESSION_ENGINES:
+                    raise ValueError('Unknown regression engine %s' % value)
+                regression_engine = value
+            elif option == "--change-points":
+                show_change_points = True
+            elif option == "--filter-outliers":
+                use_outlier_filter = True
+            elif option == "--max-points":
+                max_points = int(value)
+                if max_points < 3:
+                    raise ValueError('--max-points must be at least 3')
             else:
                 usage()
                 assert False, "unhandled option"
+        if len(directories) > 1 and len(titles) != len(directories):
+            raise ValueError('Each -d needs its own -l in batch mode')
     except ValueError:
         usage()
         sys.exit(2)
 
-    if directory is None:
+    if not directories:
         usage()
         sys.exit(2)
 
-    if not output_path:
+    batch = len(directories) > 1
+    if output_path and not batch:
+        redirect_stdout(output_path)
+
+    if not output_path and not dashboard_path:
         print 'Warning: No output path provided. No graphs will be written.'
 
     if time_of_interest:
         time_to_ignore = None
 
-    # The title flag (-l) provided in buildbot slave is in the format
-    # Bench_Performance_for_<platform>, and we want to extract <platform>
-    # for use in platform_and_alg to track matching benches later. If title flag
-    # is not in this format, there may be no matching benches in the file
-    # provided by the expectation_file flag (-e).
-    bot = title  # To store the platform as bot name
-    platform_and_alg = title
-    if platform_and_alg.startswith(TITLE_PREAMBLE):
-        bot = platform_and_alg[TITLE_PREAMBLE_LENGTH:]
-        platform_and_alg = bot + '-' + rep
-    title += ' [representation: %s]' % rep
-
-    latest_revision = get_latest_revision(directory)
-    oldest_revision, newest_revision = parse_range(revision_range)
-    oldest_regression, newest_regression = parse_range(regression_range)
-
-    unfiltered_revision_data_points = parse_dir(directory
-                                   , default_settings
-                                   , oldest_revision
-                                   , newest_revision
-                                   , rep)
-
-    # Filter out any data points that are utterly bogus... make sure to report
-    # that we did so later!
-    (allowed_revision_data_points, ignored_revision_data_points) = filter_data_points(
-        unfiltered_revision_data_points)
-
-    # Update oldest_revision and newest_revision based on the data we could find
-    all_revision_numbers = allowed_revision_data_points.keys()
-    oldest_revision = min(all_revision_numbers)
-    newest_revision = max(all_revision_numbers)
-
-    lines = create_lines(allowed_revision_data_points
-                   , settings
-                   , bench_of_interest
-                   , config_of_interest
-                   , time_of_interest
-                   , time_to_ignore)
-
-    regressions = create_regressions(lines
-                                   , oldest_regression
-                                   , newest_regression)
+    options = GraphOptions(settings, default_settings, bench_of_interest,
+                           config_of_interest, time_of_interest,
+                           time_to_ignore, rep, revision_range,
+                           regression_range, requested_width,
+                           requested_height, jobs, use_cache,
+                           regression_engine, show_change_points, max_points,
+                           appengine_url, expectations, use_outlier_filter,
+                           cache_max_bytes)
+
+    if batch:
+        graph_batch(directories, titles, output_path, dashboard_path, options,
+                    console)
+        return
 
+    output_file = None
     if output_path:
-        output_xhtml(lines, oldest_revision, newest_revision,
-                     ignored_revision_data_points, regressions, requested_width,
-                     requested_height, title)
-
-    if appengine_url:
-        write_to_appengine(lines, appengine_url, newest_revision, bot)
-
-    if bench_expectations:
-        check_expectations(lines, bench_expectations, newest_revision,
-                           platform_and_alg)
+        output_file = sys.stdout
+    title = 'Bench graph'
+    if titles:
+        title = titles[-1]
+    change_point_reports, expectation_failures = graph_platform(
+        directories[-1], title, output_file, dashboard_path, options)
+    for report in change_point_reports:
+        print >> console, report
+    if expectation_failures:
+        raise Exception(expectation_report(expectation_failures))
 
 def qa(out):
     """Stringify input and quote as an xml attribute."""
@@ -568,10 +1061,36 @@ def qe(out):
     """Stringify input and escape as xml data."""
     return xml.sax.saxutils.escape(str(out))
 
-def create_select(qualifier, lines, select_id=None):
+class OutputBuffer:
+    """Gathers output in a list of strings and writes it out in large chunks.
+    
+    Writing each piece to the output file as it is produced costs a call and
+    a bit of softspace bookkeeping per piece, which adds up over the tens of
+    thousands of elements of a large graph."""
+    def __init__(self, output_file, chunk_size=OUTPUT_CHUNK_SIZE):
+        self.output_file = output_file
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.size = 0
+    
+    def write(self, text):
+        """Appends text, writing out the gathered chunks once large enough."""
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+    
+    def flush(self):
+        """Writes out everything gathered so far."""
+        if self.chunks:
+            self.output_file.write(''.join(self.chunks))
+            self.chunks = []
+            self.size = 0
+
+def create_select(qualifier, lines, out, select_id=None):
     """Output select with options showing lines which qualifier maps to it.
     
-    ((Label) -> str, {Label:_}, str?) -> _"""
+    ((Label) -> str, {Label:_}, OutputBuffer, str?) -> _"""
     options = {} #{ option : [Label]}
     for label in lines.keys():
         option = qualifier(label)
@@ -580,18 +1099,22 @@ def create_select(qualifier, lines, select_id=None):
         options[option].append(label)
     option_list = list(options.keys())
     option_list.sort()
-    print '<select class="lines"',
+    out.write('<select class="lines"')
     if select_id is not None:
-        print 'id=%s' % qa(select_id)
-    print 'multiple="true" size="10" onchange="updateSvg();">'
+        out.write(' id=%s\n' % qa(select_id))
+    else:
+        out.write(' ')
+    out.write('multiple="true" size="10" onchange="updateSvg();">\n')
     for option in option_list:
-        print '<option value=' + qa('[' + 
-        reduce(lambda x,y:x+json.dumps(str(y))+',',options[option],"")[0:-1]
-        + ']') + '>'+qe(option)+'</option>'
-    print '</select>'
-
-def output_ignored_data_points_warning(ignored_revision_data_points):
-    """Write description of ignored_revision_data_points to stdout as xhtml.
+        out.write('<option value=' + qa('[' +
+            ','.join([json.dumps(str(label)) for label in options[option]])
+            + ']') + '>' + qe(option) + '</option>\n')
+    out.write('</select>\n')
+
+def output_ignored_data_points_warning(ignored_revision_data_points, out,
+                                       num_outliers=0):
+    """Write description of ignored_revision_data_points to out as xhtml.
+    num_outliers of them were discarded by filter_outliers.
     """
     num_ignored_points = 0
     description = ''
@@ -607,32 +1130,45 @@ def output_ignored_data_points_warning(ignored_revision_data_points):
             points_at_this_revision.sort()
             description += 'r%d: %s\n' % (revision, points_at_this_revision)
     if num_ignored_points == 0:
-        print 'Did not discard any data points; all were within the range [%d-%d]' % (
-            MIN_REASONABLE_TIME, MAX_REASONABLE_TIME)
+        out.write('Did not discard any data points; all were within the range'
+                  ' [%d-%d]\n' % (MIN_REASONABLE_TIME, MAX_REASONABLE_TIME))
     else:
-        print '<table width="100%" bgcolor="ff0000"><tr><td align="center">'
-        print 'Discarded %d data points outside of range [%d-%d]' % (
-            num_ignored_points, MIN_REASONABLE_TIME, MAX_REASONABLE_TIME)
-        print '</td></tr><tr><td width="100%" align="center">'
-        print ('<textarea rows="4" style="width:97%" readonly="true" wrap="off">'
-            + qe(description) + '</textarea>')
-        print '</td></tr></table>'
+        out.write('<table width="100%" bgcolor="ff0000">'
+                  '<tr><td align="center">\n')
+        out.write('Discarded %d data points outside of range [%d-%d]' % (
+            num_ignored_points - num_outliers, MIN_REASONABLE_TIME,
+            MAX_REASONABLE_TIME))
+        if num_outliers:
+            out.write(' and %d outliers' % num_outliers)
+        out.write('\n')
+        out.write('</td></tr><tr><td width="100%" align="center">\n')
+        out.write('<textarea rows="4" style="width:97%" readonly="true"'
+            ' wrap="off">' + qe(description) + '</textarea>\n')
+        out.write('</td></tr></table>\n')
 
 def output_xhtml(lines, oldest_revision, newest_revision, ignored_revision_data_points,
-                 regressions, requested_width, requested_height, title):
-    """Outputs an svg/xhtml view of the data."""
-    print '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN"',
-    print '"http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">'
-    print '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en">'
-    print '<head>'
-    print '<title>%s</title>' % qe(title)
-    print '</head>'
-    print '<body>'
+                 regressions, requested_width, requested_height, title,
+                 max_points=None, output_file=None, num_outliers=0):
+    """Outputs an svg/xhtml view of the data to output_file, or stdout.
+    
+    If max_points is set, draws at most that many points per line.
+    num_outliers of the ignored points were discarded by filter_outliers."""
+    if output_file is None:
+        output_file = sys.stdout
+    out = OutputBuffer(output_file)
+    out.write('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN"'
+              ' "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">\n')
+    out.write('<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en">\n')
+    out.write('<head>\n')
+    out.write('<title>%s</title>\n' % qe(title))
+    out.write('</head>\n')
+    out.write('<body>\n')
     
-    output_svg(lines, regressions, requested_width, requested_height)
+    output_svg(lines, regressions, requested_width, requested_height, out,
+               max_points)
 
     #output the manipulation controls
-    print """
+    out.write("""
 <script type="text/javascript">//<![CDATA[
     function getElementsByClass(node, searchClass, tag) {
         var classElements = new Array();
@@ -712,7 +1248,8 @@ def output_xhtml(lines, oldest_revision, newest_revision, ignored_revision_data_
             }
         }
     }
-//]]></script>"""
+//]]></script>
+""")
 
     all_settings = {}
     variant_settings = set()
@@ -723,9 +1260,9 @@ def output_xhtml(lines, oldest_revision, newest_revision, ignored_revision_data_
             elif all_settings[key] != value:
                 variant_settings.add(key)
 
-    print '<table border="0" width="%s">' % requested_width
+    out.write('<table border="0" width="%s">\n' % requested_width)
     #output column headers
-    print """
+    out.write("""
 <tr valign="top"><td width="50%">
 <table border="0" width="100%">
 <tr><td align="center"><table border="0">
@@ -734,49 +1271,54 @@ def output_xhtml(lines, oldest_revision, newest_revision, ignored_revision_data_
 <td width="1">Bench&nbsp;Type</td>
 <td width="1">Bitmap Config</td>
 <td width="1">Timer&nbsp;Type (Cpu/Gpu/wall)</td>
-"""
+
+""")
 
     for k in variant_settings:
-        print '<td width="1">%s</td>' % qe(k)
+        out.write('<td width="1">%s</td>\n' % qe(k))
 
-    print '<td width="1"><!--buttons--></td></tr>'
+    out.write('<td width="1"><!--buttons--></td></tr>\n')
 
     #output column contents
-    print '<tr valign="top" align="center">'
-    print '<td width="1">'
-    create_select(lambda l: l.bench, lines, 'benchSelect')
-    print '</td><td width="1">'
-    create_select(lambda l: l.config, lines)
-    print '</td><td width="1">'
-    create_select(lambda l: l.time_type, lines)
+    out.write('<tr valign="top" align="center">\n')
+    out.write('<td width="1">\n')
+    create_select(lambda l: l.bench, lines, out, 'benchSelect')
+    out.write('</td><td width="1">\n')
+    create_select(lambda l: l.config, lines, out)
+    out.write('</td><td width="1">\n')
+    create_select(lambda l: l.time_type, lines, out)
 
     for k in variant_settings:
-        print '</td><td width="1">'
-        create_select(lambda l: l.settings.get(k, " "), lines)
-
-    print '</td><td width="1"><button type="button"',
-    print 'onclick=%s' % qa("mark('url(#circleMark)'); return false;"),
-    print '>Mark Points</button>'
-    print '<button type="button" onclick="mark(null);">Clear Points</button>'
-    print '</td>'
-    print """
+        out.write('</td><td width="1">\n')
+        create_select(lambda l: l.settings.get(k, " "), lines, out)
+
+    out.write('</td><td width="1"><button type="button" onclick=%s'
+              ' >Mark Points</button>\n'
+              % qa("mark('url(#circleMark)'); return false;"))
+    out.write('<button type="button" onclick="mark(null);">'
+              'Clear Points</button>\n')
+    out.write('</td>\n')
+    out.write("""
 </tr>
 </form>
 </table></td></tr>
 <tr><td align="center">
 <hr />
-"""
 
-    output_ignored_data_points_warning(ignored_revision_data_points)
-    print '</td></tr></table>'
-    print '</td><td width="2%"><!--gutter--></td>'
+""")
+
+    output_ignored_data_points_warning(ignored_revision_data_points, out,
+                                       num_outliers)
+    out.write('</td></tr></table>\n')
+    out.write('</td><td width="2%"><!--gutter--></td>\n')
 
-    print '<td><table border="0">'
-    print '<tr><td align="center">%s<br></br>revisions r%s - r%s</td></tr>' % (
+    out.write('<td><table border="0">\n')
+    out.write('<tr><td align="center">%s<br></br>revisions r%s - r%s'
+              '</td></tr>\n' % (
         qe(title),
         bench_util.CreateRevisionLink(oldest_revision),
-        bench_util.CreateRevisionLink(newest_revision))
-    print """
+        bench_util.CreateRevisionLink(newest_revision)))
+    out.write("""
 <tr><td align="left">
 <p>Brighter red indicates tests that have gotten worse; brighter green
 indicates tests that have gotten better.</p>
@@ -795,7 +1337,9 @@ benchmarks.</p>
 </tr>
 </table>
 </body>
-</html>"""
+</html>
+""")
+    out.flush()
     
 def compute_size(requested_width, requested_height, rev_width, time_height):
     """Converts potentially empty requested size into a concrete size.
@@ -822,11 +1366,28 @@ def compute_size(requested_width, requested_height, rev_width, time_height):
     
     return (pic_width, pic_height)
 
-def output_svg(lines, regressions, requested_width, requested_height):
-    """Outputs an svg view of the data."""
+def group_revisions(revisions, max_groups=None):
+    """Splits the sorted revisions into at most max_groups groups of
+    consecutive revisions, as equal in size as possible.
+    
+    ([int], int?) -> [[int]]"""
+    if max_groups is None or len(revisions) <= max_groups:
+        return [[revision] for revision in revisions]
+    group_width = float(len(revisions)) / max_groups
+    bounds = [int(group * group_width) for group in range(max_groups)]
+    bounds.append(len(revisions))
+    return [revisions[start:end] for start, end in zip(bounds, bounds[1:])]
+
+def output_svg(lines, regressions, requested_width, requested_height, out,
+               max_points=None):
+    """Outputs an svg view of the data to the OutputBuffer out.
+    
+    If max_points is set, longer lines are downsampled to that many points
+    and the revisions are grouped into that many rectangles. The bounds are
+    still those of all the points."""
     
     (global_min_x, _), (global_max_x, global_max_y) = bounds(lines)
-    max_up_slope, min_down_slope = bounds_slope(regressions)
+    shading = regression_shading(regressions)
 
     #output
     global_min_y = 0
@@ -858,21 +1419,20 @@ def output_svg(lines, regressions, requested_width, requested_height):
         """Converts a time to a vertical display position."""
         return pic_height + ch(y - global_min_y)
     
-    print '<!--Picture height %.2f corresponds to bench value %.2f.-->' % (
-        pic_height, h)
-    print '<svg',
-    print 'width=%s' % qa(str(pic_width)+'px')
-    print 'height=%s' % qa(str(pic_height)+'px')
-    print 'viewBox="0 0 %s %s"' % (str(pic_width), str(pic_height))
-    print 'onclick=%s' % qa(
+    out.write('<!--Picture height %.2f corresponds to bench value %.2f.-->\n'
+              % (pic_height, h))
+    out.write('<svg width=%s\n' % qa(str(pic_width)+'px'))
+    out.write('height=%s\n' % qa(str(pic_height)+'px'))
+    out.write('viewBox="0 0 %s %s"\n' % (str(pic_width), str(pic_height)))
+    out.write('onclick=%s\n' % qa(
             "var event = arguments[0] || window.event;"
             " if (event.shiftKey) { highlightRevision(null); }"
             " if (event.ctrlKey) { highlight(null); }"
-            " return false;")
-    print 'xmlns="http://www.w3.org/2000/svg"'
-    print 'xmlns:xlink="http://www.w3.org/1999/xlink">'
+            " return false;"))
+    out.write('xmlns="http://www.w3.org/2000/svg"\n')
+    out.write('xmlns:xlink="http://www.w3.org/1999/xlink">\n')
     
-    print """
+    out.write("""
 <defs>
     <marker id="circleMark"
       viewBox="0 0 2 2" refX="1" refY="1"
@@ -881,10 +1441,11 @@ def output_svg(lines, regressions, requested_width, requested_height):
       orient="0">
       <circle cx="1" cy="1" r="1"/>
     </marker>
-</defs>"""
+</defs>
+""")
     
     #output the revisions
-    print """
+    out.write("""
 <script type="text/javascript">//<![CDATA[
     var previousRevision;
     var previousRevisionFill;
@@ -912,7 +1473,8 @@ def output_svg(lines, regressions, requested_width, requested_height):
             revision.setAttributeNS(null,'stroke','rgb(100%, 90%, 90%)');
         }
     }
-//]]></script>"""
+//]]></script>
+""")
     
     def print_rect(x, y, w, h, revision):
         """Outputs a revision rectangle in display space,
@@ -923,17 +1485,16 @@ def output_svg(lines, regressions, requested_width, requested_height):
             disp_y += disp_h
             disp_h = -disp_h
         
-        print '<rect id=%s x=%s y=%s' % (qa(revision), qa(cx(x)), qa(disp_y),),
-        print 'width=%s height=%s' % (qa(cw(w)), qa(disp_h),),
-        print 'fill="white"',
-        print 'stroke="rgb(98%%,98%%,88%%)" stroke-width=%s' % qa(line_width),
-        print 'onmouseover=%s' % qa(
-                "var event = arguments[0] || window.event;"
-                " if (event.shiftKey) {"
-                    " highlightRevision('"+str(revision)+"');"
-                    " return false;"
-                " }"),
-        print ' />'
+        out.write('<rect id=%s x=%s y=%s width=%s height=%s fill="white"'
+                  ' stroke="rgb(98%%,98%%,88%%)" stroke-width=%s'
+                  ' onmouseover=%s  />\n' % (
+                      qa(revision), qa(cx(x)), qa(disp_y),
+                      qa(cw(w)), qa(disp_h), qa(line_width),
+                      qa("var event = arguments[0] || window.event;"
+                         " if (event.shiftKey) {"
+                             " highlightRevision('"+str(revision)+"');"
+                             " return false;"
+                         " }")))
     
     xes = set()
     for line in lines.itervalues():
@@ -942,18 +1503,20 @@ def output_svg(lines, regressions, requested_width, requested_height):
     revisions = list(xes)
     revisions.sort()
     
+    # Each rectangle spans a group of revisions and is named after the first.
+    groups = group_revisions(revisions, max_points)
     left = x
-    current_revision = revisions[0]
-    for next_revision in revisions[1:]:
-        width = (((next_revision - current_revision) / 2.0)
-                 + (current_revision - left))
-        print_rect(left, y, width, h, current_revision)
+    current_group = groups[0]
+    for next_group in groups[1:]:
+        width = (((next_group[0] - current_group[-1]) / 2.0)
+                 + (current_group[-1] - left))
+        print_rect(left, y, width, h, current_group[0])
         left += width
-        current_revision = next_revision
-    print_rect(left, y, x+w - left, h, current_revision)
+        current_group = next_group
+    print_rect(left, y, x+w - left, h, current_group[0])
 
     #output the lines
-    print """
+    out.write("""
 <script type="text/javascript">//<![CDATA[
     var previous;
     var previousColor;
@@ -992,7 +1555,8 @@ def output_svg(lines, regressions, requested_width, requested_height):
             }
         }
     }
-//]]></script>"""
+//]]></script>
+""")
 
     # Add a new element to each item in the 'lines' list: the label in string
     # form.  Then use that element to sort the list.
@@ -1002,64 +1566,54 @@ def output_svg(lines, regressions, requested_width, requested_height):
     sorted_lines.sort()
 
     for label_as_string, label, line in sorted_lines:
-        print '<g id=%s>' % qa(label_as_string)
-        r = 128
-        g = 128
-        b = 128
-        a = .10
+        out.write('<g id=%s>\n' % qa(label_as_string))
+        r, g, b, a = shading.get(label, LINE_SHADING)
         if label in regressions:
             regression = regressions[label]
-            min_slope = regression.find_min_slope()
-            if min_slope < 0:
-                d = max(0, (min_slope / min_down_slope))
-                g += int(d*128)
-                a += d*0.9
-            elif min_slope > 0:
-                d = max(0, (min_slope / max_up_slope))
-                r += int(d*128)
-                a += d*0.9
-            
             slope = regression.slope
             intercept = regression.intercept
             min_x = regression.min_x
             max_x = regression.max_x
-            print '<polyline id=%s' % qa(str(label)+'_linear'),
-            print 'fill="none" stroke="yellow"',
-            print 'stroke-width=%s' % qa(abs(ch(regression.serror*2))),
-            print 'opacity="0.5" pointer-events="none" visibility="hidden"',
-            print 'points="',
-            print '%s,%s' % (str(cx(min_x)), str(cy(slope*min_x + intercept))),
-            print '%s,%s' % (str(cx(max_x)), str(cy(slope*max_x + intercept))),
-            print '"/>'
+            out.write('<polyline id=%s fill="none" stroke="yellow"'
+                      ' stroke-width=%s' % (
+                          qa(str(label)+'_linear'),
+                          qa(abs(ch(regression.serror*2)))))
+            out.write(' opacity="0.5" pointer-events="none"'
+                      ' visibility="hidden"')
+            out.write(' points=" %s,%s %s,%s "/>\n' % (
+                str(cx(min_x)), str(cy(slope*min_x + intercept)),
+                str(cx(max_x)), str(cy(slope*max_x + intercept))))
         
-        print '<polyline id=%s' % qa(str(label)+'_line'),
-        print 'onmouseover=%s' % qa(
-                "var event = arguments[0] || window.event;"
-                " if (event.ctrlKey) {"
-                    " highlight('"+str(label).replace("'", "\\'")+"');"
-                    " return false;"
-                " }"),
-        print 'fill="none" stroke="rgb(%s,%s,%s)"' % (str(r), str(g), str(b)),
-        print 'stroke-width=%s' % qa(line_width),
-        print 'opacity=%s' % qa(a),
-        print 'points="',
-        for point in line:
-            print '%s,%s' % (str(cx(point[0])), str(cy(point[1]))),
-        print '"/>'
-
-        print '</g>'
+        out.write('<polyline id=%s onmouseover=%s' % (
+            qa(str(label)+'_line'),
+            qa("var event = arguments[0] || window.event;"
+               " if (event.ctrlKey) {"
+                   " highlight('"+str(label).replace("'", "\\'")+"');"
+                   " return false;"
+               " }")))
+        out.write(' fill="none" stroke="rgb(%s,%s,%s)"' % (
+            str(r), str(g), str(b)))
+        out.write(' stroke-width=%s opacity=%s points="' % (
+            qa(line_width), qa(a)))
+        if max_points is not None:
+            line = bench_util.LargestTriangleThreeBuckets(line, max_points)
+        out.write(''.join([' %s,%s' % (str(cx(point[0])), str(cy(point[1])))
+                           for point in line]))
+        out.write(' "/>\n')
+
+        out.write('</g>\n')
 
     #output the labels
-    print '<text id="label" x="0" y=%s' % qa(font_size),
-    print 'font-size=%s> </text>' % qa(font_size)
+    out.write('<text id="label" x="0" y=%s font-size=%s> </text>\n' % (
+        qa(font_size), qa(font_size)))
 
-    print '<a id="rev_link" xlink:href="" target="_top">'
-    print '<text id="revision" x="0" y=%s style="' % qa(font_size*2)
-    print 'font-size: %s; ' % qe(font_size)
-    print 'stroke: #0000dd; text-decoration: underline; '
-    print '"> </text></a>'
+    out.write('<a id="rev_link" xlink:href="" target="_top">\n')
+    out.write('<text id="revision" x="0" y=%s style="\n' % qa(font_size*2))
+    out.write('font-size: %s; \n' % qe(font_size))
+    out.write('stroke: #0000dd; text-decoration: underline; \n')
+    out.write('"> </text></a>\n')
 
-    print '</svg>'
+    out.write('</svg>\n')
 
 if __name__ == "__main__":
     main()
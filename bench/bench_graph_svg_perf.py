@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+'''
+Measures the speed of writing the xhtml graph in bench_graph_svg.py for large
+synthetic sets of lines, so changes to the output phase can be compared before
+and after.
+'''
+import optparse
+import random
+import sys
+import time
+
+import bench_graph_svg
+import bench_util_perf
+
+# Configs and time types of the synthetic lines.
+CONFIGS = ['8888', '565', 'GPU']
+TIME_TYPES = ['', 'c', 'g']
+
+class ByteCounter:
+    """A file-like sink which only counts the bytes and calls written."""
+    def __init__(self):
+        self.bytes = 0
+        self.writes = 0
+        self.softspace = 0
+
+    def write(self, text):
+        self.bytes += len(text)
+        self.writes += 1
+
+def synthetic_lines(num_labels, num_revisions, seed=0):
+    """Returns {Label:[(revision, time)]} with num_labels lines, each with a
+    point at every one of num_revisions consecutive revisions."""
+    rand = random.Random(seed)
+    settings = {'scale': '0', 'rotate': '0'}
+    lines = {}
+    for i in range(num_labels):
+        label = bench_graph_svg.Label(
+            'bench_%d' % (i / (len(CONFIGS) * len(TIME_TYPES))),
+            CONFIGS[i % len(CONFIGS)],
+            TIME_TYPES[(i / len(CONFIGS)) % len(TIME_TYPES)],
+            settings)
+        base = rand.uniform(0.5, 50)
+        lines[label] = [(7000 + revision, base * rand.uniform(0.9, 1.2))
+                        for revision in range(num_revisions)]
+    return lines
+
+def time_output(lines, num_revisions, repeat, max_points=None):
+    """Prints the MB/sec of bench_graph_svg.output_xhtml for lines.
+
+    The graph is written to stdout, which is replaced by a ByteCounter for
+    the duration, so the figures do not depend on the output device. If
+    max_points is set, it is passed on to output_xhtml."""
+    regressions = bench_graph_svg.create_regressions(
+        lines, 7000, 7000 + num_revisions)
+    counter = ByteCounter()
+    args = [lines, 7000, 7000 + num_revisions, {}, regressions, 1024, 768,
+            'Bench_Performance_for_Synthetic']
+    if max_points is not None:
+        args.append(max_points)
+
+    def output():
+        counter.bytes = 0
+        counter.writes = 0
+        stdout = sys.stdout
+        sys.stdout = counter
+        try:
+            bench_graph_svg.output_xhtml(*args)
+        finally:
+            sys.stdout = stdout
+
+    elapsed = bench_util_perf.best_time(output, repeat)
+    print ('output_xhtml %6d lines x %6d revisions %8.3f s %10d writes '
+           '%8.2f MB %8.2f MB/sec' % (len(lines), num_revisions, elapsed,
+                                      counter.writes,
+                                      counter.bytes / float(1 << 20),
+                                      counter.bytes / elapsed / (1 << 20)))
+
+def main():
+    """Parses flags and prints timings."""
+    parser = optparse.OptionParser('USAGE: %prog [options]')
+    parser.add_option('-l', '--lines', dest='lines', type='int',
+                      default=500, help='number of graph lines.')
+    parser.add_option('-r', '--revisions', dest='revisions', type='int',
+                      default=200, help='revisions (points) per line.')
+    parser.add_option('-n', '--repeat', dest='repeat', type='int', default=3,
+                      help='number of timed runs; the best one is reported.')
+    parser.add_option('-p', '--max-points', dest='max_points', type='int',
+                      default=None,
+                      help='if set, the most points to draw for each line.')
+    (options, _) = parser.parse_args()
+
+    lines = synthetic_lines(options.lines, options.revisions)
+    time_output(lines, options.revisions, options.repeat, options.max_points)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+'''
+Uploads bench values to the appengine dashboard.
+
+Payloads for the same bot, config and revision are batched into as few
+requests as fit MAX_PAYLOAD_BYTES, and posted by a small pool of threads,
+each keeping one HTTP connection open for all of its requests. Requests that fail for reasons
+which may go away (connection errors, timeouts, 5xx, 408 and 429 replies)
+are retried with exponential backoff. Payloads still failing after that are
+kept in a spool file, and are sent again before the new payloads on the
+next run.
+'''
+import httplib
+import json
+import os
+import Queue
+import random
+import socket
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+# Number of upload threads, each with its own connection.
+DEFAULT_WORKERS = 4
+# Seconds to wait for the server on each request.
+DEFAULT_TIMEOUT = 30
+# Attempts after the first before a payload is spooled, and the delay before
+# the first of them, doubling each time up to MAX_BACKOFF seconds.
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+# Payloads are batched and split so their requests stay below this many
+# bytes.
+MAX_PAYLOAD_BYTES = 256 * 1024
+
+# Default spool location relative to the bench directory.
+SPOOL_SUFFIX = '.upload_spool'
+
+# Replies after which the same request may succeed later.
+RETRY_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+
+def default_spool_path(bench_directory):
+    """Returns the spool file to use for the given bench directory."""
+    return os.path.normpath(os.path.abspath(bench_directory)) + SPOOL_SUFFIX
+
+def encode(payload):
+    """Returns the request body posting payload."""
+    return urllib.urlencode({'data': json.dumps(payload, sort_keys=True)})
+
+def split_payload(payload, max_bytes=MAX_PAYLOAD_BYTES):
+    """Splits payload into payloads whose requests are at most max_bytes,
+    by dividing its comma-separated benches between them.
+
+    A single bench too large on its own still gets a payload of its own.
+    ({str:_}, int) -> [{str:_}]"""
+    if len(encode(payload)) <= max_bytes:
+        return [payload]
+    # JSON and form encoding both encode each character on its own, so the
+    # size of a request is that of one without benches plus that of each.
+    empty_size = len(encode(dict(payload, benches='')))
+    separator_size = len(urllib.quote_plus(','))
+    payloads = []
+    benches = []
+    size = empty_size
+    for bench in payload['benches'].split(','):
+        bench_size = len(urllib.quote_plus(json.dumps(bench)[1:-1]))
+        if benches:
+            bench_size += separator_size
+        if benches and size + bench_size > max_bytes:
+            payloads.append(dict(payload, benches=','.join(benches)))
+            benches = []
+            size = empty_size
+            bench_size -= separator_size
+        benches.append(bench)
+        size += bench_size
+    payloads.append(dict(payload, benches=','.join(benches)))
+    return payloads
+
+def payload_fields(payload):
+    """Returns the fields of payload other than its benches, which name the
+    config and revision it is for, as a hashable tuple.
+    ({str:_}) -> ((str, _))"""
+    return tuple(sorted((name, value) for name, value in payload.iteritems()
+                        if name != 'benches'))
+
+def batch_payloads(payloads, max_bytes=MAX_PAYLOAD_BYTES):
+    """Returns payloads packed into as few payloads as have requests of at
+    most max_bytes.
+
+    The dashboard takes one config of one revision per request, so only
+    payloads agreeing on every field but their benches are combined, by
+    joining their benches in order; each combined payload is then split as
+    by split_payload. Combined payloads come in the order of their first
+    part. ([{str:_}], int) -> [{str:_}]"""
+    batches = [] # [({str:_}, [str])] of the fields and benches of each
+    batch_index = {} # {fields other than benches : index in batches}
+    for payload in payloads:
+        key = payload_fields(payload)
+        if key not in batch_index:
+            batch_index[key] = len(batches)
+            batches.append((payload, []))
+        if payload['benches']:
+            batches[batch_index[key]][1].append(payload['benches'])
+    batched = []
+    for payload, benches in batches:
+        batched.extend(split_payload(dict(payload, benches=','.join(benches)),
+                                     max_bytes))
+    return batched
+
+def read_spool(spool_path):
+    """Returns the payloads spooled at spool_path, skipping any line which
+    cannot be read, such as one cut short by a crash."""
+    payloads = []
+    try:
+        spool = open(spool_path, 'r')
+    except IOError:
+        return payloads
+    try:
+        for line in spool:
+            try:
+                payloads.append(json.loads(line))
+            except ValueError:
+                continue
+    finally:
+        spool.close()
+    return payloads
+
+def write_spool(spool_path, payloads):
+    """Replaces the spool at spool_path with payloads, one JSON object per
+    line, or removes it if there are none.
+
+    The new spool is synced to disk before it is renamed into place, so a
+    crash leaves either the old spool or the new one."""
+    if not payloads:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        return
+    temp_path = spool_path + '.tmp'
+    spool = open(temp_path, 'w')
+    try:
+        for payload in payloads:
+            spool.write(json.dumps(payload, sort_keys=True) + '\n')
+        spool.flush()
+        os.fsync(spool.fileno())
+    finally:
+        spool.close()
+    if os.name == 'nt' and os.path.exists(spool_path):
+        os.remove(spool_path)
+    os.rename(temp_path, spool_path)
+
+class _PermanentError(Exception):
+    """A reply that will not change by sending the same request again."""
+    pass
+
+class Uploader:
+    """Posts payloads to url as form field 'data', encoded as JSON.
+
+    sleep is called with the number of seconds to back off before a retry;
+    tests can pass a function that returns at once.
+    (str, int, float, int, float, (float) -> _)"""
+    def __init__(self, url, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 sleep=time.sleep):
+        scheme, self.host, path, query, _ = urlparse.urlsplit(url)
+        if scheme == 'https':
+            self._connection_class = httplib.HTTPSConnection
+        elif scheme == 'http':
+            self._connection_class = httplib.HTTPConnection
+        else:
+            raise ValueError('Cannot upload to %s' % url)
+        self.path = path or '/'
+        if query:
+            self.path += '?' + query
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.sleep = sleep
+
+    def _post(self, connection, body):
+        """Posts body over connection and reads the whole reply, so the
+        connection can be used again. Raises _PermanentError for replies
+        not worth retrying, and IOError for those that are."""
+        connection.request('POST', self.path, body, {
+            'Content-Type': 'application/x-www-form-urlencoded',
+        })
+        response = connection.getresponse()
+        response.read()
+        if 200 <= response.status < 300:
+            return
+        error = 'HTTP %d %s' % (response.status, response.reason)
+        if response.status in RETRY_STATUSES:
+            raise IOError(error)
+        raise _PermanentError(error)
+
+    def _work(self, tasks, failed, lock):
+        """Uploads payloads from tasks until it is empty. Appends the
+        payloads to retry on a later run to failed."""
+        connection = None
+        while True:
+            try:
+                payload = tasks.get_nowait()
+            except Queue.Empty:
+                break
+            body = encode(payload)
+            attempt = 0
+            while True:
+                if connection is None:
+                    connection = self._connection_class(self.host,
+                                                        timeout=self.timeout)
+                try:
+                    self._post(connection, body)
+                    break
+                except _PermanentError, e:
+                    sys.stderr.write('Could not upload JSON data %s: %s\n' % (
+                        payload, e))
+                    break
+                except (IOError, socket.error, httplib.HTTPException), e:
+                    # The connection may be in any state; start afresh.
+                    connection.close()
+                    connection = None
+                    if attempt >= self.retries:
+                        sys.stderr.write('Gave up uploading JSON data %s: %s\n'
+                                         % (payload, e))
+                        lock.acquire()
+                        try:
+                            failed.append(payload)
+                        finally:
+                            lock.release()
+                        break
+                    delay = min(MAX_BACKOFF, self.backoff * 2 ** attempt)
+                    self.sleep(delay * random.uniform(0.5, 1.0))
+                    attempt += 1
+        if connection is not None:
+            connection.close()
+
+    def upload(self, payloads):
+        """Uploads payloads, batched as by batch_payloads, and returns those
+        which failed but may succeed if tried again later. Payloads the
+        server rejects outright are reported and dropped.
+
+        ([{str:_}]) -> [{str:_}]"""
+        tasks = Queue.Queue()
+        count = 0
+        for payload in batch_payloads(payloads):
+            tasks.put(payload)
+            count += 1
+        failed = []
+        lock = threading.Lock()
+        threads = [threading.Thread(target=self._work,
+                                    args=(tasks, failed, lock))
+                   for _ in range(min(self.workers, count))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return failed
+
+def upload_with_spool(uploader, payloads, spool_path):
+    """Uploads the payloads left in the spool at spool_path by earlier runs,
+    then payloads, and spools those which fail for next time.
+
+    A spooled payload for the same config and revision as one of payloads
+    was computed again by this run, and is replaced by it rather than
+    uploaded alongside.
+
+    Returns the number of payloads spooled.
+    (Uploader, [{str:_}], str) -> int"""
+    payloads = list(payloads)
+    fresh = set(payload_fields(payload) for payload in payloads)
+    spooled = [payload for payload in read_spool(spool_path)
+               if payload_fields(payload) not in fresh]
+    failed = uploader.upload(spooled + payloads)
+    write_spool(spool_path, failed)
+    return len(failed)
@@ -4,14 +4,73 @@ Created on May 19, 2011
 @author: bungeman
 '''
 
+import array
+import bisect
+import heapq
+import itertools
 import re
 import math
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # bench representation algorithm constant names
 ALGORITHM_AVERAGE = 'avg'
 ALGORITHM_MEDIAN = 'med'
 ALGORITHM_MINIMUM = 'min'
 ALGORITHM_25TH_PERCENTILE = '25th'
+ALGORITHMS = [ALGORITHM_AVERAGE, ALGORITHM_MINIMUM, ALGORITHM_MEDIAN,
+              ALGORITHM_25TH_PERCENTILE]
+
+# Lists at least this long are reduced by selection rather than by sorting;
+# below it, sorting in C is faster than selecting in Python.
+QUICKSELECT_MIN_LENGTH = 2000
+# Groups of equal-length lists with at least this many values in total are
+# reduced with numpy, if it is available.
+NUMPY_MIN_VALUES = 256
+
+# Minimum number of points before FitLinearRegressions fits all lines together
+# with numpy, if it is available.
+NUMPY_MIN_REGRESSION_POINTS = 1024
+
+# regression engine names
+REGRESSION_LEAST_SQUARES = 'least-squares'
+REGRESSION_THEIL_SEN = 'theil-sen'
+REGRESSION_ENGINES = [REGRESSION_LEAST_SQUARES, REGRESSION_THEIL_SEN]
+
+# Theil-Sen slopes are listed directly up to this many point pairs; larger
+# inputs are narrowed down to about this many pairs first, in at most
+# THEIL_SEN_MAX_ROUNDS rounds.
+THEIL_SEN_DIRECT_PAIRS = 5000
+THEIL_SEN_MAX_ROUNDS = 16
+
+# Scales a median absolute deviation to a normal standard deviation.
+MAD_TO_STANDARD_DEVIATION = 1.4826
+
+# FindChangePoints splits a series only where the squared error drops by more
+# than CHANGE_POINT_PENALTY * log(n) noise variances, and leaves at least
+# CHANGE_POINT_MIN_SEGMENT values on either side.
+CHANGE_POINT_PENALTY = 3.0
+CHANGE_POINT_MIN_SEGMENT = 3
+# Values further than CHANGE_POINT_SPIKE_SIGMAS noise deviations from the
+# median of their CHANGE_POINT_SPIKE_WINDOW neighbours are treated as spikes.
+CHANGE_POINT_SPIKE_SIGMAS = 3.0
+CHANGE_POINT_SPIKE_WINDOW = 2
+# The noise is never taken to be below this fraction of the median value.
+CHANGE_POINT_MIN_RELATIVE_NOISE = 0.01
+
+# FindOutliers rejects values further than OUTLIER_SIGMAS deviations from the
+# median of themselves and the OUTLIER_HALF_WINDOW values on either side.
+# The deviation is estimated from the median absolute deviation of the same
+# window, and is never taken below OUTLIER_MIN_RELATIVE_NOISE of the median.
+# Windows cut short by the ends of a series need OUTLIER_MIN_WINDOW values.
+OUTLIER_HALF_WINDOW = 5
+OUTLIER_SIGMAS = 5.0
+OUTLIER_MIN_RELATIVE_NOISE = 0.1
+OUTLIER_MIN_WINDOW = 5
 
 # Regular expressions used throughout
 PER_SETTING_RE = '([^\s=]+)(?:=(\S+))?'
@@ -28,6 +87,14 @@ TILE_RE = ('  tile_(\S+): tile \[\d+,\d+\] out of \[\d+,\d+\] <averaged>:'
 # for extracting tile layout
 TILE_LAYOUT_RE = ' out of \[(\d+),(\d+)\] <averaged>: '
 
+# Literal text that must be present for the corresponding regular expression
+# above to match, used to classify lines without running every pattern.
+SETTINGS_PREFIX = 'skia bench:'
+BENCH_PREFIX = 'running bench '
+TILE_PREFIX = '  tile_'
+TILE_AVERAGED = ' <averaged>: '
+CONFIG_SEPARATOR = ': '
+
 PER_SETTING_RE_COMPILED = re.compile(PER_SETTING_RE)
 SETTINGS_RE_COMPILED = re.compile(SETTINGS_RE)
 BENCH_RE_COMPILED = re.compile(BENCH_RE)
@@ -39,9 +106,11 @@ TILE_LAYOUT_RE_COMPILED = re.compile(TILE_LAYOUT_RE)
 class BenchDataPoint:
     """A single data point produced by bench.
 
-    (str, str, str, float, {str:str}, str, [floats])"""
+    (str, str, str, float, {str:str}, str, [floats], str,
+     (SampleBuffer, int, int))"""
     def __init__(self, bench, config, time_type, time, settings,
-                 tile_layout='', per_tile_values=[]):
+                 tile_layout='', per_tile_values=[], representation=None,
+                 samples=None):
         self.bench = bench
         self.config = config
         self.time_type = time_type
@@ -51,6 +120,27 @@ class BenchDataPoint:
         self.tile_layout = tile_layout
         # list of per_tile bench values, if applicable
         self.per_tile_values = per_tile_values
+        # the ALGORITHM_XXX type time was computed with
+        self.representation = representation
+        # (buffer, first, end): the raw iterations are the lists [first, end)
+        # of the SampleBuffer, one per tile. None unless requested in parse().
+        self.samples = samples
+
+    def iterations(self):
+        """Returns the raw iterations of all tiles as one array('d'), or None
+        if they were not kept."""
+        if self.samples is None:
+            return None
+        buffer, first, end = self.samples
+        return buffer.get_range(first, end)
+
+    def tile_iterations(self):
+        """Returns the raw iterations as an array('d') per tile, or None if
+        they were not kept."""
+        if self.samples is None:
+            return None
+        buffer, first, end = self.samples
+        return [buffer.get(i) for i in xrange(first, end)]
 
     def __repr__(self):
         return "BenchDataPoint(%s, %s, %s, %s, %s)" % (
@@ -61,6 +151,35 @@ class BenchDataPoint:
                    str(self.settings),
                )
 
+class SampleBuffer(object):
+    """Compact storage for the raw iteration lists of many data points.
+
+    All iterations share one array('d'), so keeping them costs 8 bytes per
+    iteration plus 8 bytes per iteration list, instead of a Python list and a
+    float object per iteration. Each point refers to its consecutive lists
+    with a (buffer, first, end) tuple. One buffer can be shared by any number
+    of parse() calls."""
+    def __init__(self):
+        self.values = array.array('d')
+        self.offsets = array.array('l', [0])  # start of each list in values
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def add(self, iterations):
+        """Appends an iteration list and returns its index."""
+        self.values.extend(iterations)
+        self.offsets.append(len(self.values))
+        return len(self.offsets) - 2
+
+    def get(self, index):
+        """Returns the iteration list with the given index as an array('d')."""
+        return self.values[self.offsets[index] : self.offsets[index + 1]]
+
+    def get_range(self, first, end):
+        """Returns the lists [first, end) concatenated into one array('d')."""
+        return self.values[self.offsets[first] : self.offsets[end]]
+
 class _ExtremeType(object):
     """Instances of this class compare greater or less than other objects."""
     def __init__(self, cmpr, rep):
@@ -79,9 +198,49 @@ class _ExtremeType(object):
 Max = _ExtremeType(1, "Max")
 Min = _ExtremeType(-1, "Min")
 
+def _PercentileRank(representation, length):
+    """Returns the 1-based rank of the percentile representation in a list of
+    the given length.
+
+    For percentiles, we use the value below which x% of values are found,
+    which allows for better detection of quantum behaviors."""
+    if representation == ALGORITHM_MEDIAN:
+        return int(round(0.5 * length + 0.5))
+    elif representation == ALGORITHM_25TH_PERCENTILE:
+        return int(round(0.25 * length + 0.5))
+    raise Exception("invalid representation algorithm %s!" % representation)
+
+def _SelectKth(data, k):
+    """Returns the k-th smallest (0-based) value of data, reordering data.
+
+    Uses quickselect with a median-of-three pivot, falling back to sorting
+    if partitioning stops making progress, so it runs in expected linear
+    time and is never worse than sorting."""
+    depth_limit = 2 * int(math.log(max(len(data), 1), 2) + 1)
+    while len(data) >= QUICKSELECT_MIN_LENGTH:
+        depth_limit -= 1
+        if depth_limit < 0:
+            break
+        pivot = sorted((data[0], data[len(data) // 2], data[-1]))[1]
+        lows = [value for value in data if value < pivot]
+        if k < len(lows):
+            data = lows
+            continue
+        highs = [value for value in data if value > pivot]
+        equal_count = len(data) - len(lows) - len(highs)
+        if k < len(lows) + equal_count:
+            return pivot
+        k -= len(lows) + equal_count
+        data = highs
+    data.sort()
+    return data[k]
+
 class _ListAlgorithm(object):
     """Algorithm for selecting the representation value from a given list.
-    representation is one of the ALGORITHM_XXX representation types."""
+    representation is one of the ALGORITHM_XXX representation types.
+
+    Only the average needs every value; the minimum is a single scan and
+    percentiles select one order statistic without sorting long lists."""
     def __init__(self, data, representation=None):
         if not representation:
             representation = ALGORITHM_AVERAGE  # default algorithm
@@ -89,29 +248,54 @@ class _ListAlgorithm(object):
         self._len = len(data)
         if representation == ALGORITHM_AVERAGE:
             self._rep = sum(self._data) / self._len
+        elif representation == ALGORITHM_MINIMUM:
+            self._rep = min(self._data)
         else:
-            self._data.sort()
-            if representation == ALGORITHM_MINIMUM:
-                self._rep = self._data[0]
-            else:
-                # for percentiles, we use the value below which x% of values are
-                # found, which allows for better detection of quantum behaviors.
-                if representation == ALGORITHM_MEDIAN:
-                    x = int(round(0.5 * self._len + 0.5))
-                elif representation == ALGORITHM_25TH_PERCENTILE:
-                    x = int(round(0.25 * self._len + 0.5))
-                else:
-                    raise Exception("invalid representation algorithm %s!" %
-                                    representation)
-                self._rep = self._data[x - 1]
+            x = _PercentileRank(representation, self._len)
+            self._rep = _SelectKth(self._data, x - 1)
 
     def compute(self):
         return self._rep
 
+def ComputeRepresentations(iteration_lists, representation=None):
+    """Returns the representation value of each list in iteration_lists.
+
+    If numpy is available, percentiles of lists of equal length are selected
+    together, one row per list; results are identical to _ListAlgorithm's.
+    Averages and minimums are not batched, since converting the lists to an
+    array costs more than the builtin sum() and min() scans.
+    ([[float]], str) -> [float]"""
+    if not representation:
+        representation = ALGORITHM_AVERAGE  # default algorithm
+    if (numpy is None or representation == ALGORITHM_AVERAGE or
+        representation == ALGORITHM_MINIMUM):
+        return [_ListAlgorithm(iters, representation).compute()
+                for iters in iteration_lists]
+
+    results = [None] * len(iteration_lists)
+    groups = {}  # {length : [index in iteration_lists]}
+    for i, iters in enumerate(iteration_lists):
+        groups.setdefault(len(iters), []).append(i)
+    for length, indices in groups.iteritems():
+        if length * len(indices) < NUMPY_MIN_VALUES:
+            for i in indices:
+                results[i] = _ListAlgorithm(
+                    iteration_lists[i], representation).compute()
+            continue
+        rows = numpy.array([iteration_lists[i] for i in indices], dtype=float)
+        k = _PercentileRank(representation, length) - 1
+        values = numpy.partition(rows, k, axis=1)[:, k]
+        for i, value in zip(indices, values.tolist()):
+            results[i] = value
+    return results
+
 def _ParseAndStoreTimes(config_re_compiled, is_per_tile, line, bench,
-                        value_dic, layout_dic, representation=None):
+                        value_dic, layout_dic):
     """Parses given bench time line with regex and adds data to value_dic.
 
+    The iteration list of each time is stored as is; _ReduceTimes() later
+    replaces the lists by their representation values in one batch.
+
     config_re_compiled: precompiled regular expression for parsing the config
         line.
     is_per_tile: boolean indicating whether this is a per-tile bench.
@@ -119,8 +303,8 @@ def _ParseAndStoreTimes(config_re_compiled, is_per_tile, line, bench,
     line: input string line to parse.
     bench: name of bench for the time values.
     value_dic: dictionary to store bench values. See bench_dic in parse() below.
-    layout_dic: dictionary to store tile layouts. See parse() for descriptions.
-    representation: should match one of the ALGORITHM_XXX types."""
+    layout_dic: dictionary to store tile layouts. See parse() for
+        descriptions."""
 
     for config in config_re_compiled.finditer(line):
         current_config = config.group(1)
@@ -137,96 +321,625 @@ def _ParseAndStoreTimes(config_re_compiled, is_per_tile, line, bench,
                      new_time.group(2).strip().split(',')]
             value_dic.setdefault(bench, {}).setdefault(
                 current_config, {}).setdefault(current_time_type, []).append(
-                    _ListAlgorithm(iters, representation).compute())
+                    iters)
             layout_dic.setdefault(bench, {}).setdefault(
                 current_config, {}).setdefault(current_time_type, tile_layout)
 
-def parse(settings, lines, representation=None):
-    """Parses bench output into a useful data structure.
+def _Representations(representation):
+    """Returns the list of ALGORITHM_XXX types requested by the representation
+    argument of parse(), which may be a single type or a collection of them.
 
-    ({str:str}, __iter__ -> str) -> [BenchDataPoint]
-    representation is one of the ALGORITHM_XXX types."""
+    The average comes first, since selecting the other representations
+    reorders the iteration lists and the average must be summed in order."""
+    if not representation:
+        return [ALGORITHM_AVERAGE]
+    if isinstance(representation, basestring):
+        return [representation]
+    order = dict((algorithm, i) for i, algorithm in enumerate(ALGORITHMS))
+    return sorted(set(representation),
+                  key=lambda r: (order.get(r, len(order)), r))
+
+def _ReduceTimes(config_dic, representations, samples=None):
+    """Replaces the iteration lists stored by _ParseAndStoreTimes for one
+    bench by tuples of their values for each of the representations.
+
+    If samples is a SampleBuffer, the iteration lists are first added to it
+    and their index is appended to each tuple.
+
+    config_dic: [config][time_type] -> [list of bench values or iterations]"""
+    slots = []  # [(list of bench values, index of iteration list in it)]
+    for time_dic in config_dic.itervalues():
+        for values in time_dic.itervalues():
+            for i, value in enumerate(values):
+                if isinstance(value, list):
+                    slots.append((values, i))
+    iteration_lists = [values[i] for values, i in slots]
+    columns = []
+    if samples is not None:
+        # before reducing, which may reorder the lists.
+        columns.append([samples.add(iters) for iters in iteration_lists])
+    columns[0:0] = [ComputeRepresentations(iteration_lists, representation)
+                    for representation in representations]
+    reduced = zip(*columns)
+    for (values, i), value in zip(slots, reduced):
+        values[i] = value
+
+def _ClassifyLine(line):
+    """Decides once which kinds of bench output the given line contains.
+
+    Cheap substring checks select the candidate patterns, which are then
+    anchored at the position of their literal prefix, so each line is scanned
+    by at most the patterns that can actually match it.
+
+    (str) -> (settings_match, bench_match, config_re_compiled)
+    Each element is None if the line contains no such part."""
+    settings_match = None
+    start = line.find(SETTINGS_PREFIX)
+    if start >= 0:
+        settings_match = SETTINGS_RE_COMPILED.match(line, start)
+
+    bench_match = None
+    start = line.find(BENCH_PREFIX)
+    while start >= 0 and not bench_match:
+        bench_match = BENCH_RE_COMPILED.match(line, start)
+        start = line.find(BENCH_PREFIX, start + 1)
+
+    config_re_compiled = None
+    if CONFIG_SEPARATOR in line:
+        if line.startswith(TILE_PREFIX):
+            # non-averaged per-tile lines are ignored, see TILE_RE.
+            if TILE_AVERAGED in line:
+                config_re_compiled = TILE_RE_COMPILED
+        else:
+            config_re_compiled = CONFIG_RE_COMPILED
+
+    return (settings_match, bench_match, config_re_compiled)
+
+def _ParseSettings(settings_match, settings):
+    """Returns a copy of settings updated from the given settings line match.
+
+    (re.MatchObject, {str:str}) -> {str:str}"""
+    settings = dict(settings)
+    for settingMatch in PER_SETTING_RE_COMPILED.finditer(settings_match.group(1)):
+        if (settingMatch.group(2)):
+            settings[settingMatch.group(1)] = settingMatch.group(2)
+        else:
+            settings[settingMatch.group(1)] = True
+    return settings
+
+def _CreateBenchDataPoints(bench, config_dic, layout_dic, settings,
+                           representations, samples=None):
+    """Creates the data points of one bench for each of the representations,
+    using the total time as final bench value.
 
+    config_dic: [config][time_type] -> [tuple of values per representation,
+        followed by the index of the iteration list in samples if given]
+    layout_dic: [config][time_type] -> tile_layout
+    (str, {str:{str:[(float)]}}, {str:{str:str}}, {str:str}, [str],
+     SampleBuffer) -> [BenchDataPoint]"""
     benches = []
+    for config in config_dic:
+        for time_type in config_dic[config]:
+            point_samples = None
+            if samples is not None:
+                lists = [value[-1] for value in config_dic[config][time_type]]
+                first = lists[0]
+                if lists != range(first, first + len(lists)):
+                    # a bench seen more than once; make its lists consecutive.
+                    first = len(samples)
+                    for index in lists:
+                        samples.add(samples.get(index))
+                point_samples = (samples, first, first + len(lists))
+            for i, representation in enumerate(representations):
+                values = [value[i] for value in config_dic[config][time_type]]
+                tile_layout = ''
+                per_tile_values = []
+                if len(values) > 1:
+                    # per-tile values, extract tile_layout
+                    per_tile_values = values
+                    tile_layout = layout_dic[config][time_type]
+                benches.append(BenchDataPoint(
+                    bench,
+                    config,
+                    time_type,
+                    sum(values),
+                    settings,
+                    tile_layout,
+                    per_tile_values,
+                    representation,
+                    point_samples))
+    return benches
+
+def _AppendBenchRows(table, bench, config_dic, layout_dic, settings,
+                     revision):
+    """Appends the rows of one bench to table, as _CreateBenchDataPoints
+    would create its points for a single representation.
+
+    (BenchTable, str, {str:{str:[(float)]}}, {str:{str:str}}, {str:str}, int)
+    """
+    for config in config_dic:
+        for time_type in config_dic[config]:
+            values = [value[0] for value in config_dic[config][time_type]]
+            tile_layout = ''
+            per_tile_values = ()
+            if len(values) > 1:
+                # per-tile values, extract tile_layout
+                per_tile_values = values
+                tile_layout = layout_dic[config][time_type]
+            table.append(bench, config, time_type, sum(values), settings,
+                         tile_layout, per_tile_values, revision)
+
+def _ParseBenches(settings, lines, representations, samples=None):
+    """Parses bench output into per-bench dictionaries of reduced values.
+
+    Returns (bench_dic, layout_dic, settings), settings being those in effect
+    at the end of lines.
+    bench_dic: [bench][config][time_type] -> [tuple of values per
+        representation, followed by the index of the iteration list in
+        samples if given]
+    layout_dic: [bench][config][time_type] -> tile_layout"""
     current_bench = None
     bench_dic = {}  # [bench][config][time_type] -> [list of bench values]
     # [bench][config][time_type] -> tile_layout
     layout_dic = {}
 
     for line in lines:
+        settings_match, new_bench, config_re_compiled = _ClassifyLine(line)
 
         # see if this line is a settings line
-        settingsMatch = SETTINGS_RE_COMPILED.search(line)
-        if (settingsMatch):
-            settings = dict(settings)
-            for settingMatch in PER_SETTING_RE_COMPILED.finditer(settingsMatch.group(1)):
-                if (settingMatch.group(2)):
-                    settings[settingMatch.group(1)] = settingMatch.group(2)
-                else:
-                    settings[settingMatch.group(1)] = True
+        if settings_match:
+            settings = _ParseSettings(settings_match, settings)
 
         # see if this line starts a new bench
-        new_bench = BENCH_RE_COMPILED.search(line)
         if new_bench:
+            if current_bench in bench_dic:
+                _ReduceTimes(bench_dic[current_bench], representations, samples)
             current_bench = new_bench.group(1)
 
         # add configs on this line to the bench_dic
-        if current_bench:
-            if line.startswith('  tile_') :
-                _ParseAndStoreTimes(TILE_RE_COMPILED, True, line, current_bench,
-                                    bench_dic, layout_dic, representation)
-            else:
-                _ParseAndStoreTimes(CONFIG_RE_COMPILED, False, line,
-                                    current_bench,
-                                    bench_dic, layout_dic, representation)
+        if current_bench and config_re_compiled:
+            _ParseAndStoreTimes(config_re_compiled,
+                                config_re_compiled is TILE_RE_COMPILED, line,
+                                current_bench, bench_dic, layout_dic)
+
+    if current_bench in bench_dic:
+        _ReduceTimes(bench_dic[current_bench], representations, samples)
+
+    return (bench_dic, layout_dic, settings)
+
+def parse(settings, lines, representation=None, samples=None):
+    """Parses bench output into a useful data structure.
+
+    ({str:str}, __iter__ -> str) -> [BenchDataPoint]
+    representation is one of the ALGORITHM_XXX types, or a collection of them.
+    For a collection, every representation is computed from the same parsed
+    iterations and there is one point per representation, which can be told
+    apart by its representation field.
+    samples: if a SampleBuffer, the raw iterations of every point are kept
+    in it; see BenchDataPoint.iterations()."""
+
+    representations = _Representations(representation)
+    bench_dic, layout_dic, settings = _ParseBenches(settings, lines,
+                                                    representations, samples)
 
     # append benches to list, use the total time as final bench value.
+    benches = []
     for bench in bench_dic:
-        for config in bench_dic[bench]:
-            for time_type in bench_dic[bench][config]:
-                tile_layout = ''
-                per_tile_values = []
-                if len(bench_dic[bench][config][time_type]) > 1:
-                    # per-tile values, extract tile_layout
-                    per_tile_values = bench_dic[bench][config][time_type]
-                    tile_layout = layout_dic[bench][config][time_type]
-                benches.append(BenchDataPoint(
-                    bench,
-                    config,
-                    time_type,
-                    sum(bench_dic[bench][config][time_type]),
-                    settings,
-                    tile_layout,
-                    per_tile_values))
+        benches.extend(_CreateBenchDataPoints(bench, bench_dic[bench],
+                                              layout_dic[bench], settings,
+                                              representations, samples))
 
     return benches
 
-class LinearRegression:
+def parse_table(settings, lines, representation=None, table=None,
+                revision=0):
+    """Parses bench output into the columns of a BenchTable, without
+    creating a BenchDataPoint for each row.
+
+    The rows are those of the points parse() returns, in the same order, and
+    carry the given revision. They are appended to table if given, otherwise
+    to a new BenchTable, which is returned.
+
+    ({str:str}, __iter__ -> str, str, BenchTable, int) -> BenchTable
+    representation is one of the ALGORITHM_XXX types; unlike for parse(), it
+    cannot be a collection of them, as rows do not record their type."""
+
+    representations = _Representations(representation)
+    if len(representations) != 1:
+        raise ValueError('parse_table takes a single representation')
+    bench_dic, layout_dic, settings = _ParseBenches(settings, lines,
+                                                    representations)
+    if table is None:
+        table = BenchTable()
+    for bench in bench_dic:
+        _AppendBenchRows(table, bench, bench_dic[bench], layout_dic[bench],
+                         settings, revision)
+    return table
+
+def iter_parse(settings, lines, representation=None, samples=None):
+    """Parses bench output, yielding data points as each bench finishes.
+
+    Unlike parse(), only the configs of the bench currently being read are
+    kept in memory, so arbitrarily large logs can be processed by callers that
+    filter or aggregate the points. Points are yielded in input order, and
+    carry the settings in effect when their bench finished.
+
+    For the same reason, a bench which appears again later in the log is
+    not merged with its earlier runs: each run yields points of its own.
+    parse() instead merges the values of all runs of a bench into one point
+    per config and time type, whose time is their sum and whose
+    per_tile_values are the values of each run.
+
+    ({str:str}, __iter__ -> str) -> __iter__ -> BenchDataPoint
+    representation and samples are as for parse()."""
+
+    representations = _Representations(representation)
+    current_bench = None
+    bench_dic = {}  # [current_bench][config][time_type] -> [bench values]
+    layout_dic = {}  # [current_bench][config][time_type] -> tile_layout
+
+    for line in lines:
+        settings_match, new_bench, config_re_compiled = _ClassifyLine(line)
+        if settings_match:
+            settings = _ParseSettings(settings_match, settings)
+
+        if new_bench:
+            if current_bench in bench_dic:
+                _ReduceTimes(bench_dic[current_bench], representations, samples)
+                for point in _CreateBenchDataPoints(
+                        current_bench, bench_dic[current_bench],
+                        layout_dic[current_bench], settings,
+                        representations, samples):
+                    yield point
+            bench_dic = {}
+            layout_dic = {}
+            current_bench = new_bench.group(1)
+
+        if current_bench and config_re_compiled:
+            _ParseAndStoreTimes(config_re_compiled,
+                                config_re_compiled is TILE_RE_COMPILED, line,
+                                current_bench, bench_dic, layout_dic)
+
+    if current_bench in bench_dic:
+        _ReduceTimes(bench_dic[current_bench], representations, samples)
+        for point in _CreateBenchDataPoints(
+                current_bench, bench_dic[current_bench],
+                layout_dic[current_bench], settings,
+                representations, samples):
+            yield point
+
+class BenchTable(object):
+    """Columnar storage for a large number of bench data points.
+
+    Bench, config, time type and tile layout strings are interned into one
+    string table and stored as indices, times are stored in an array('d'),
+    and the per-tile values of row i are tile_values[tile_offsets[i] :
+    tile_offsets[i + 1]]. Rows share settings dicts, and may carry the
+    revision they were parsed from. This avoids a BenchDataPoint instance and
+    a list of per-tile values for every point."""
+    def __init__(self):
+        self._strings = []  # interned strings, indexed by the string columns
+        self._string_index = {}  # {str : index in _strings}
+        self._settings = []  # settings dicts, indexed by settings_ids
+        self._settings_index = {}  # {id(settings) : index in _settings}
+        self.revisions = array.array('l')
+        self.benches = array.array('i')
+        self.configs = array.array('i')
+        self.time_types = array.array('i')
+        self.times = array.array('d')
+        self.settings_ids = array.array('i')
+        self.tile_layouts = array.array('i')
+        self.tile_offsets = array.array('l', [0])
+        self.tile_values = array.array('d')
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return self.rows()
+
+    def __getstate__(self):
+        # the indices are rebuilt, as _settings_index is keyed by identity.
+        state = dict(self.__dict__)
+        del state['_string_index']
+        del state['_settings_index']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._string_index = dict((string, i)
+                                  for i, string in enumerate(self._strings))
+        self._settings_index = dict((id(settings), i)
+                                    for i, settings in enumerate(self._settings))
+
+    def _intern(self, string):
+        index = self._string_index.get(string)
+        if index is None:
+            index = len(self._strings)
+            self._strings.append(string)
+            self._string_index[string] = index
+        return index
+
+    def _intern_settings(self, settings):
+        index = self._settings_index.get(id(settings))
+        if index is None:
+            index = len(self._settings)
+            self._settings.append(settings)
+            self._settings_index[id(settings)] = index
+        return index
+
+    def append(self, bench, config, time_type, time, settings,
+               tile_layout='', per_tile_values=(), revision=0):
+        """Adds a row with the same fields as a BenchDataPoint."""
+        self.revisions.append(revision)
+        self.benches.append(self._intern(bench))
+        self.configs.append(self._intern(config))
+        self.time_types.append(self._intern(time_type))
+        self.times.append(time)
+        self.settings_ids.append(self._intern_settings(settings))
+        self.tile_layouts.append(self._intern(tile_layout))
+        self.tile_values.extend(per_tile_values)
+        self.tile_offsets.append(len(self.tile_values))
+
+    def append_point(self, point, revision=0):
+        """Adds a row holding the given BenchDataPoint."""
+        self.append(point.bench, point.config, point.time_type, point.time,
+                    point.settings, point.tile_layout, point.per_tile_values,
+                    revision)
+
+    def extend(self, points, revision=0):
+        """Adds rows for all BenchDataPoints in the iterable points."""
+        for point in points:
+            self.append_point(point, revision)
+
+    def extend_table(self, other, revision=None):
+        """Adds all rows of the BenchTable other, giving them revision if it
+        is not None."""
+        strings = [self._intern(string) for string in other._strings]
+        settings = [self._intern_settings(row_settings)
+                    for row_settings in other._settings]
+        if revision is None:
+            self.revisions.extend(other.revisions)
+        else:
+            self.revisions.extend([revision] * len(other))
+        for column, other_column in [(self.benches, other.benches),
+                                     (self.configs, other.configs),
+                                     (self.time_types, other.time_types),
+                                     (self.tile_layouts, other.tile_layouts)]:
+            column.extend([strings[i] for i in other_column])
+        self.settings_ids.extend([settings[i] for i in other.settings_ids])
+        self.times.extend(other.times)
+        offset = len(self.tile_values)
+        self.tile_offsets.extend([offset + end
+                                  for end in other.tile_offsets[1:]])
+        self.tile_values.extend(other.tile_values)
+
+    def replace_settings(self, old, new):
+        """Makes the rows with the settings dict old have new instead."""
+        index = self._settings_index.pop(id(old), None)
+        if index is None:
+            return
+        self._settings[index] = new
+        self._settings_index.setdefault(id(new), index)
+
+    def take(self, indices):
+        """Returns a BenchTable of the rows with the given indices, in order.
+        """
+        table = BenchTable()
+        table._strings = list(self._strings)
+        table._string_index = dict(self._string_index)
+        table._settings = list(self._settings)
+        table._settings_index = dict(self._settings_index)
+        for name in ['revisions', 'benches', 'configs', 'time_types', 'times',
+                     'settings_ids', 'tile_layouts']:
+            column = getattr(self, name)
+            getattr(table, name).extend([column[i] for i in indices])
+        for i in indices:
+            table.tile_values.extend(self.per_tile_values(i))
+            table.tile_offsets.append(len(table.tile_values))
+        return table
+
+    def bench(self, i):
+        return self._strings[self.benches[i]]
+
+    def config(self, i):
+        return self._strings[self.configs[i]]
+
+    def time_type(self, i):
+        return self._strings[self.time_types[i]]
+
+    def settings(self, i):
+        return self._settings[self.settings_ids[i]]
+
+    def tile_layout(self, i):
+        return self._strings[self.tile_layouts[i]]
+
+    def per_tile_values(self, i):
+        """Returns the per-tile values of row i as an array('d')."""
+        return self.tile_values[self.tile_offsets[i] : self.tile_offsets[i + 1]]
+
+    def point(self, i):
+        """Returns row i as a BenchDataPoint."""
+        return BenchDataPoint(self.bench(i), self.config(i),
+                              self.time_type(i), self.times[i],
+                              self.settings(i), self.tile_layout(i),
+                              list(self.per_tile_values(i)))
+
+    def select(self, bench=None, config=None, time_type=None,
+               ignore_time_type=None, settings=None):
+        """Returns the indices of the rows matching all given filters.
+
+        bench, config, time_type: if not None, the value rows must have.
+        ignore_time_type: if not None, the time type rows must not have,
+            even if it is time_type.
+        settings: if given, rows must not have a different value for any of
+            its keys. Each distinct settings dict is only checked once.
+        (str?, str?, str?, str?, {str:str}?) -> [int]"""
+        wanted = []  # [(column, interned index)]
+        for column, value in [(self.benches, bench), (self.configs, config),
+                              (self.time_types, time_type)]:
+            if value is not None:
+                if value not in self._string_index:
+                    return []
+                wanted.append((column, self._string_index[value]))
+        ignored = None
+        if ignore_time_type is not None:
+            if ignore_time_type == time_type:
+                return []
+            ignored = self._string_index.get(ignore_time_type)
+        allowed_settings = None
+        if settings:
+            allowed_settings = []
+            for row_settings in self._settings:
+                allowed_settings.append(not [
+                    key for key, value in settings.items()
+                    if key in row_settings and row_settings[key] != value])
+
+        indices = []
+        for i in xrange(len(self.times)):
+            skip = False
+            for column, index in wanted:
+                if column[i] != index:
+                    skip = True
+                    break
+            if skip:
+                continue
+            if ignored is not None and self.time_types[i] == ignored:
+                continue
+            if (allowed_settings is not None and
+                not allowed_settings[self.settings_ids[i]]):
+                continue
+            indices.append(i)
+        return indices
+
+    def rows(self, indices=None):
+        """Yields (revision, bench, config, time_type, time, settings) tuples
+        for the given row indices, or for all rows in order."""
+        if indices is None:
+            indices = xrange(len(self.times))
+        strings = self._strings
+        for i in indices:
+            yield (self.revisions[i],
+                   strings[self.benches[i]],
+                   strings[self.configs[i]],
+                   strings[self.time_types[i]],
+                   self.times[i],
+                   self._settings[self.settings_ids[i]])
+
+class RegressionAccumulator(object):
+    """Sufficient statistics for a least-squares fit of a set of points.
+
+    Points can be added and removed one at a time, and accumulators of
+    disjoint point sets can be merged, so sliding windows and partial fits
+    never need a full pass over the points. The sums cost O(1) per point.
+    The smallest and largest x are kept in heaps from which removed values
+    are only dropped once they reach the top, so adding, removing and asking
+    for the extremes cost O(log n) amortized. Pass the accumulator to
+    LinearRegression to get the fit. Removing points subtracts from the
+    running sums, so a long-lived sliding window gathers some floating point
+    error that a refit from the points would not have.
+
+    ([(Number,Number)])"""
+    def __init__(self, points=()):
+        self.n = 0
+        self.Sx = 0.0
+        self.Sy = 0.0
+        self.Sxx = 0.0
+        self.Sxy = 0.0
+        self.Syy = 0.0
+        self._x_counts = {}  # {x: number of points at x}, for remove()
+        # heaps of the x values, and of their negations, which may still
+        # hold values no longer in _x_counts below their tops.
+        self._min_heap = []
+        self._max_heap = []
+        for point in points:
+            self.add(point[0], point[1])
+
+    def __len__(self):
+        return self.n
+
+    def add(self, x, y):
+        """Adds the point (x, y)."""
+        self.n += 1
+        self.Sx += x
+        self.Sy += y
+        self.Sxx += x*x
+        self.Sxy += x*y
+        self.Syy += y*y
+        self._add_x(x, 1)
+
+    def _add_x(self, x, count):
+        previous = self._x_counts.get(x, 0)
+        self._x_counts[x] = previous + count
+        if not previous:
+            heapq.heappush(self._min_heap, x)
+            heapq.heappush(self._max_heap, -x)
+
+    def remove(self, x, y):
+        """Removes the point (x, y), which must have been added before."""
+        count = self._x_counts.get(x, 0)
+        if not count:
+            raise ValueError('No point with x == %s to remove' % x)
+        if count == 1:
+            # left in the heaps until it reaches their tops, or until they
+            # are rebuilt for holding mostly removed values.
+            del self._x_counts[x]
+            if len(self._min_heap) > 2 * len(self._x_counts) + 16:
+                self._min_heap = self._x_counts.keys()
+                heapq.heapify(self._min_heap)
+            if len(self._max_heap) > 2 * len(self._x_counts) + 16:
+                self._max_heap = [-x for x in self._x_counts]
+                heapq.heapify(self._max_heap)
+        else:
+            self._x_counts[x] = count - 1
+        self.n -= 1
+        self.Sx -= x
+        self.Sy -= y
+        self.Sxx -= x*x
+        self.Sxy -= x*y
+        self.Syy -= y*y
+
+    def merge(self, other):
+        """Adds all the points accumulated in other."""
+        self.n += other.n
+        self.Sx += other.Sx
+        self.Sy += other.Sy
+        self.Sxx += other.Sxx
+        self.Sxy += other.Sxy
+        self.Syy += other.Syy
+        for x, count in other._x_counts.iteritems():
+            self._add_x(x, count)
+
+    def min_x(self):
+        """Returns the smallest x, or Max if there are no points."""
+        heap = self._min_heap
+        while heap and heap[0] not in self._x_counts:
+            heapq.heappop(heap)
+        return heap[0] if heap else Max
+
+    def max_x(self):
+        """Returns the largest x, or Min if there are no points."""
+        heap = self._max_heap
+        while heap and -heap[0] not in self._x_counts:
+            heapq.heappop(heap)
+        return -heap[0] if heap else Min
+
+class LinearRegression(object):
     """Linear regression data based on a set of data points.
 
-    ([(Number,Number)])
+    ([(Number,Number)] or RegressionAccumulator)
     There must be at least two points for this to make sense."""
     def __init__(self, points):
-        n = len(points)
-        max_x = Min
-        min_x = Max
-
-        Sx = 0.0
-        Sy = 0.0
-        Sxx = 0.0
-        Sxy = 0.0
-        Syy = 0.0
-        for point in points:
-            x = point[0]
-            y = point[1]
-            max_x = max(max_x, x)
-            min_x = min(min_x, x)
-
-            Sx += x
-            Sy += y
-            Sxx += x*x
-            Sxy += x*y
-            Syy += y*y
+        if isinstance(points, RegressionAccumulator):
+            accumulator = points
+        else:
+            accumulator = RegressionAccumulator(points)
+        n = accumulator.n
+        Sx = accumulator.Sx
+        Sy = accumulator.Sy
+        Sxx = accumulator.Sxx
+        Sxy = accumulator.Sxy
+        Syy = accumulator.Syy
 
         denom = n*Sxx - Sx*Sx
         if (denom != 0.0):
@@ -249,8 +962,8 @@ class LinearRegression:
         self.serror = math.sqrt(max(0, se2))
         self.serror_slope = math.sqrt(max(0, sB2))
         self.serror_intercept = math.sqrt(max(0, sa2))
-        self.max_x = max_x
-        self.min_x = min_x
+        self.max_x = accumulator.max_x()
+        self.min_x = accumulator.min_x()
 
     def __repr__(self):
         return "LinearRegression(%s, %s, %s, %s, %s)" % (
@@ -282,6 +995,588 @@ class LinearRegression:
 
         return 0
 
+def _Median(values):
+    """Returns the median of a non-empty list of numbers, reordering it."""
+    middle = len(values) // 2
+    upper = _SelectKth(values, middle)
+    if len(values) % 2:
+        return upper
+    return (_SelectKth(values, middle - 1) + upper) / 2.0
+
+def _MergeInversions(keys, strict=False, visit=None):
+    """Counts the pairs of positions a < b with keys[a] >= keys[b], or
+    keys[a] > keys[b] if strict, with a bottom-up merge sort.
+
+    If given, visit(lefts, start, b) is called with the positions
+    lefts[start:] forming such pairs with b, so every pair is reported in
+    exactly one call. O(n log n) plus the visits."""
+    n = len(keys)
+    order = range(n)
+    count = 0
+    width = 1
+    while width < n:
+        merged = []
+        for first in xrange(0, n, 2 * width):
+            left = order[first:first + width]
+            left_length = len(left)
+            i = 0
+            for b in order[first + width:first + 2 * width]:
+                key = keys[b]
+                if strict:
+                    while i < left_length and keys[left[i]] <= key:
+                        merged.append(left[i])
+                        i += 1
+                else:
+                    while i < left_length and keys[left[i]] < key:
+                        merged.append(left[i])
+                        i += 1
+                if i < left_length:
+                    count += left_length - i
+                    if visit is not None:
+                        visit(left, i, b)
+                merged.append(b)
+            merged.extend(left[i:])
+        order = merged
+        width *= 2
+    return count
+
+class _SlopeCounter(object):
+    """Order statistics of the slopes between all pairs of points with
+    different x, without listing the pairs.
+
+    A pair i, j with x_i < x_j has a slope <= t exactly when
+    y_j - t*x_j <= y_i - t*x_i, so the pairs on either side of t are the
+    inversions of the points ordered by x when keyed on y - t*x, and the
+    pairs with slopes in (lo, hi] are the inversions between the orders at
+    lo and at hi. Both are found by merge sort in O(n log n).
+
+    ([Number], [Number]) with xs ascending"""
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+        self.equal_x_pairs = 0
+        run = 1
+        for i in xrange(1, len(xs) + 1):
+            if i < len(xs) and xs[i] == xs[i - 1]:
+                run += 1
+            else:
+                self.equal_x_pairs += run * (run - 1) // 2
+                run = 1
+        n = len(xs)
+        self.pairs = n * (n - 1) // 2 - self.equal_x_pairs
+
+    def slope(self, i, j):
+        return (self.ys[j] - self.ys[i]) / float(self.xs[j] - self.xs[i])
+
+    def all_slopes(self):
+        """Returns every slope, in O(n^2)."""
+        xs = self.xs
+        return [self.slope(i, j)
+                for i in xrange(len(xs)) for j in xrange(i + 1, len(xs))
+                if xs[i] != xs[j]]
+
+    def count_at_most(self, t, strict=False):
+        """Returns the number of slopes <= t, or < t if strict."""
+        keys = [y - t*x for x, y in itertools.izip(self.xs, self.ys)]
+        if strict:
+            # pairs with equal x are never strict inversions in this order.
+            order = sorted(xrange(len(keys)),
+                           key=lambda i: (self.xs[i], keys[i]))
+            return _MergeInversions([keys[i] for i in order], strict=True)
+        # pairs with equal x are always inversions in this order.
+        order = sorted(xrange(len(keys)), key=lambda i: (self.xs[i], -keys[i]))
+        return (_MergeInversions([keys[i] for i in order]) -
+                self.equal_x_pairs)
+
+    def extremes(self):
+        """Returns the smallest and largest slope. Both are found between
+        points at consecutive distinct x."""
+        xs = self.xs
+        ys = self.ys
+        groups = []  # [(x, min y, max y)]
+        for x, y in itertools.izip(xs, ys):
+            if groups and groups[-1][0] == x:
+                _, low, high = groups[-1]
+                groups[-1] = (x, min(low, y), max(high, y))
+            else:
+                groups.append((x, y, y))
+        smallest = Max
+        largest = Min
+        for (x0, low0, high0), (x1, low1, high1) in itertools.izip(
+                groups, groups[1:]):
+            width = float(x1 - x0)
+            smallest = min(smallest, (low1 - high0) / width)
+            largest = max(largest, (high1 - low0) / width)
+        return smallest, largest
+
+    def slopes_between(self, lo, hi, sample_size=None):
+        """Returns the slopes of the pairs in (lo, hi], or of sample_size
+        pairs of them chosen at random."""
+        xs = self.xs
+        ys = self.ys
+        lo_keys = [y - lo*x for x, y in itertools.izip(xs, ys)]
+        hi_keys = [y - hi*x for x, y in itertools.izip(xs, ys)]
+        order = sorted(xrange(len(xs)),
+                       key=lambda i: (lo_keys[i], hi_keys[i]))
+        keys = [hi_keys[i] for i in order]
+        slopes = []
+        if sample_size is None:
+            def visit(lefts, start, b):
+                j = order[b]
+                for a in lefts[start:]:
+                    i = order[a]
+                    if xs[i] != xs[j]:
+                        slopes.append(self.slope(i, j))
+        else:
+            count = _MergeInversions(keys)
+            if not count:
+                return slopes
+            # pair numbers in the order visit() sees them
+            wanted = sorted(random.randrange(count)
+                            for _ in xrange(sample_size))
+            wanted.reverse()
+            seen = [0]
+            def visit(lefts, start, b):
+                end = seen[0] + len(lefts) - start
+                j = order[b]
+                while wanted and wanted[-1] < end:
+                    i = order[lefts[start + wanted.pop() - seen[0]]]
+                    if xs[i] != xs[j]:
+                        slopes.append(self.slope(i, j))
+                seen[0] = end
+        _MergeInversions(keys, visit=visit)
+        return slopes
+
+def _TheilSenSlope(xs, ys):
+    """Returns the median slope between pairs of points with different x,
+    or 0.0 if there are none.
+
+    Small inputs list every slope. Larger ones use randomized interval
+    contraction: each round samples slopes from the interval known to hold
+    the median, narrows it to the sample quantiles around the median's rank
+    and counts the slopes below the new bounds, until few enough are left
+    to list. This takes expected O(n log n) time.
+
+    ([Number], [Number]) with xs ascending -> float"""
+    counter = _SlopeCounter(xs, ys)
+    total = counter.pairs
+    if total == 0:
+        return 0.0
+    if total <= THEIL_SEN_DIRECT_PAIRS:
+        return _Median(counter.all_slopes())
+
+    low_rank = (total - 1) // 2
+    high_rank = total // 2
+    smallest, largest = counter.extremes()
+    # The median's slopes are in (lo, hi]; below of them are <= lo and
+    # at_most_hi are <= hi.
+    lo = smallest - 1.0 - abs(smallest)
+    hi = largest
+    below = counter.count_at_most(lo)
+    at_most_hi = counter.count_at_most(hi)
+    sample_size = len(xs)
+    for _ in xrange(THEIL_SEN_MAX_ROUNDS):
+        inside = at_most_hi - below
+        if inside <= max(THEIL_SEN_DIRECT_PAIRS, 4 * len(xs)):
+            break
+        sample = counter.slopes_between(lo, hi, sample_size)
+        if not sample:
+            break
+        sample.sort()
+        spread = 2 * int(math.sqrt(len(sample)))
+        scale = float(len(sample)) / inside
+        new_lo_index = int((low_rank - below) * scale) - spread
+        new_hi_index = int((high_rank - below) * scale) + spread
+        if 0 <= new_lo_index:
+            new_lo = sample[new_lo_index]
+            new_below = counter.count_at_most(new_lo)
+            if new_below <= low_rank:
+                lo, below = new_lo, new_below
+            elif counter.count_at_most(new_lo, strict=True) <= low_rank:
+                # both middle slopes are tied at new_lo.
+                if new_below > high_rank:
+                    return new_lo
+        if new_hi_index < len(sample):
+            new_hi = sample[new_hi_index]
+            new_at_most_hi = counter.count_at_most(new_hi)
+            if new_at_most_hi > high_rank:
+                hi, at_most_hi = new_hi, new_at_most_hi
+
+    slopes = counter.slopes_between(lo, hi)
+    if not slopes:
+        return hi
+    last = len(slopes) - 1
+    upper = _SelectKth(slopes, max(0, min(last, high_rank - below)))
+    if low_rank == high_rank:
+        return upper
+    lower = _SelectKth(slopes, max(0, min(last, low_rank - below)))
+    return (lower + upper) / 2.0
+
+class TheilSenRegression(LinearRegression):
+    """Theil-Sen regression data based on a set of data points.
+
+    The slope is the median of the slopes between all pairs of points, and
+    the intercept the median of y - slope*x, so a few outlying points barely
+    move the line. serror is the median absolute residual scaled to match a
+    normal standard deviation, and the slope and intercept errors are derived
+    from it as for a least-squares fit.
+
+    ([(Number,Number)])
+    There must be at least two points for this to make sense."""
+    def __init__(self, points):
+        points = sorted(points, key=lambda point: point[0])
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        accumulator = RegressionAccumulator(points)
+        n = accumulator.n
+
+        B = _TheilSenSlope(xs, ys)
+        a = _Median([y - B*x for x, y in points])
+
+        se2 = 0
+        sB2 = 0
+        sa2 = 0
+        denom = n*accumulator.Sxx - accumulator.Sx*accumulator.Sx
+        if (n >= 3 and denom != 0.0):
+            mad = _Median([abs(y - (B*x + a)) for x, y in points])
+            se2 = (MAD_TO_STANDARD_DEVIATION * mad) ** 2
+            sB2 = (n*se2) / denom
+            sa2 = sB2 * (1.0/n) * accumulator.Sxx
+
+        self.slope = B
+        self.intercept = a
+        self.serror = math.sqrt(max(0, se2))
+        self.serror_slope = math.sqrt(max(0, sB2))
+        self.serror_intercept = math.sqrt(max(0, sa2))
+        self.max_x = accumulator.max_x()
+        self.min_x = accumulator.min_x()
+
+    def __repr__(self):
+        return "TheilSenRegression(%s, %s, %s, %s, %s)" % (
+                   str(self.slope),
+                   str(self.intercept),
+                   str(self.serror),
+                   str(self.serror_slope),
+                   str(self.serror_intercept),
+               )
+
+def _FitBatch(point_lists, min_x, max_x):
+    """FitLinearRegressions using numpy.
+
+    The points of all lists are packed into flat arrays with an offset per
+    list. The sums are accumulated one point position at a time across all
+    lists, so every list is summed in the same order as by LinearRegression
+    and the results are identical."""
+    lengths = numpy.fromiter((len(points) for points in point_lists), int,
+                             len(point_lists))
+    total = int(lengths.sum())
+    xs = numpy.array([p[0] for points in point_lists for p in points])
+    ys = numpy.fromiter((p[1] for points in point_lists for p in points),
+                        float, total)
+    segment_ids = numpy.repeat(numpy.arange(len(point_lists)), lengths)
+    if min_x is not None or max_x is not None:
+        keep = numpy.ones(total, dtype=bool)
+        if min_x is not None:
+            keep &= xs >= min_x
+        if max_x is not None:
+            keep &= xs <= max_x
+        xs = xs[keep]
+        ys = ys[keep]
+        segment_ids = segment_ids[keep]
+        lengths = numpy.bincount(segment_ids, minlength=len(point_lists))
+
+    fitted = numpy.flatnonzero(lengths >= 2)
+    regressions = [None] * len(point_lists)
+    if not len(fitted):
+        return regressions
+    offsets = numpy.zeros(len(point_lists) + 1, dtype=int)
+    numpy.cumsum(lengths, out=offsets[1:])
+    starts = offsets[fitted]
+    counts = lengths[fitted]
+
+    # x*x is taken before converting to float, as Python does for int x.
+    columns = numpy.column_stack((xs, ys, xs*xs, xs*ys, ys*ys)).astype(float)
+    # Longest lists first, so the lists still going at each position are a
+    # prefix of the order.
+    order = numpy.argsort(-counts, kind='mergesort')
+    sorted_starts = starts[order]
+    sorted_counts = counts[order]
+    sums = numpy.zeros((len(fitted), 5))
+    for position in xrange(int(sorted_counts[0])):
+        active = int(numpy.searchsorted(-sorted_counts, -position,
+                                        side='left'))
+        sums[:active] += columns[sorted_starts[:active] + position]
+    unsorted_sums = numpy.empty_like(sums)
+    unsorted_sums[order] = sums
+    Sx, Sy, Sxx, Sxy, Syy = unsorted_sums.T
+    n = counts.astype(float)
+
+    # The same arithmetic as LinearRegression.__init__, element by element.
+    old_settings = numpy.seterr(divide='ignore', invalid='ignore')
+    try:
+        denom = n*Sxx - Sx*Sx
+        B = numpy.where(denom != 0.0, (n*Sxy - Sx*Sy) / denom, 0.0)
+        a = (1.0/n)*(Sy - B*Sx)
+        errors = (counts >= 3) & (denom != 0.0)
+        se2 = numpy.where(errors,
+            (1.0/(n*(n-2)) * (n*Syy - Sy*Sy - B*B*denom)), 0.0)
+        sB2 = numpy.where(errors, (n*se2) / denom, 0.0)
+        sa2 = sB2 * (1.0/n) * Sxx
+        # max(0, v) as in LinearRegression, which never gives -0.0 or nan.
+        serror = numpy.sqrt(numpy.where(se2 > 0, se2, 0.0))
+        serror_slope = numpy.sqrt(numpy.where(sB2 > 0, sB2, 0.0))
+        serror_intercept = numpy.sqrt(numpy.where(sa2 > 0, sa2, 0.0))
+    finally:
+        numpy.seterr(**old_settings)
+    # reduceat reduces up to the next given start, so give every non-empty
+    # list's start and pick the fitted ones from the results.
+    non_empty = numpy.flatnonzero(lengths)
+    positions = numpy.searchsorted(non_empty, fitted)
+    min_xs = numpy.minimum.reduceat(xs, offsets[non_empty])[positions]
+    max_xs = numpy.maximum.reduceat(xs, offsets[non_empty])[positions]
+
+    for values in zip(fitted.tolist(), B.tolist(), a.tolist(),
+                      serror.tolist(), serror_slope.tolist(),
+                      serror_intercept.tolist(), min_xs.tolist(),
+                      max_xs.tolist()):
+        regression = LinearRegression.__new__(LinearRegression)
+        (i, regression.slope, regression.intercept, regression.serror,
+         regression.serror_slope, regression.serror_intercept,
+         regression.min_x, regression.max_x) = values
+        regressions[i] = regression
+    return regressions
+
+def FitLinearRegressions(point_lists, min_x=None, max_x=None):
+    """Fits a LinearRegression to each of the point lists.
+
+    Only points with min_x <= x <= max_x are used, when these are given.
+    Lists with fewer than two such points get None. With numpy and enough
+    points, all lists are fitted together; the results are the same as
+    fitting one LinearRegression per list.
+
+    ([[(Number,Number)]], Number, Number) -> [LinearRegression or None]"""
+    total = sum(len(points) for points in point_lists)
+    if numpy is not None and total >= NUMPY_MIN_REGRESSION_POINTS:
+        return _FitBatch(point_lists, min_x, max_x)
+
+    regressions = []
+    for points in point_lists:
+        if min_x is not None or max_x is not None:
+            points = [p for p in points
+                      if (min_x is None or min_x <= p[0]) and
+                         (max_x is None or p[0] <= max_x)]
+        if len(points) < 2:
+            regressions.append(None)
+        else:
+            regressions.append(LinearRegression(points))
+    return regressions
+
+def MannWhitneyU(old_values, new_values):
+    """Two-sided Mann-Whitney U test of whether one set of values tends to be
+    larger than the other, making no assumption about their distribution.
+
+    Uses the normal approximation with tie and continuity corrections, which
+    is accurate once both sides have more than a few values. Runs in
+    O(n log n) for n values in all.
+
+    ([Number], [Number]) -> (U of old_values, two-sided p-value)"""
+    n1 = len(old_values)
+    n2 = len(new_values)
+    if not n1 or not n2:
+        return (0.0, 1.0)
+    combined = sorted([(value, 0) for value in old_values] +
+                      [(value, 1) for value in new_values])
+    old_rank_sum = 0.0
+    tie_term = 0.0  # sum of t^3 - t over groups of t tied values
+    start = 0
+    while start < len(combined):
+        end = start + 1
+        while end < len(combined) and combined[end][0] == combined[start][0]:
+            end += 1
+        # 1-based ranks start+1..end share their average.
+        rank = (start + 1 + end) / 2.0
+        for _, side in combined[start:end]:
+            if side == 0:
+                old_rank_sum += rank
+        ties = end - start
+        tie_term += ties * ties * ties - ties
+        start = end
+
+    u = old_rank_sum - n1 * (n1 + 1) / 2.0
+    n = n1 + n2
+    variance = n1 * n2 / 12.0 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return (u, 1.0)
+    z = max(0.0, abs(u - n1 * n2 / 2.0) - 0.5) / math.sqrt(variance)
+    return (u, math.erfc(z / math.sqrt(2)))
+
+def _NoiseDeviation(values):
+    """Estimates the standard deviation of the noise in values from the
+    median absolute deviation of successive differences, which level shifts
+    and spikes barely affect."""
+    differences = [b - a for a, b in itertools.izip(values, values[1:])]
+    center = _Median(list(differences))
+    mad = _Median([abs(d - center) for d in differences])
+    deviation = MAD_TO_STANDARD_DEVIATION * mad / math.sqrt(2)
+    floor = CHANGE_POINT_MIN_RELATIVE_NOISE * abs(_Median(list(values)))
+    return max(deviation, floor)
+
+def _RemoveSpikes(values, deviation):
+    """Returns values with spikes replaced by the median of their neighbours.
+
+    A running median keeps level shifts in place, so only values that stand
+    out from both sides are replaced."""
+    half = CHANGE_POINT_SPIKE_WINDOW
+    limit = CHANGE_POINT_SPIKE_SIGMAS * deviation
+    filtered = list(values)
+    for i, value in enumerate(values):
+        window = values[max(0, i - half):i + half + 1]
+        median = _Median(window)
+        if abs(value - median) > limit:
+            filtered[i] = median
+    return filtered
+
+def FindChangePoints(values, penalty=None,
+                     min_segment=CHANGE_POINT_MIN_SEGMENT):
+    """Returns the ascending indices i at which the level of values shifts,
+    so that values[i] is the first value at the new level.
+
+    Uses binary segmentation with a squared error cost: the split that
+    reduces the cost of a segment the most is kept if the reduction is more
+    than penalty noise variances, and both halves are searched again. The
+    noise is estimated robustly, spikes are removed before splitting, and
+    segment costs come from prefix sums, so a series of n values with k
+    change points takes O(n (k + 1)) time.
+
+    ([Number], float, int) -> [int]"""
+    n = len(values)
+    if n < 2 * min_segment:
+        return []
+    if penalty is None:
+        penalty = CHANGE_POINT_PENALTY * math.log(n)
+    deviation = _NoiseDeviation(values)
+    if deviation == 0:
+        return []
+    filtered = _RemoveSpikes(values, deviation)
+
+    # Prefix sums of the centered values in units of the noise deviation.
+    center = sum(filtered) / float(n)
+    sums = [0.0]
+    squares = [0.0]
+    for value in filtered:
+        value = (value - center) / deviation
+        sums.append(sums[-1] + value)
+        squares.append(squares[-1] + value*value)
+
+    def cost(start, end):
+        total = sums[end] - sums[start]
+        return squares[end] - squares[start] - total*total / (end - start)
+
+    change_points = []
+    segments = [(0, n)]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2 * min_segment:
+            continue
+        whole = cost(start, end)
+        best_gain = penalty
+        best_split = None
+        for split in xrange(start + min_segment, end - min_segment + 1):
+            gain = whole - cost(start, split) - cost(split, end)
+            if gain > best_gain:
+                best_gain = gain
+                best_split = split
+        if best_split is not None:
+            change_points.append(best_split)
+            segments.append((start, best_split))
+            segments.append((best_split, end))
+    change_points.sort()
+    return change_points
+
+def SegmentMedians(values, splits):
+    """Returns the median of each segment of values between the ascending
+    split indices, as returned by FindChangePoints.
+
+    ([Number], [int]) -> [float]"""
+    bounds = [0] + list(splits) + [len(values)]
+    return [_Median(values[start:end])
+            for start, end in zip(bounds, bounds[1:])]
+
+def FindOutliers(values, half_window=OUTLIER_HALF_WINDOW,
+                 sigmas=OUTLIER_SIGMAS):
+    """Returns the ascending indices of the values which stand out from
+    their neighbours, such as a spike to ten times the usual time.
+
+    This is a Hampel filter: each value is compared to the median of the
+    window of itself and half_window values on either side, in units of the
+    window's median absolute deviation. A level shift splits the windows
+    around it evenly, so the values next to it are kept. The window is kept
+    sorted as it slides along values in one pass, so this takes
+    O(n half_window) time.
+
+    ([Number], int, float) -> [int]"""
+    n = len(values)
+    window = sorted(values[:half_window])
+    outliers = []
+    for i in xrange(n):
+        if i + half_window < n:
+            bisect.insort(window, values[i + half_window])
+        if i > half_window:
+            del window[bisect.bisect_left(window, values[i - half_window - 1])]
+        size = len(window)
+        if size < OUTLIER_MIN_WINDOW:
+            continue
+        if size % 2:
+            median = window[size // 2]
+        else:
+            median = (window[size // 2 - 1] + window[size // 2]) / 2.0
+        mad = _Median([abs(value - median) for value in window])
+        deviation = max(MAD_TO_STANDARD_DEVIATION * mad,
+                        OUTLIER_MIN_RELATIVE_NOISE * abs(median))
+        if abs(values[i] - median) > sigmas * deviation:
+            outliers.append(i)
+    return outliers
+
+def LargestTriangleThreeBuckets(points, threshold):
+    """Downsamples points to at most threshold of them, for display.
+
+    Keeps the first and last points, and from each of threshold - 2 equal
+    buckets in between the point forming the largest triangle with the point
+    kept from the previous bucket and the average of the next bucket. Spikes
+    form large triangles, so they stay visible where a plain average or
+    stride would smooth them away. Returns points itself if it is already
+    small enough, or if threshold is less than 3.
+
+    ([(x, y)] | [n].x <= [n+1].x, int) -> [(x, y)]"""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return points
+    sampled = [points[0]]
+    bucket_width = float(n - 2) / (threshold - 2)
+    kept = 0
+    for bucket in xrange(threshold - 2):
+        start = int(bucket * bucket_width) + 1
+        end = int((bucket + 1) * bucket_width) + 1
+        next_end = min(int((bucket + 2) * bucket_width) + 1, n)
+        next_count = float(next_end - end)
+        next_x = sum(p[0] for p in points[end:next_end]) / next_count
+        next_y = sum(p[1] for p in points[end:next_end]) / next_count
+
+        kept_x, kept_y = points[kept]
+        best_area = -1.0
+        for i in xrange(start, end):
+            x, y = points[i]
+            # Twice the triangle's area; only the comparison matters.
+            area = abs((kept_x - next_x) * (y - kept_y) -
+                       (kept_x - x) * (next_y - kept_y))
+            if area > best_area:
+                best_area = area
+                best = i
+        sampled.append(points[best])
+        kept = best
+    sampled.append(points[-1])
+    return sampled
+
 def CreateRevisionLink(revision_number):
     """Returns HTML displaying the given revision number and linking to
     that revision's change page at code.google.com, e.g.
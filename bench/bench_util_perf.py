@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+'''
+Measures the speed of the bench output processing in bench_util.py on large
+synthetic bench logs, so changes to the parser can be compared before and
+after.
+'''
+import optparse
+import random
+import time
+
+import bench_util
+
+# Number of configs and time types on each synthetic microbench line.
+MICRO_CONFIGS = ['8888', '565', 'GPU', 'NULLGPU']
+TIME_TYPES = ['', 'c', 'g']
+
+# Tile layout of each synthetic picture bench.
+TILE_COLUMNS = 4
+TILE_ROWS = 6
+
+def synthetic_log(num_benches, iterations, seed=0):
+    """Returns a list of lines resembling bench and bench_pictures output.
+
+    Half of the benches are microbenches with all configs on their 'running
+    bench' line; the other half are picture benches with one line per tile.
+    Each time has the given number of comma-separated iterations."""
+    rand = random.Random(seed)
+
+    def times(base):
+        return ', '.join(['%.2f' % (base * rand.uniform(0.9, 1.2))
+                          for _ in range(iterations)])
+
+    lines = ['skia bench: alpha=0xFF antialias=1 filter=0 dither=default '
+             'rotate=0 scale=0 clip=0\n']
+    for i in range(num_benches):
+        base = rand.uniform(0.5, 50)
+        if i % 2:
+            line = 'running bench [640 480] %28s' % ('micro_%d' % i)
+            for config in MICRO_CONFIGS:
+                line += '   %s:' % config
+                for time_type in TIME_TYPES:
+                    line += ' %smsecs = %s' % (time_type, times(base))
+            lines.append(line + '\n')
+        else:
+            lines.append('running bench [1024 768] picture_%d.skp \n' % i)
+            for tile in range(TILE_COLUMNS * TILE_ROWS):
+                position = (tile % TILE_COLUMNS, tile / TILE_COLUMNS)
+                lines.append('  tile_256x256: tile [%d,%d] out of [%d,%d] '
+                             '<averaged>: msecs = %s\n' % (
+                                 position + (TILE_COLUMNS, TILE_ROWS,
+                                             times(base))))
+                lines.append('  tile_256x256: tile [%d,%d] out of [%d,%d]: '
+                             'msecs = %s\n' % (
+                                 position + (TILE_COLUMNS, TILE_ROWS,
+                                             times(base))))
+            lines.append('  simple_viewport_1024x768: msecs = %s '
+                         'cmsecs = %s\n' % (times(base), times(base)))
+    return lines
+
+def best_time(function, repeat):
+    """Returns the fastest of repeat wall times of calling function."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def time_parse(lines, representation, repeat):
+    """Prints the lines/sec of bench_util.parse and iter_parse over lines."""
+    for name, parser in [('parse', bench_util.parse),
+                         ('iter_parse', bench_util.iter_parse)]:
+        elapsed = best_time(
+            lambda: list(parser({}, lines, representation)), repeat)
+        print '%-12s %10d lines %8.3f s %12.0f lines/sec' % (
+            name, len(lines), elapsed, len(lines) / elapsed)
+
+def time_representations(num_lists, iterations, repeat, seed=0):
+    """Prints lists/sec of reducing iteration lists to each representation,
+    one list at a time and all lists in one batch."""
+    rand = random.Random(seed)
+    lists = [[round(rand.uniform(1, 100), 2) for _ in range(iterations)]
+             for _ in range(num_lists)]
+    for representation in [bench_util.ALGORITHM_AVERAGE,
+                           bench_util.ALGORITHM_MINIMUM,
+                           bench_util.ALGORITHM_MEDIAN,
+                           bench_util.ALGORITHM_25TH_PERCENTILE]:
+        for name, reduce_lists in [
+            ('per list', lambda: [
+                bench_util._ListAlgorithm(list(iters), representation).compute()
+                for iters in lists]),
+            ('batched', lambda: bench_util.ComputeRepresentations(
+                [list(iters) for iters in lists], representation))]:
+            elapsed = best_time(reduce_lists, repeat)
+            print '%-4s %-8s %6d x %6d iterations %8.3f s %10.0f lists/sec' % (
+                representation, name, num_lists, iterations, elapsed,
+                num_lists / elapsed)
+
+def main():
+    """Parses flags and prints timings."""
+    parser = optparse.OptionParser('USAGE: %prog [options]')
+    parser.add_option('-b', '--benches', dest='benches', type='int',
+                      default=2000, help='number of benches in the log.')
+    parser.add_option('-i', '--iterations', dest='iterations', type='int',
+                      default=10, help='iterations per bench time.')
+    parser.add_option('-l', '--lists', dest='lists', type='int', default=0,
+                      help=('if set, also time reducing this many iteration '
+                            'lists to each representation.'))
+    parser.add_option('-m', '--representation', dest='representation',
+                      default=bench_util.ALGORITHM_25TH_PERCENTILE,
+                      help='bench representation algorithm.')
+    parser.add_option('-n', '--repeat', dest='repeat', type='int', default=3,
+                      help='number of timed runs; the best one is reported.')
+    (options, _) = parser.parse_args()
+
+    lines = synthetic_log(options.benches, options.iterations)
+    time_parse(lines, options.representation, options.repeat)
+    if options.lists:
+        time_representations(options.lists, options.iterations, options.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -22,14 +22,11 @@ See http://developers.google.com/storage/docs/gspythonlibrary for details.
 __author__ = 'bensong@google.com (Ben Chen)'
 
 import bench_util
-import boto
 import cStringIO
 import optparse
 import re
 import shutil
 
-from oauth2_plugin import oauth2_plugin
-
 
 # Ratios for calculating suggested picture bench upper and lower bounds.
 BENCH_UB = 1.1  # Allow for 10% room for normal variance on the up side.
@@ -90,15 +87,38 @@ BENCH_TYPES = ['micro', 'skp']
 # List of valid representation algorithms.
 REPRESENTATION_ALGS = ['avg', 'min', 'med', '25th']
 
-def OutputBenchExpectations(bench_type, rev_min, rev_max, representation_alg):
+def BenchExpectations(lines, platform, representation_algs):
+  """Returns {expectation key: bench value} for the lines of one bench file.
+
+  A bench which ran more than once in the file gets the sum of the values of
+  its runs, as bench_util.parse() gives it.
+  """
+  values = {}  # [key] -> [values of each run, or of each tile of each run]
+  for point in bench_util.iter_parse('', lines, representation_algs):
+    if point.config in CONFIGS_TO_FILTER:
+      continue
+
+    key = '%s_%s_%s,%s-%s' % (point.bench, point.config, point.time_type,
+                              platform, point.representation)
+    values.setdefault(key, []).extend(point.per_tile_values or [point.time])
+  return dict((key, sum(key_values))
+              for key, key_values in values.iteritems())
+
+def OutputBenchExpectations(bench_type, rev_min, rev_max, representation_algs):
   """Reads bench data from google storage, and outputs expectations.
 
   Ignores data with revisions outside [rev_min, rev_max] integer range. For
   bench data with multiple revisions, we use higher revisions to calculate
   expected bench values.
   bench_type is either 'micro' or 'skp', according to the flag '-b'.
-  Uses the provided representation_alg for calculating bench representations.
+  Outputs expectations for each of the provided representation_algs, all
+  calculated from a single read of the bench data.
   """
+  # Imported here, so that BenchExpectations can be used without the Google
+  # Storage library.
+  import boto
+  from oauth2_plugin import oauth2_plugin
+
   if bench_type not in BENCH_TYPES:
     raise Exception('Not valid bench_type! (%s)' % BENCH_TYPES)
   expectation_dic = {}
@@ -132,16 +152,10 @@ def OutputBenchExpectations(bench_type, rev_min, rev_max, representation_alg):
       continue
     contents = cStringIO.StringIO()
     obj.get_file(contents)
-    for point in bench_util.parse('', contents.getvalue().split('\n'),
-                                  representation_alg):
-      if point.config in CONFIGS_TO_FILTER:
-        continue
-
-      key = '%s_%s_%s,%s-%s' % (point.bench, point.config, point.time_type,
-                                platform, representation_alg)
-      # It is fine to have later revisions overwrite earlier benches, since we
-      # only use the latest bench within revision range to set expectations.
-      expectation_dic[key] = point.time
+    # It is fine to have later revisions overwrite earlier benches, since we
+    # only use the latest bench within revision range to set expectations.
+    expectation_dic.update(BenchExpectations(
+        contents.getvalue().split('\n'), platform, representation_algs))
   keys = expectation_dic.keys()
   keys.sort()
   for key in keys:
@@ -163,8 +177,13 @@ def main():
   parser.add_option(OPTION_REPRESENTATION_ALG_SHORT, OPTION_REPRESENTATION_ALG,
       dest='alg', default='25th',
       help=('Bench representation algorithm. One of '
-            '%s. Default to "25th".' % str(REPRESENTATION_ALGS)))
+            '%s, or several of them separated by ",". Default to "25th".' %
+            str(REPRESENTATION_ALGS)))
   (options, args) = parser.parse_args()
+  algs = options.alg.split(',')
+  for alg in algs:
+    if alg not in REPRESENTATION_ALGS:
+      parser.error('Wrong representation algorithm [%s]' % alg)
   if options.rev_range:
     range_match = re.search('(\d+)\:(\d+)', options.rev_range)
     if not range_match:
@@ -172,7 +191,7 @@ def main():
     else:
       rev_min = int(range_match.group(1))
       rev_max = int(range_match.group(2))
-      OutputBenchExpectations(options.bench_type, rev_min, rev_max, options.alg)
+      OutputBenchExpectations(options.bench_type, rev_min, rev_max, algs)
   else:
     parser.error('Please provide mandatory flag %s' % OPTION_REVISION_RANGE)
 
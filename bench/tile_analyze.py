@@ -196,19 +196,23 @@ def OutputTileAnalysis(rev, representation_alg, bench_dir, platform):
                 '<h3>PLATFORM: %s REVISION: %s</h3><br>' % (platform, rev))
   bench_dic = {}  # [bench][config] -> [layout, [values]]
   file_dic = GetFiles(rev, bench_dir, platform)
+  # Keeps all points in columnar form, with per-tile values in one array.
+  table = bench_util.BenchTable()
   for f in file_dic:
-    for point in bench_util.parse('', file_dic[f].split('\n'),
-                                  representation_alg):
-      if point.time_type:  # Ignores non-walltime time_type.
-        continue
-      bench = point.bench.replace('.skp', '')
-      config = point.config.replace('simple_', '')
-      components = config.split('_')
-      if components[0] == 'viewport':
-        bench_dic.setdefault(bench, {})[config] = [components[1], [point.time]]
-      else:  # Stores per-tile benches.
-        bench_dic.setdefault(bench, {})[config] = [
-          point.tile_layout, point.per_tile_values]
+    bench_util.parse_table('', file_dic[f].split('\n'), representation_alg,
+                           table)
+  for i in xrange(len(table)):
+    if table.time_type(i):  # Ignores non-walltime time_type.
+      continue
+    bench = table.bench(i).replace('.skp', '')
+    config = table.config(i).replace('simple_', '')
+    components = config.split('_')
+    if components[0] == 'viewport':
+      bench_dic.setdefault(bench, {})[config] = [components[1],
+                                                 [table.times[i]]]
+    else:  # Stores per-tile benches.
+      bench_dic.setdefault(bench, {})[config] = [
+        table.tile_layout(i), table.per_tile_values(i)]
   benches = bench_dic.keys()
   benches.sort()
   for bench in benches:
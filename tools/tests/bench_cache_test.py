@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Tests for bench/bench_cache.py.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'bench'))
+import bench_cache
+
+
+class RevisionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.bench_dir = os.path.join(self.temp_dir, 'bench')
+        self.store_dir = os.path.join(self.temp_dir, 'store')
+        os.mkdir(self.bench_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def add_bench_file(self, name, age):
+        """Adds an empty bench file and dates the directory age seconds back,
+        so the store trusts its listing."""
+        open(os.path.join(self.bench_dir, name), 'w').close()
+        then = time.time() - age
+        os.utime(self.bench_dir, (then, then))
+
+    def open_store(self):
+        store = bench_cache.RevisionStore(self.bench_dir, self.store_dir)
+        store.refresh()
+        return store
+
+    def test_files_listed_across_runs(self):
+        self.add_bench_file('bench_r7671_data', 100)
+        self.open_store()
+        self.add_bench_file('bench_r7672_data', 50)
+        self.open_store()
+        self.assertEqual(
+            {'bench_r7671_data': (7671, 'data'),
+             'bench_r7672_data': (7672, 'data')},
+            self.open_store().files)
+
+    def test_append_after_torn_tail(self):
+        self.add_bench_file('bench_r7671_data', 100)
+        self.open_store()
+        # Cut the last record short, as an interrupted write would.
+        index_path = os.path.join(self.store_dir, bench_cache.STORE_INDEX)
+        index = open(index_path, 'rb').read()
+        open(index_path, 'wb').write(index[:-4])
+
+        self.add_bench_file('bench_r7672_data', 50)
+        self.open_store()
+        store = bench_cache.RevisionStore(self.bench_dir, self.store_dir)
+        self.assertEqual(
+            {'bench_r7671_data': (7671, 'data'),
+             'bench_r7672_data': (7672, 'data')},
+            store.files)
+        self.assertEqual(repr(os.stat(self.bench_dir).st_mtime),
+                         store.directory_mtime)
+
+    def test_torn_file_record_is_skipped(self):
+        self.add_bench_file('bench_r7671_data', 100)
+        self.open_store()
+        # A file record torn within its scalar type, then terminated.
+        index_path = os.path.join(self.store_dir, bench_cache.STORE_INDEX)
+        index_file = open(index_path, 'ab')
+        index_file.write('F\tbench_r7672_data\t7672\tda\n')
+        index_file.close()
+        self.assertEqual({'bench_r7671_data': (7671, 'data')},
+                         bench_cache.RevisionStore(self.bench_dir,
+                                                   self.store_dir).files)
+
+    def run_store(self, now, max_bytes, read=(), write=()):
+        """Runs a store at time now that reads and writes the named files'
+        results, then trims it."""
+        store = bench_cache.RevisionStore(self.bench_dir, self.store_dir,
+                                          max_bytes)
+        store.now = now
+        for name in read:
+            self.assertEqual(name, store.get(
+                os.path.join(self.bench_dir, name), 'extra'))
+        for name in write:
+            self.add_bench_file(name, 100)
+            store.put(os.path.join(self.bench_dir, name), 'extra', name)
+        store.trim()
+        return store
+
+    def test_trim_keeps_most_recently_used(self):
+        day = 24 * 3600
+        max_bytes = 1 << 20
+        self.run_store(1 * day, max_bytes,
+                       write=['bench_r1_data', 'bench_r2_data'])
+        self.run_store(2 * day, max_bytes, write=['bench_r3_data'])
+        data_path = os.path.join(self.store_dir, bench_cache.STORE_DATA)
+        size = os.path.getsize(data_path)
+        # Room for two results once trimmed to TRIM_FRACTION.
+        max_bytes = int(size * 0.7 / bench_cache.TRIM_FRACTION)
+        self.run_store(3 * day, max_bytes, read=['bench_r1_data'])
+
+        self.assertTrue(os.path.getsize(data_path) < size)
+        self.assertTrue(os.path.getsize(data_path) <= max_bytes)
+        store = bench_cache.RevisionStore(self.bench_dir, self.store_dir)
+        self.assertEqual(['bench_r1_data', 'bench_r3_data'],
+                         sorted(key[0] for key in store.entries))
+        self.assertEqual('bench_r1_data', store.get(
+            os.path.join(self.bench_dir, 'bench_r1_data'), 'extra'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Tests for bench/bench_compare.py.
+"""
+
+import cStringIO
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'bench'))
+import bench_compare
+import bench_util
+
+OLD_LINES = [
+    'running bench [640 480] bitmap_0   8888: msecs = 10.00   '
+    '565: msecs = 9.00\n',
+    'running bench [640 480] bitmap_1   8888: msecs = 5.00, 6.00\n',
+    'running bench [1024 768]  desk_a.skp\n',
+    '  tile_256x256: tile [0,0] out of [2,1] <averaged>: msecs = 1.00, 2.00\n',
+    '  tile_256x256: tile [1,0] out of [2,1] <averaged>: msecs = 3.00, 4.00\n',
+    'running bench [640 480] old_only   8888: msecs = 1.00\n',
+]
+
+NEW_LINES = [
+    'running bench [640 480] new_only   8888: msecs = 2.00\n',
+    'running bench [640 480] bitmap_0   8888: msecs = 11.00\n',
+    'running bench [1024 768]  desk_a.skp\n',
+    '  tile_256x256: tile [0,0] out of [2,1] <averaged>: msecs = 1.50, 2.00\n',
+    '  tile_256x256: tile [1,0] out of [2,1] <averaged>: msecs = 3.00, 4.00\n',
+    'running bench [640 480] bitmap_1   8888: msecs = 4.00, 4.00\n',
+]
+
+
+def capture_stdout(function, *args):
+    """Returns what function writes to stdout when called with args."""
+    stdout = sys.stdout
+    sys.stdout = cStringIO.StringIO()
+    try:
+        function(*args)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def keys(points):
+    return [bench_compare.bench_key(point) for point in points]
+
+
+def diff_fields(bench_diffs):
+    return sorted((bench_compare.bench_key(bench_diff.old),
+                   bench_diff.old.time, bench_diff.new.time)
+                  for bench_diff in bench_diffs)
+
+
+class CompareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.old = self.write('old', OLD_LINES)
+        self.new = self.write('new', NEW_LINES)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, name, lines):
+        path = os.path.join(self.temp_dir, name)
+        open(path, 'w').write(''.join(lines))
+        return path
+
+    def run_main(self, *args):
+        argv = sys.argv
+        sys.argv = ['bench_compare.py'] + list(args)
+        try:
+            return capture_stdout(bench_compare.main)
+        finally:
+            sys.argv = argv
+
+    def test_keys_in_one_file_only(self):
+        bench_diffs, old_only, new_only = bench_compare.join_benches(
+            bench_util.parse({}, OLD_LINES), bench_util.parse({}, NEW_LINES))
+        self.assertEqual(
+            [(('bitmap_0', '8888', ''), 10.0, 11.0),
+             (('bitmap_1', '8888', ''), 5.5, 4.0),
+             (('desk_a.skp', 'tile_256x256', ''), 5.0, 5.25)],
+            diff_fields(bench_diffs))
+        self.assertEqual([('bitmap_0', '565', ''), ('old_only', '8888', '')],
+                         keys(old_only))
+        self.assertEqual([('new_only', '8888', '')], keys(new_only))
+
+        output = self.run_main('-o', self.old, '-n', self.new, '-t')
+        self.assertTrue(output.endswith(
+            '\nOnly in old file:\nbitmap_0\t565\t\nold_only\t8888\t\n'
+            '\nOnly in new file:\nnew_only\t8888\t\n'))
+
+    def test_stream_matches_join(self):
+        expected = bench_compare.join_benches(
+            bench_util.parse({}, OLD_LINES), bench_util.parse({}, NEW_LINES))
+        # A run of a single point per spill, a few runs, and none at all.
+        for memory_points in (1, 2, bench_compare.STREAM_MEMORY_POINTS):
+            bench_diffs, old_only, new_only = bench_compare.stream_benches(
+                self.old, self.new, 'avg', memory_points=memory_points)
+            self.assertEqual(diff_fields(expected[0]),
+                             diff_fields(bench_diffs))
+            self.assertEqual(keys(expected[1]), keys(old_only))
+            self.assertEqual(keys(expected[2]), keys(new_only))
+
+    def test_stream_output_matches_join_output(self):
+        expected = self.run_main('-o', self.old, '-n', self.new, '-t', '-h')
+        for memory_points in ('1', '3'):
+            output = self.run_main('-o', self.old, '-n', self.new, '-t', '-h',
+                                   '--stream', '--memory-points',
+                                   memory_points)
+            expected_diffs, expected_only = expected.split('\n\n', 1)
+            diffs, only = output.split('\n\n', 1)
+            # Streamed diffs come by bench rather than by percent diff.
+            self.assertEqual(sorted(expected_diffs.split('\n')),
+                             sorted(diffs.split('\n')))
+            self.assertEqual(expected_only, only)
+
+    def test_stream_match_bench(self):
+        bench_diffs, old_only, new_only = bench_compare.stream_benches(
+            self.old, self.new, 'avg', 'bitmap_0', memory_points=1)
+        self.assertEqual([(('bitmap_0', '8888', ''), 10.0, 11.0)],
+                         diff_fields(bench_diffs))
+        self.assertEqual([('bitmap_0', '565', '')], keys(old_only))
+        self.assertEqual([], keys(new_only))
+
+
+class MatrixTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.paths = []
+        for name, lines in (('run_1', OLD_LINES[:2]),
+                            ('run_2', NEW_LINES[1:2] + NEW_LINES[5:])):
+            path = os.path.join(self.temp_dir, name)
+            open(path, 'w').write(''.join(lines))
+            self.paths.append(path)
+        self.keys, self.rows = bench_compare.compare_runs(self.paths, 'avg')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def output(self, output_format):
+        return capture_stdout(bench_compare.output_matrix, self.paths,
+                              self.keys, self.rows, True, output_format)
+
+    def test_runs_are_lined_up(self):
+        self.assertEqual([('bitmap_0', '565', ''), ('bitmap_0', '8888', ''),
+                          ('bitmap_1', '8888', '')], self.keys)
+        self.assertEqual([[9.0, None], [10.0, 11.0], [5.5, 4.0]], self.rows)
+        self.assertEqual(([('bitmap_1', '8888', '')], [[5.5, 4.0]]),
+                         bench_compare.compare_runs(self.paths, 'avg',
+                                                    'bitmap_1'))
+
+    def test_csv(self):
+        self.assertEqual(
+            'bench,conf,time,run_1,run_2,mean,stddev,cv,min,max\n'
+            'bitmap_0,565,,9.00,,9.0000,0.0000,0.0000,9.0000,9.0000\n'
+            'bitmap_0,8888,,10.00,11.00,10.5000,0.7071,0.0673,10.0000,'
+            '11.0000\n'
+            'bitmap_1,8888,,5.50,4.00,4.7500,1.0607,0.2233,4.0000,5.5000\n',
+            self.output('csv'))
+
+    def test_json(self):
+        matrix = json.loads(self.output('json'))
+        self.assertEqual(self.paths, matrix['runs'])
+        self.assertEqual(3, len(matrix['benches']))
+        bench = matrix['benches'][1]
+        self.assertEqual(['bitmap_0', '8888', '', [10.0, 11.0], 10.5, 10.0,
+                          11.0],
+                         [bench['bench'], bench['config'], bench['time_type'],
+                          bench['times'], bench['mean'], bench['min'],
+                          bench['max']])
+        self.assertAlmostEqual(0.7071068, bench['stddev'])
+        self.assertAlmostEqual(0.0673435, bench['cv'])
+        self.assertEqual([9.0, None], matrix['benches'][0]['times'])
+
+    def test_tabs(self):
+        self.assertEqual(
+            'bench\tconf\ttime\trun_1\trun_2\tmean\tstddev\tcv\tmin\tmax\t\n'
+            'bitmap_0\t565\t\t 9.00\t\t 9.00\t 0.00\t 0.0%\t 9.00\t 9.00\t\n'
+            'bitmap_0\t8888\t\t 10.00\t 11.00\t 10.50\t 0.71\t 6.7%\t 10.00\t'
+            ' 11.00\t\n'
+            'bitmap_1\t8888\t\t 5.50\t 4.00\t 4.75\t 1.06\t 22.3%\t 4.00\t'
+            ' 5.50\t\n',
+            self.output('tabs'))
+
+
+def tiled_bench(first_tile, second_tile):
+    return [
+        'running bench [1024 768]  desk_a.skp\n',
+        '  tile_256x256: tile [0,0] out of [2,1] <averaged>: msecs = %s\n' %
+        ', '.join(['%.2f' % first_tile] * 10),
+        '  tile_256x256: tile [1,0] out of [2,1] <averaged>: msecs = %s\n' %
+        ', '.join(['%.2f' % second_tile] * 10),
+    ]
+
+
+class SignificanceTest(unittest.TestCase):
+
+    def test_tiles_are_summed_per_iteration(self):
+        # Every iteration of the whole picture is slower in new, which
+        # pooling the iterations of both tiles would blur.
+        samples = bench_util.SampleBuffer()
+        old, = bench_util.parse({}, tiled_bench(1.0, 100.0), None, samples)
+        new, = bench_util.parse({}, tiled_bench(1.5, 100.0), None, samples)
+        self.assertEqual([101.0] * 10, bench_compare.summed_iterations(old))
+        bench_diff = bench_compare.BenchDiff(old, new)
+        _, pvalue = bench_util.MannWhitneyU([101.0] * 10, [101.5] * 10)
+        self.assertEqual(pvalue, bench_diff.pvalue)
+        self.assertTrue(bench_diff.pvalue < bench_compare.SIGNIFICANCE_LEVEL)
+        _, pooled_pvalue = bench_util.MannWhitneyU(old.iterations(),
+                                                   new.iterations())
+        self.assertTrue(pooled_pvalue > bench_compare.SIGNIFICANCE_LEVEL)
+
+    def test_no_pvalue_without_iterations(self):
+        old, = bench_util.parse({}, tiled_bench(1.0, 100.0))
+        new, = bench_util.parse({}, tiled_bench(1.5, 100.0))
+        self.assertEqual(None, bench_compare.summed_iterations(old))
+        self.assertEqual(None, bench_compare.BenchDiff(old, new).pvalue)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Tests for bench/bench_dashboard.py.
+"""
+
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'bench'))
+import bench_dashboard
+import bench_graph_svg
+import bench_util
+
+
+def label(bench, config):
+    return bench_graph_svg.Label(bench, config, '', {'scale': '0'})
+
+
+class WriteDashboardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.temp_dir, 'dashboard')
+        self.rising = label('desk_a.skp', '8888')
+        self.flat = label('desk_a.skp', '565')
+        self.other = label('bitmap_0', 'GPU')
+        self.lines = {
+            self.rising: [(7000 + i, 10.0 + i) for i in xrange(10)],
+            self.flat: [(7000 + i, 5.0 + i % 2 * 0.0001) for i in xrange(10)],
+            self.other: [(7000, 1.23456), (7009, 2.0)],
+        }
+        self.regressions = dict(
+            (label, bench_util.LinearRegression(line))
+            for label, line in self.lines.iteritems() if len(line) > 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, title='Nexus10 <float>', max_points=None):
+        bench_dashboard.write_dashboard(
+            self.directory, self.lines, self.regressions, 7000, 7009, title,
+            3, max_points, bench_graph_svg.regression_shading(self.regressions))
+        return json.load(open(os.path.join(self.directory,
+                                           bench_dashboard.INDEX_FILE)))
+
+    def shard(self, index, bench):
+        entry, = [entry for entry in index['benches']
+                  if entry['bench'] == bench]
+        return json.loads(gzip.open(os.path.join(self.directory,
+                                                 entry['shard'])).read())
+
+    def test_index(self):
+        index = self.write()
+        self.assertEqual(
+            ['Nexus10 <float>', 7000, 7009, 3],
+            [index['title'], index['oldest_revision'],
+             index['newest_revision'], index['ignored_points']])
+        self.assertEqual(
+            [('bitmap_0', 1, ['GPU'], ['']),
+             ('desk_a.skp', 2, ['565', '8888'], [''])],
+            [(entry['bench'], entry['lines'], entry['configs'],
+              entry['time_types']) for entry in index['benches']])
+        shard_files = sorted(entry['shard'] for entry in index['benches'])
+        self.assertEqual(
+            sorted(shard_files + [bench_dashboard.INDEX_FILE,
+                                  bench_dashboard.SHELL_FILE]),
+            sorted(os.listdir(self.directory)))
+        shell = open(os.path.join(self.directory,
+                                  bench_dashboard.SHELL_FILE)).read()
+        self.assertTrue('<title>Nexus10 &lt;float&gt;</title>' in shell)
+
+    def test_shards(self):
+        index = self.write()
+        shard = self.shard(index, 'desk_a.skp')
+        self.assertEqual('desk_a.skp', shard['bench'])
+        rising, = [line for line in shard['lines']
+                   if line['id'] == str(self.rising)]
+        self.assertEqual([[7000 + i, 10.0 + i] for i in xrange(10)],
+                         rising['points'])
+        self.assertEqual([7000, 10.0, 7009, 19.0, 0.0], rising['regression'])
+        # The line going up is shaded red, as in the xhtml graph.
+        r, g, b, opacity = bench_graph_svg.regression_shading(
+            self.regressions)[self.rising]
+        self.assertTrue(r > g == b)
+        self.assertEqual('rgb(%d,%d,%d)' % (r, g, b), rising['color'])
+        self.assertEqual(round(opacity, 3), rising['opacity'])
+        flat, = [line for line in shard['lines']
+                 if line['id'] == str(self.flat)]
+        self.assertEqual('rgb(128,128,128)', flat['color'])
+        self.assertEqual(0.1, flat['opacity'])
+
+        other, = self.shard(index, 'bitmap_0')['lines']
+        self.assertEqual([[7000, 1.235], [7009, 2.0]], other['points'])
+        self.assertEqual(None, other['regression'])
+        self.assertEqual('rgb(128,128,128)', other['color'])
+        self.assertEqual(0.1, other['opacity'])
+
+    def test_max_points(self):
+        index = self.write(max_points=4)
+        rising, = [line for line in self.shard(index, 'desk_a.skp')['lines']
+                   if line['id'] == str(self.rising)]
+        self.assertEqual(4, len(rising['points']))
+        self.assertEqual([7000, 10.0], rising['points'][0])
+        self.assertEqual([7009, 19.0], rising['points'][-1])
+
+    def test_unchanged_shards_are_kept_and_stale_ones_removed(self):
+        first = self.write()
+        self.lines[self.other] = [(7000, 1.0), (7009, 3.0)]
+        second = self.write()
+        self.assertEqual(first['benches'][1], second['benches'][1])
+        self.assertNotEqual(first['benches'][0]['shard'],
+                            second['benches'][0]['shard'])
+        self.assertFalse(os.path.exists(os.path.join(
+            self.directory, first['benches'][0]['shard'])))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.directory, second['benches'][0]['shard'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Tests for bench/bench_expectations.py.
+"""
+
+import hashlib
+import marshal
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'bench'))
+import bench_expectations
+
+EXPECTATIONS = '''# comment
+desk_amazon.skp_1024_768_8888_,skp-Nexus10-float,20.5,18.0,23.0
+desk_*_8888_,skp-*,10.0,9.0,11.0
+'''
+
+
+class LoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, 'expectations.txt')
+        open(self.filename, 'w').write(EXPECTATIONS)
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def index_path(self):
+        return os.path.join(self.cache_dir, '%s.v%d' % (
+            hashlib.sha1(EXPECTATIONS).hexdigest(),
+            bench_expectations.INDEX_VERSION))
+
+    def test_cached_index_matches_parsed_one(self):
+        parsed = bench_expectations.load(self.filename, None)
+        bench_expectations.load(self.filename, self.cache_dir)
+        self.assertTrue(os.path.exists(self.index_path()))
+        self.assertEqual(0700, os.stat(self.cache_dir).st_mode & 0777)
+        cached = bench_expectations.load(self.filename, self.cache_dir)
+        self.assertEqual(parsed.exact, cached.exact)
+        self.assertEqual(parsed.patterns, cached.patterns)
+        self.assertEqual((9.0, 11.0),
+                         cached.lookup('desk_ebay.skp_1024_768_8888_',
+                                       'skp-Nexus10-float'))
+
+    def test_cache_writable_by_others_is_not_read(self):
+        os.mkdir(self.cache_dir)
+        os.chmod(self.cache_dir, 0777)
+        # A planted index claiming a different range.
+        marshal.dump(
+            ({('desk_amazon.skp_1024_768_8888_', 'skp-Nexus10-float'):
+              (0.0, 1.0)}, []), open(self.index_path(), 'wb'))
+        index = bench_expectations.load(self.filename, self.cache_dir)
+        self.assertEqual((18.0, 23.0),
+                         index.lookup('desk_amazon.skp_1024_768_8888_',
+                                      'skp-Nexus10-float'))
+
+
+class MergeTest(unittest.TestCase):
+
+    def test_merge_adds_ranges_and_rejects_duplicates(self):
+        index = bench_expectations.parse(EXPECTATIONS.splitlines())
+        other = bench_expectations.parse(['desk_ebay.skp_1024_768_8888_,'
+                                          'skp-Nexus10-float,5.0,4.0,6.0'])
+        index.merge(other)
+        self.assertEqual((4.0, 6.0),
+                         index.lookup('desk_ebay.skp_1024_768_8888_',
+                                      'skp-Nexus10-float'))
+        self.assertEqual(3, len(index))
+        self.assertRaises(Exception, index.merge, other)
+        pattern = bench_expectations.parse(['desk_*_8888_,skp-*,1,0,2'])
+        self.assertRaises(Exception, index.merge, pattern)
+
+
+if __name__ == '__main__':
+    unittest.main()
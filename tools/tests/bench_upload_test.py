@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Tests for bench/bench_upload.py, against a local HTTP server.
+"""
+
+import BaseHTTPServer
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'bench'))
+import bench_upload
+
+
+class DashboardHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers each POST with the next of the server's statuses, or 200 once
+    they run out, and records the payloads posted."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        server.payloads.append(
+            json.loads(urlparse.parse_qs(body)['data'][0]))
+        status = 200
+        if server.statuses:
+            status = server.statuses.pop(0)
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def payload(test, benches, revision=7672):
+    return {'master': 'Skia', 'bot': 'Nexus10', 'test': test,
+            'revision': revision, 'benches': benches}
+
+
+class UploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                DashboardHandler)
+        self.server.statuses = []
+        self.server.payloads = []
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/add_point' % self.server.server_port
+        self.delays = []
+        self.temp_dir = tempfile.mkdtemp()
+        self.spool_path = os.path.join(self.temp_dir, 'spool')
+        # Failures are reported on stderr; keep the test output clean.
+        self.stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stderr.close()
+        sys.stderr = self.stderr
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def uploader(self, retries=bench_upload.DEFAULT_RETRIES):
+        return bench_upload.Uploader(self.url, workers=1, timeout=5,
+                                     retries=retries, backoff=1.0,
+                                     sleep=self.delays.append)
+
+    def test_retries_server_errors(self):
+        self.server.statuses = [503, 500]
+        failed = self.uploader().upload([payload('8888', 'desk_a:1.00')])
+        self.assertEqual([], failed)
+        self.assertEqual(3, len(self.server.payloads))
+        self.assertEqual(2, len(self.delays))
+
+    def test_backs_off_exponentially(self):
+        self.server.statuses = [503] * 4
+        failed = self.uploader(retries=3).upload(
+            [payload('8888', 'desk_a:1.00')])
+        self.assertEqual([payload('8888', 'desk_a:1.00')], failed)
+        self.assertEqual(3, len(self.delays))
+        for attempt, delay in enumerate(self.delays):
+            self.assertTrue(0.5 * 2 ** attempt <= delay <= 2 ** attempt)
+
+    def test_does_not_retry_rejected_payloads(self):
+        self.server.statuses = [400]
+        failed = self.uploader().upload([payload('8888', 'desk_a:1.00')])
+        self.assertEqual([], failed)
+        self.assertEqual(1, len(self.server.payloads))
+        self.assertEqual([], self.delays)
+
+    def test_batches_payloads_of_one_config(self):
+        self.uploader().upload([payload('8888', 'desk_a:1.00'),
+                                payload('8888', 'desk_b:2.00'),
+                                payload('GPU', 'desk_a:3.00')])
+        self.assertEqual(
+            sorted([payload('8888', 'desk_a:1.00,desk_b:2.00'),
+                    payload('GPU', 'desk_a:3.00')]),
+            sorted(self.server.payloads))
+
+    def test_spool_round_trip(self):
+        payloads = [payload('8888', 'desk_a:1.00'),
+                    payload('GPU', 'desk_b:2.00', 7671)]
+        bench_upload.write_spool(self.spool_path, payloads)
+        self.assertEqual(payloads, bench_upload.read_spool(self.spool_path))
+        # A line cut short by a crash is skipped.
+        spool = open(self.spool_path, 'a')
+        spool.write('{"master": "Sk')
+        spool.close()
+        self.assertEqual(payloads, bench_upload.read_spool(self.spool_path))
+        bench_upload.write_spool(self.spool_path, [])
+        self.assertFalse(os.path.exists(self.spool_path))
+
+    def test_upload_with_spool(self):
+        old = payload('8888', 'desk_a:1.00', 7671)
+        self.server.statuses = [503] * 2
+        self.assertEqual(1, bench_upload.upload_with_spool(
+            self.uploader(retries=1), [old], self.spool_path))
+        self.assertEqual([old], bench_upload.read_spool(self.spool_path))
+
+        new = payload('8888', 'desk_a:1.50')
+        self.server.payloads = []
+        self.assertEqual(0, bench_upload.upload_with_spool(
+            self.uploader(), [new], self.spool_path))
+        self.assertEqual([old, new], self.server.payloads)
+        self.assertFalse(os.path.exists(self.spool_path))
+
+    def test_recomputed_payload_replaces_spooled_one(self):
+        old = payload('8888', 'desk_a:1.00')
+        other = payload('GPU', 'desk_a:3.00')
+        bench_upload.write_spool(self.spool_path, [old, other])
+        new = payload('8888', 'desk_a:1.50')
+        self.assertEqual(0, bench_upload.upload_with_spool(
+            self.uploader(), [new], self.spool_path))
+        self.assertEqual([other, new], self.server.payloads)
+
+
+class BatchPayloadsTest(unittest.TestCase):
+
+    def test_splits_at_max_bytes(self):
+        benches = ['desk_%d:%d.00' % (i, i) for i in xrange(200)]
+        payloads = [payload('8888', bench) for bench in benches]
+        max_bytes = 600
+        batched = bench_upload.batch_payloads(payloads, max_bytes)
+        self.assertTrue(1 < len(batched) < len(payloads))
+        for part in batched:
+            self.assertTrue(len(bench_upload.encode(part)) <= max_bytes)
+        self.assertEqual(','.join(benches),
+                         ','.join(part['benches'] for part in batched))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Tests for bench/bench_util.py.
+"""
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'bench'))
+import bench_graph_svg
+import bench_util
+
+BENCH_LINES = [
+    'skia bench: alpha=0xFF scale=0\n',
+    'running bench [640 480]   bitmap_0   8888: msecs = 70.48  '
+    'cmsecs = 52.80   565: msecs = 68.94  cmsecs = 60.52\n',
+    'running bench [1024 768]  desk_a.skp\n',
+    '  tile_256x256: tile [0,0] out of [2,1] <averaged>: msecs = 1.00, 2.00\n',
+    '  tile_256x256: tile [1,0] out of [2,1] <averaged>: msecs = 3.50, 4.50 '
+    'cmsecs = 1.25\n',
+    '  simple_viewport_1024x768: cmsecs = 1.50, 1.20  msecs = 20.00, 21.00\n',
+]
+
+
+def point_fields(points):
+    return [(point.bench, point.config, point.time_type, point.time,
+             point.tile_layout, list(point.per_tile_values))
+            for point in points]
+
+
+class ParseTableTest(unittest.TestCase):
+
+    def test_rows_match_parse(self):
+        rep = bench_util.ALGORITHM_25TH_PERCENTILE
+        points = bench_util.parse({}, BENCH_LINES, rep)
+        table = bench_util.parse_table({}, BENCH_LINES, rep, revision=7)
+        self.assertEqual(point_fields(points),
+                         point_fields([table.point(i)
+                                       for i in xrange(len(table))]))
+        self.assertEqual([7] * len(points), list(table.revisions))
+
+    def test_create_lines_agrees_with_points(self):
+        revision_data_points = {}
+        table = bench_util.BenchTable()
+        for revision in (1, 2):
+            revision_data_points[revision] = bench_util.parse(
+                {}, BENCH_LINES)
+            bench_util.parse_table({}, BENCH_LINES, table=table,
+                                   revision=revision)
+        for filters in [(None, None, None, None),
+                        (None, None, None, 'c'),
+                        (None, None, 'c', None),
+                        (None, None, 'c', 'c'),
+                        ('desk_a.skp', 'tile_256x256', None, None)]:
+            from_points = bench_graph_svg.create_lines(
+                revision_data_points, {'scale': '0'}, *filters)
+            from_table = bench_graph_svg.create_lines(
+                table, {'scale': '0'}, *filters)
+            self.assertEqual(
+                sorted((str(label), line)
+                       for label, line in from_points.iteritems()),
+                sorted((str(label), line)
+                       for label, line in from_table.iteritems()))
+
+
+class IterParseTest(unittest.TestCase):
+
+    REPEATED_BENCH_LINES = [
+        'running bench [640 480] bitmap_0   8888: msecs = 10.00\n',
+        'running bench [640 480] bitmap_1   8888: msecs = 5.00\n',
+        'running bench [640 480] bitmap_0   8888: msecs = 12.00\n',
+    ]
+
+    def test_yields_points_of_parse(self):
+        self.assertEqual(
+            sorted(point_fields(bench_util.parse({}, BENCH_LINES))),
+            sorted(point_fields(bench_util.iter_parse({}, BENCH_LINES))))
+
+    def test_repeated_bench_is_not_merged(self):
+        # Each run of bitmap_0 is a point of its own, in input order.
+        self.assertEqual(
+            [('bitmap_0', '8888', '', 10.0, '', []),
+             ('bitmap_1', '8888', '', 5.0, '', []),
+             ('bitmap_0', '8888', '', 12.0, '', [])],
+            point_fields(bench_util.iter_parse({},
+                                               self.REPEATED_BENCH_LINES)))
+        # whereas parse() sums them into one.
+        self.assertEqual(
+            [('bitmap_0', '8888', '', 22.0, '', [10.0, 12.0]),
+             ('bitmap_1', '8888', '', 5.0, '', [])],
+            sorted(point_fields(bench_util.parse({},
+                                                 self.REPEATED_BENCH_LINES))))
+
+
+class RegressionAccumulatorTest(unittest.TestCase):
+
+    def test_extremes_of_sliding_window(self):
+        accumulator = bench_util.RegressionAccumulator()
+        window = 10
+        for x in xrange(100):
+            accumulator.add(x, x * 0.5)
+            if x >= window:
+                accumulator.remove(x - window, (x - window) * 0.5)
+            self.assertEqual(max(0, x - window + 1), accumulator.min_x())
+            self.assertEqual(x, accumulator.max_x())
+        self.assertTrue(len(accumulator._max_heap) <= 2 * window + 16)
+
+    def test_extremes_after_readding(self):
+        accumulator = bench_util.RegressionAccumulator([(1, 0), (5, 0)])
+        accumulator.remove(1, 0)
+        accumulator.remove(5, 0)
+        self.assertEqual(bench_util.Max, accumulator.min_x())
+        self.assertEqual(bench_util.Min, accumulator.max_x())
+        accumulator.add(3, 0)
+        accumulator.merge(bench_util.RegressionAccumulator([(1, 0), (2, 0)]))
+        self.assertEqual(1, accumulator.min_x())
+        self.assertEqual(3, accumulator.max_x())
+
+
+def brute_force_slope(points):
+    """The median of the slopes between all pairs of points with different
+    x, or 0.0 if there are none."""
+    slopes = sorted((y2 - y1) / float(x2 - x1)
+                    for i, (x1, y1) in enumerate(points)
+                    for x2, y2 in points[i + 1:] if x1 != x2)
+    if not slopes:
+        return 0.0
+    middle = len(slopes) // 2
+    if len(slopes) % 2:
+        return slopes[middle]
+    return (slopes[middle - 1] + slopes[middle]) / 2.0
+
+
+class TheilSenRegressionTest(unittest.TestCase):
+
+    def test_slope_is_median_of_pairwise_slopes(self):
+        generator = random.Random(4)
+        # Up to 200 points, past THEIL_SEN_DIRECT_PAIRS slopes.
+        for case in xrange(60):
+            n = generator.randint(2, 200)
+            x_range = generator.choice([3, 20, 1000])
+            if case % 2:
+                # Few distinct values, so that many slopes tie.
+                points = [(generator.randint(0, x_range),
+                           float(generator.randint(0, 5)))
+                          for _ in xrange(n)]
+            else:
+                points = [(generator.randint(0, x_range),
+                           generator.gauss(0.01 * case, 1.0))
+                          for _ in xrange(n)]
+            regression = bench_util.TheilSenRegression(points)
+            self.assertEqual(brute_force_slope(points), regression.slope)
+
+    def test_equal_x_only(self):
+        regression = bench_util.TheilSenRegression([(5, 1.0), (5, 3.0),
+                                                    (5, 2.0)])
+        self.assertEqual(0.0, regression.slope)
+        self.assertEqual(2.0, regression.intercept)
+
+    def test_outlier_barely_moves_line(self):
+        points = [(x, 2.0 * x + 1.0) for x in xrange(20)]
+        points[7] = (7, 1000.0)
+        regression = bench_util.TheilSenRegression(points)
+        self.assertEqual(2.0, regression.slope)
+        self.assertEqual(1.0, regression.intercept)
+
+
+def regression_fields(regression):
+    if regression is None:
+        return None
+    return tuple(repr(value) for value in (
+        regression.slope, regression.intercept, regression.serror,
+        regression.serror_slope, regression.serror_intercept,
+        regression.min_x, regression.max_x))
+
+
+class FitLinearRegressionsTest(unittest.TestCase):
+
+    @unittest.skipIf(bench_util.numpy is None, 'needs numpy')
+    def test_batch_fit_is_identical_to_linear_regression(self):
+        generator = random.Random(2)
+        point_lists = []
+        for _ in xrange(200):
+            length = generator.choice([0, 1, 2, 3, 10, 40])
+            start = generator.randint(7000, 7100)
+            point_lists.append([
+                (start + generator.randint(0, 3) * i,
+                 generator.uniform(0.1, 100.0)) for i in xrange(length)])
+        # Equal x only, so the slope's denominator is zero.
+        point_lists.append([(7050, 1.0), (7050, 2.0), (7050, 4.0)])
+        self.assertTrue(sum(len(points) for points in point_lists) >=
+                        bench_util.NUMPY_MIN_REGRESSION_POINTS)
+        for min_x, max_x in [(None, None), (7020, None), (7040, 7150)]:
+            expected = []
+            for points in point_lists:
+                points = [p for p in points
+                          if (min_x is None or min_x <= p[0]) and
+                             (max_x is None or p[0] <= max_x)]
+                if len(points) < 2:
+                    expected.append(None)
+                else:
+                    expected.append(bench_util.LinearRegression(points))
+            self.assertEqual(
+                map(regression_fields, expected),
+                map(regression_fields, bench_util.FitLinearRegressions(
+                    point_lists, min_x, max_x)))
+
+
+class FindChangePointsTest(unittest.TestCase):
+
+    def test_step_is_found(self):
+        generator = random.Random(3)
+        values = ([10.0 + generator.gauss(0, 0.1) for _ in xrange(30)] +
+                  [20.0 + generator.gauss(0, 0.1) for _ in xrange(25)])
+        change_points = bench_util.FindChangePoints(values)
+        self.assertEqual([30], change_points)
+        medians = bench_util.SegmentMedians(values, change_points)
+        self.assertAlmostEqual(10.0, medians[0], 0)
+        self.assertAlmostEqual(20.0, medians[1], 0)
+
+    def test_noise_and_spike_are_not_change_points(self):
+        generator = random.Random(5)
+        values = [10.0 + generator.gauss(0, 0.1) for _ in xrange(50)]
+        values[20] = 100.0
+        self.assertEqual([], bench_util.FindChangePoints(values))
+
+
+class FindOutliersTest(unittest.TestCase):
+
+    def test_spike_is_flagged(self):
+        values = [10.0, 10.2, 9.9, 10.1] * 5
+        values[9] = 100.0
+        self.assertEqual([9], bench_util.FindOutliers(values))
+
+    def test_level_shift_is_kept(self):
+        values = [10.0, 10.2, 9.9, 10.1] * 3 + [20.0, 20.2, 19.9, 20.1] * 3
+        self.assertEqual([], bench_util.FindOutliers(values))
+
+    def test_filter_outliers_keeps_newest_point(self):
+        label = bench_graph_svg.Label('desk_a.skp', '8888', '', {})
+        line = [(7000 + i, time)
+                for i, time in enumerate([10.0, 10.2, 9.9, 10.1] * 5)]
+        line[9] = (7009, 100.0)
+        line[-1] = (7019, 100.0)
+        self.assertEqual([9, 19], bench_util.FindOutliers(
+            [time for _, time in line]))
+        lines = {label: list(line)}
+        ignored = {}
+        self.assertEqual(1, bench_graph_svg.filter_outliers(lines, ignored))
+        self.assertEqual(line[:9] + line[10:], lines[label])
+        self.assertEqual([7009], ignored.keys())
+        self.assertEqual(100.0, ignored[7009][0].time)
+
+
+class LargestTriangleThreeBucketsTest(unittest.TestCase):
+
+    def test_keeps_endpoints_and_count(self):
+        generator = random.Random(6)
+        points = [(x, generator.uniform(0, 1)) for x in xrange(1000)]
+        points[500] = (500, 50.0)
+        for threshold in (3, 10, 101):
+            sampled = bench_util.LargestTriangleThreeBuckets(points,
+                                                             threshold)
+            self.assertEqual(threshold, len(sampled))
+            self.assertEqual(points[0], sampled[0])
+            self.assertEqual(points[-1], sampled[-1])
+            self.assertEqual(sorted(sampled), sampled)
+            self.assertTrue((500, 50.0) in sampled)
+
+    def test_small_inputs_are_kept(self):
+        points = [(x, x * 2.0) for x in xrange(10)]
+        self.assertTrue(
+            bench_util.LargestTriangleThreeBuckets(points, 10) is points)
+        self.assertTrue(
+            bench_util.LargestTriangleThreeBuckets(points, 2) is points)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Tests for bench/gen_bench_ranges.py.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'bench'))
+import bench_util
+import gen_bench_ranges
+
+PLATFORM = 'Perf-Android-Nexus7-Tegra3-Arm7-Release'
+
+# desk_a.skp and bitmap_0 run twice; gpu is filtered out.
+BENCH_LINES = [
+    'running bench [640 480] bitmap_0   8888: msecs = 10.00   gpu: '
+    'msecs = 1.00\n',
+    'running bench [1024 768]  desk_a.skp\n',
+    '  tile_256x256: tile [0,0] out of [2,1] <averaged>: msecs = 1.10, 2.00\n',
+    '  tile_256x256: tile [1,0] out of [2,1] <averaged>: msecs = 3.30, 4.00\n',
+    'running bench [640 480] bitmap_1   8888: msecs = 5.00\n',
+    'running bench [640 480] bitmap_0   8888: msecs = 12.00\n',
+    'running bench [1024 768]  desk_a.skp\n',
+    '  tile_256x256: tile [0,0] out of [2,1] <averaged>: msecs = 0.70, 2.00\n',
+    '  tile_256x256: tile [1,0] out of [2,1] <averaged>: msecs = 0.10, 4.00\n',
+]
+
+
+class BenchExpectationsTest(unittest.TestCase):
+
+    def test_repeated_benches_are_summed(self):
+        algs = ['avg', '25th']
+        expected = {}
+        for point in bench_util.parse('', BENCH_LINES, algs):
+            if point.config not in gen_bench_ranges.CONFIGS_TO_FILTER:
+                expected['%s_%s_%s,%s-%s' % (
+                    point.bench, point.config, point.time_type, PLATFORM,
+                    point.representation)] = point.time
+        expectations = gen_bench_ranges.BenchExpectations(BENCH_LINES,
+                                                          PLATFORM, algs)
+        self.assertEqual(expected, expectations)
+        self.assertEqual(22.0, expectations['bitmap_0_8888_,%s-avg' % PLATFORM])
+        self.assertEqual(6, len(expectations))
+
+
+if __name__ == '__main__':
+    unittest.main()
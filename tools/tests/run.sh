@@ -113,10 +113,10 @@ function benchgraph_test {
   ACTUAL_OUTPUT_DIR="$PLATFORM_DIR/output-actual"
   EXPECTED_OUTPUT_DIR="$PLATFORM_DIR/output-expected"
 
-  # Run bench_graph_svg.py .
+  # Run bench_graph_svg.py, without leaving a revision store in the tree.
   rm -rf $ACTUAL_OUTPUT_DIR
   mkdir -p $ACTUAL_OUTPUT_DIR
-  COMMAND="python bench/bench_graph_svg.py -d $RAW_BENCH_DATA_DIR -r -150 -f -150 -x 1024 -y 768 -l Title -m 25th -o $ACTUAL_OUTPUT_DIR/graph.xhtml"
+  COMMAND="python bench/bench_graph_svg.py -d $RAW_BENCH_DATA_DIR -r -150 -f -150 -x 1024 -y 768 -l Title -m 25th --no-cache -o $ACTUAL_OUTPUT_DIR/graph.xhtml"
   echo "$COMMAND" >$ACTUAL_OUTPUT_DIR/command_line
   START_TIMESTAMP=$(date +%s)
   $COMMAND &>$ACTUAL_OUTPUT_DIR/stdout
@@ -223,6 +223,23 @@ benchgraph_download_rawdata $PLATFORM 7679 "$BENCHDATA_FILE_SUFFIXES_YES_INDIVID
 benchgraph_download_rawdata $PLATFORM 7686 "$BENCHDATA_FILE_SUFFIXES_YES_INDIVIDUAL_TILES"
 benchgraph_test $PLATFORM
 
+#
+# Run unit tests of the bench scripts ...
+#
+
+for TEST in bench_cache_test bench_compare_test bench_dashboard_test \
+    bench_expectations_test bench_upload_test bench_util_test \
+    gen_bench_ranges_test; do
+  COMMAND="python tools/tests/$TEST.py"
+  echo "$COMMAND"
+  $COMMAND
+  ret=$?
+  if [ $ret -ne 0 ]; then
+      echo "$TEST failed."
+      exit 1
+  fi
+done
+
 #
 # Run self test for skimage ...
 #